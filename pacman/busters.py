@@ -29,6 +29,9 @@ from builtins import object
 from past.utils import old_div
 from game import GameStateData
 from game import Game
+from game import GameResult
+from game import GameProfile
+from game import writeProfiles
 from game import Directions
 from game import Actions
 from game import Configuration
@@ -90,7 +93,6 @@ class GameState(object):
     ####################################################
     # Accessor methods: use these to access state data #
     ####################################################
-    ghostDirections = {}
 
     def getLegalActions( self, agentIndex=0 ):
         """
@@ -111,8 +113,8 @@ class GameState(object):
         # Check that successors exist
         if self.isWin() or self.isLose(): raise Exception('Can\'t generate a successor of a terminal state.')
 
-        # Copy current state
-        state = GameState(self)
+        # Share the current state, copying only the agent that moves
+        state = self.shareSuccessor( agentIndex )
 
         # Let agent's logic deal with its action's effects on the board
         if agentIndex == 0:  # Pacman is moving
@@ -136,13 +138,7 @@ class GameState(object):
         # Book keeping
         state.data._agentMoved = agentIndex
         state.data.score += state.data.scoreChange
-        p = state.getPacmanPosition()
-        state.data.ghostDistances = [getNoisyDistance(p, state.getGhostPosition(i)) for i in range(1,state.getNumAgents())]
-        state.ghostPositions = self.ghostPositions = [self.getGhostPosition(i) for i in range(1, self.getNumAgents())]
-        a = 0
-        for i in range(1, self.getNumAgents()):
-            self.ghostDirections[a] = (state.data.agentStates[i].configuration.getDirection())
-            a += 1
+        state.updateGhostInfo( self, agentIndex )
         if agentIndex == self.getNumAgents() - 1:
             state.numMoves += 1
         return state
@@ -181,7 +177,7 @@ class GameState(object):
         return self.data.capsules
 
     def getNumFood( self ):
-        return self.data.food.count()
+        return len(self.data.getFoodIndex())
 
     def getFood(self):
         """
@@ -208,10 +204,10 @@ class GameState(object):
         return self.data.layout.walls
 
     def hasFood(self, x, y):
-        return self.data.food[x][y]
+        return self.data.food.get(x, y)
 
     def hasWall(self, x, y):
-        return self.data.layout.walls[x][y]
+        return self.data.layout.walls.get(x, y)
 
     ##############################
     # Additions for Busters Pacman #
@@ -229,20 +225,14 @@ class GameState(object):
         """
         Returns the distance to the nearest food
         """
-        if(self.getNumFood() > 0):
-            minDistance = 900000
-            pacmanPosition = self.getPacmanPosition()
-            for i in range(self.data.layout.width):
-                for j in range(self.data.layout.height):
-                    if self.hasFood(i, j):
-                        foodPosition = i, j
-                        distance = util.manhattanDistance(pacmanPosition, foodPosition)
-                        if distance < minDistance:
-                            minDistance = distance
-            return minDistance
+        return self.data.getFoodIndex().nearest(self.getPacmanPosition())
 
-        else:
-            return None;
+    def getMazeDistanceNearestFood(self, distancer):
+        """
+        Returns the maze distance to the nearest food, measured with a
+        distanceCalculator.Distancer for this layout
+        """
+        return self.data.getFoodIndex().nearestInMaze(self.getPacmanPosition(), distancer)
 
     def getGhostPositions(self):
         return self.ghostPositions
@@ -251,6 +241,8 @@ class GameState(object):
         return self.ghostDirections
 
     def setGhostNotLiving(self, index):
+        # The list may be shared with the predecessor state
+        self.livingGhosts = self.livingGhosts[:]
         self.livingGhosts[index] = False
 
     def isLose( self ):
@@ -278,6 +270,7 @@ class GameState(object):
             self.data = GameStateData(prevState.data)
             self.livingGhosts = prevState.livingGhosts[:]
             self.ghostPositions = prevState.ghostPositions[:]
+            self.ghostDirections = dict(prevState.ghostDirections)
             self.numMoves = prevState.numMoves;
             self.maxMoves = prevState.maxMoves;
         else: # Initial state
@@ -285,6 +278,59 @@ class GameState(object):
             self.numMoves = 0;
             self.maxMoves = -1;
             self.data.ghostDistances = []
+            self.ghostDirections = {}
+
+    def shareSuccessor( self, agentIndex ):
+        """
+        Returns a successor that shares everything with this state except the
+        state of the moving agent and the food grid, which is itself
+        copy-on-write.  The rules copy any other agent state, and the
+        livingGhosts, _eaten and ghost info lists, before changing them.
+        """
+        prev = self.data
+        state = GameState()
+        data = state.data
+        data.food = prev.food.shallowCopy()
+        data._foodIndex = prev._foodIndex
+        data.capsules = prev.capsules
+        data.agentStates = prev.agentStates[:]
+        data.agentStates[agentIndex] = prev.agentStates[agentIndex].copy()
+        data.layout = prev.layout
+        data._eaten = prev._eaten
+        data.score = prev.score
+        data.ghostDistances = prev.ghostDistances
+        state.livingGhosts = self.livingGhosts
+        state.ghostPositions = self.ghostPositions
+        state.ghostDirections = self.ghostDirections
+        state.numMoves = self.numMoves
+        state.maxMoves = self.maxMoves
+        return state
+
+    def updateGhostInfo( self, prevState, agentIndex ):
+        """
+        Refreshes the noisy distances, positions and directions of the ghosts
+        whose state changed since prevState.  Every distance changes when
+        Pacman moves; otherwise only the ghosts that moved or were captured.
+        """
+        agentStates = self.data.agentStates
+        prevStates = prevState.data.agentStates
+        changed = [i for i in range(1, len(agentStates)) if agentStates[i] is not prevStates[i]]
+        if agentIndex != 0 and not changed: return
+
+        p = self.getPacmanPosition()
+        if agentIndex == 0:
+            self.data.ghostDistances = [getNoisyDistance(p, agentStates[i].getPosition()) for i in range(1, len(agentStates))]
+        else:
+            self.data.ghostDistances = self.data.ghostDistances[:]
+        if not changed: return
+
+        self.ghostPositions = self.ghostPositions[:]
+        self.ghostDirections = dict(self.ghostDirections)
+        for i in changed:
+            position = agentStates[i].getPosition()
+            self.ghostPositions[i - 1] = position
+            self.ghostDirections[i - 1] = agentStates[i].configuration.getDirection()
+            self.data.ghostDistances[i - 1] = getNoisyDistance(p, position)
 
     def deepCopy( self ):
         state = GameState( self )
@@ -318,6 +364,7 @@ class GameState(object):
         self.livingGhosts = [False] + [True for i in range(numGhostAgents)]
         self.data.ghostDistances = [getNoisyDistance(self.getPacmanPosition(), self.getGhostPosition(i)) for i in range(1, self.getNumAgents())]
         self.ghostPositions = [self.getGhostPosition(i) for i in range(1, self.getNumAgents())]
+        self.ghostDirections = dict([(i - 1, self.getGhostDirection(i)) for i in range(1, self.getNumAgents())])
 
     def getGhostPosition( self, agentIndex ):
         if agentIndex == 0:
@@ -348,11 +395,13 @@ class BustersGameRules(object):
     and how the game starts and ends.
     """
 
-    def newGame( self, layout, pacmanAgent, ghostAgents, display, maxMoves= -1 ):
+    def newGame( self, layout, pacmanAgent, ghostAgents, display, maxMoves= -1, headless=False,
+                 muteAgents=False, outputLimit=util.AGENT_OUTPUT_LIMIT, outputRate=None, binaryLog=False ):
         agents = [pacmanAgent] + ghostAgents
         initState = GameState()
         initState.initialize( layout, len(ghostAgents))
-        game = Game(agents, display, self)
+        game = Game(agents, display, self, muteAgents=muteAgents, headless=headless,
+                    outputLimit=outputLimit, outputRate=outputRate, binaryLog=binaryLog)
         game.state = initState
         game.state.maxMoves = maxMoves
         return game
@@ -431,6 +480,8 @@ class GhostRules(object):
                 ghostState = state.data.agentStates[index]
                 ghostPosition = ghostState.configuration.getPosition()
                 if GhostRules.canKill( pacmanPosition, ghostPosition ):
+                    # The ghost's state may be shared with the predecessor
+                    ghostState = state.data.agentStates[index] = ghostState.copy()
                     GhostRules.collide( state, ghostState, index )
         else:
             ghostState = state.data.agentStates[agentIndex]
@@ -444,7 +495,7 @@ class GhostRules(object):
         if agentIndex == 0: # Pacman just moved; Anyone can kill him
             if state.hasFood(pacmanPosition[0], pacmanPosition[1]):
                 state.data._foodEaten = pacmanPosition[0], pacmanPosition[1]
-                state.data.food[pacmanPosition[0]][pacmanPosition[1]] = False
+                state.data.eatFood(pacmanPosition[0], pacmanPosition[1])
                 state.data.scoreChange += 100
     checkFoodEaten = staticmethod( checkFoodEaten )
 
@@ -453,6 +504,7 @@ class GhostRules(object):
         state.data.scoreChange += 200
         GhostRules.placeGhost(ghostState, agentIndex)
         # Added for first-person
+        state.data._eaten = state.data._eaten[:]
         state.data._eaten[agentIndex] = True
         state.setGhostNotLiving(agentIndex)
     collide = staticmethod( collide )
@@ -535,6 +587,20 @@ def readCommand( argv ):
                       help='Renders the ghosts in the display (cheating)', default=True)
     parser.add_option('-t', '--frameTime', dest='frameTime', type='float',
                       help=default('Time to delay between frames; <0 means keyboard'), default=0.1)
+    parser.add_option('--headless', action='store_true', dest='headless',
+                      help='Play without graphics in the fast game loop (agents must not modify the states they observe)', default=False)
+    parser.add_option('-w', '--workers', dest='workers', type='int',
+                      help=default('Number of worker processes to spread the games over (no graphics when > 1)'), default=1)
+    parser.add_option('--profile', dest='profile',
+                      help='Time the phases of every ply and write the histograms to this JSON file', default=None)
+    parser.add_option('--muteAgents', action='store_true', dest='muteAgents',
+                      help='Keep what the agents print in a buffer per agent instead of the console', default=False)
+    parser.add_option('--outputLimit', dest='outputLimit', type='int',
+                      help=default('Characters of output kept per muted agent'), default=util.AGENT_OUTPUT_LIMIT)
+    parser.add_option('--outputRate', dest='outputRate', type='int',
+                      help='Writes kept per call to a muted agent (default: no limit)', default=None)
+    parser.add_option('--binaryLog', action='store_true', dest='binaryLog',
+                      help='Log the observations to the binary info.traj instead of info (agents with the stock printLineData only)', default=False)
 
     options, otherjunk = parser.parse_args()
     if len(otherjunk) != 0:
@@ -559,11 +625,22 @@ def readCommand( argv ):
     agentOpts['ghostAgents'] = args['ghosts']
     pacman = pacmanType(**agentOpts) # Instantiate Pacman with agentArgs
     args['pacman'] = pacman
-    import graphicsDisplay
-    args['display'] = graphicsDisplay.FirstPersonPacmanGraphics(options.zoom, \
-                                                                  options.showGhosts, \
-                                                                  frameTime = options.frameTime)
+    if options.headless:
+        import textDisplay
+        args['display'] = textDisplay.NullGraphics()
+    else:
+        import graphicsDisplay
+        args['display'] = graphicsDisplay.FirstPersonPacmanGraphics(options.zoom, \
+                                                                      options.showGhosts, \
+                                                                      frameTime = options.frameTime)
     args['numGames'] = options.numGames
+    args['workers'] = options.workers
+    args['headless'] = options.headless
+    args['profile'] = options.profile
+    args['muteAgents'] = options.muteAgents
+    args['outputLimit'] = options.outputLimit
+    args['outputRate'] = options.outputRate
+    args['binaryLog'] = options.binaryLog
 
     return args
 
@@ -590,28 +667,79 @@ def loadAgent(pacman, nographics):
                 return getattr(module, pacman)
     raise Exception('The agent ' + pacman + ' is not specified in any *Agents.py.')
 
-def runGames( layout, pacman, ghosts, display, numGames, maxMoves=-1):
+def _playGame(task):
+    "Plays a single game inside a worker process and returns its GameResult."
+    layout, pacman, ghosts, maxMoves, headless, profile, output, binaryLog, index, seed = task
+    random.seed(seed)
+    import textDisplay, __main__
+    display = textDisplay.NullGraphics()
+    __main__.__dict__['_display'] = display
+    rules = BustersGameRules()
+    game = rules.newGame( layout, pacman, ghosts, display, maxMoves, headless, *output, binaryLog=binaryLog )
+    if profile: game.profile = GameProfile()
+    game.run()
+    return GameResult(game, index, seed)
+
+def runGamesInParallel( layout, pacman, ghosts, numGames, maxMoves, workers, headless=False, profile=False,
+                        output=(False, util.AGENT_OUTPUT_LIMIT, None), binaryLog=False ):
+    """
+    Shards the games over a pool of worker processes.  Each game runs with its
+    own copy of the agents, a NullGraphics display and the seed
+    baseSeed + gameIndex, so every game of a sweep can be replayed on its own.
+    output holds the muteAgents, outputLimit and outputRate of the games.
+    Returns the GameResults in game order.
+    """
+    import multiprocessing
+    baseSeed = random.getrandbits(31)
+    tasks = [(layout, pacman, ghosts, maxMoves, headless, profile, output, binaryLog, i, baseSeed + i) for i in range(numGames)]
+    pool = multiprocessing.Pool(workers)
+    try:
+        return pool.map(_playGame, tasks, max(1, numGames // (4 * workers)))
+    finally:
+        pool.close()
+        pool.join()
+
+def runGames( layout, pacman, ghosts, display, numGames, maxMoves=-1, workers=1, headless=False, profile=None,
+              muteAgents=False, outputLimit=util.AGENT_OUTPUT_LIMIT, outputRate=None, binaryLog=False):
+    """
+    Plays numGames games.  If profile is the name of a file, the phases of
+    every ply are timed and their histograms written to it as JSON.  With
+    muteAgents, each agent keeps the last outputLimit characters it prints,
+    and at most outputRate writes per call.  With binaryLog, the observations
+    go to the binary trajectory log instead of the info file.
+    """
+    output = (muteAgents, outputLimit, outputRate)
     # Hack for agents writing to the display
     import __main__
     __main__.__dict__['_display'] = display
 
-    rules = BustersGameRules()
-    games = []
+    if workers > 1:
+        games = runGamesInParallel( layout, pacman, ghosts, numGames, maxMoves, workers, headless, profile != None, output, binaryLog )
+        scores = [game.getScore() for game in games]
+        wins = [game.isWin() for game in games]
+    else:
+        rules = BustersGameRules()
+        games = []
 
-    for i in range( numGames ):
-        game = rules.newGame( layout, pacman, ghosts, display, maxMoves )
-        game.run()
-        games.append(game)
+        for i in range( numGames ):
+            game = rules.newGame( layout, pacman, ghosts, display, maxMoves, headless, *output, binaryLog=binaryLog )
+            if profile != None: game.profile = GameProfile()
+            game.run()
+            games.append(game)
 
-    if numGames > 1:
         scores = [game.state.getScore() for game in games]
         wins = [game.state.isWin() for game in games]
+
+    if numGames > 1:
         winRate = wins.count(True)/ float(len(wins))
         print('Average Score:', sum(scores) / float(len(scores)))
         print('Scores:       ', ', '.join([str(score) for score in scores]))
         print('Win Rate:      %d/%d (%.2f)' % (wins.count(True), len(wins), winRate))
         print('Record:       ', ', '.join([ ['Loss', 'Win'][int(w)] for w in wins]))
 
+    if profile != None:
+        writeProfiles([game.profile for game in games], profile)
+
     return games
 
 if __name__ == '__main__':
@@ -29,7 +29,9 @@ from past.utils import old_div
 from builtins import object
 from util import *
 import time, os
+from bisect import bisect_left
 import traceback
+import trajectoryLog
 import sys
 
 #######################
@@ -168,9 +170,17 @@ class AgentState(object):
 
 class Grid(object):
     """
-    A 2-dimensional array of objects backed by a list of lists.  Data is accessed
-    via grid[x][y] where (x,y) are positions on a Pacman map with x horizontal,
-    y vertical and the origin (0,0) in the bottom left corner.
+    A 2-dimensional array of booleans packed into the bits of a single integer.
+    Data is accessed via grid[x][y] where (x,y) are positions on a Pacman map
+    with x horizontal, y vertical and the origin (0,0) in the bottom left corner.
+
+    Cell (x,y) is bit x * height + y.  Python integers are immutable, so copies
+    share their bits until one of them is written to (copy-on-write), the hash
+    is computed once and cached, and count() is a popcount.  Reads go through
+    plain per-column lists, so grid[x][y] and get(x, y) cost a list lookup.
+    A column is built from the bits the first time it is read, and copies
+    share their columns with the grid they were copied from until one of
+    the two writes to a column or hands it out as grid[x].
 
     The __str__ method constructs an output that is oriented like a pacman board.
     """
@@ -180,57 +190,108 @@ class Grid(object):
 
         self.width = width
         self.height = height
-        self.data = [[initialValue for y in range(height)] for x in range(width)]
+        self._mask = (1 << (width * height)) - 1
+        self._bits = self._mask if initialValue else 0
+        self._hash = None
+        self._columns = [None] * width
+        self._owned = 0 # bit x is set if column x is not shared with a copy
         if bitRepresentation:
             self._unpackBits(bitRepresentation)
 
     def __getitem__(self, i):
-        return self.data[i]
+        column = self._columns[i]
+        if column is None or column.grid is not self:
+            column = self._makeColumn(i % self.width)
+        return column
+
+    def get(self, x, y):
+        "The value of cell (x, y); the fast path for inner loops."
+        column = self._columns[x]
+        if column is None: column = self._makeColumn(x % self.width)
+        return column[y]
+
+    def _makeColumn(self, x):
+        "Gives this grid its own copy of column x, built from the bits if no grid has it yet."
+        column = self._columns[x]
+        if column is None:
+            bits, height = self._bits >> (x * self.height), self.height
+            column = [(bits >> y) & 1 == 1 for y in range(height)]
+        column = self._columns[x] = GridColumn(self, x, column)
+        self._owned |= 1 << x
+        return column
 
     def __setitem__(self, key, item):
-        self.data[key] = item
+        column = self[key]
+        for y, value in enumerate(item):
+            column[y] = value
+
+    def __iter__(self):
+        for x in range(self.width):
+            yield self[x]
+
+    def __len__(self):
+        return self.width
 
     def __str__(self):
-        out = [[str(self.data[x][y])[0] for x in range(self.width)] for y in range(self.height)]
+        out = [[str(self._getBit(x, y))[0] for x in range(self.width)] for y in range(self.height)]
         out.reverse()
         return '\n'.join([''.join(x) for x in out])
 
     def __eq__(self, other):
-        if other == None: return False
-        return self.data == other.data
+        if other == None or not isinstance(other, Grid): return False
+        return self.width == other.width and self.height == other.height and self._bits == other._bits
+
+    def __ne__(self, other):
+        return not self == other
 
     def __hash__(self):
-        # return hash(str(self))
-        base = 1
-        h = 0
-        for l in self.data:
-            for i in l:
-                if i:
-                    h += base
-                base *= 2
-        return hash(h)
+        if self._hash is None:
+            self._hash = hash(self._bits)
+        return self._hash
+
+    def _getBit(self, x, y):
+        return (self._bits >> (x * self.height + y)) & 1 == 1
+
+    def _setBit(self, x, y, value):
+        if value not in [False, True]: raise Exception('Grids can only contain booleans')
+        bit = 1 << (x * self.height + y)
+        if value:
+            self._bits |= bit
+        else:
+            self._bits &= ~bit
+        self._hash = None
+        column = self._columns[x]
+        if column is not None:
+            if not (self._owned >> x) & 1: column = self._makeColumn(x)
+            list.__setitem__(column, y, bool(value))
 
     def copy(self):
         g = Grid(self.width, self.height)
-        g.data = [x[:] for x in self.data]
+        g._bits = self._bits
+        g._hash = self._hash
+        g._columns = list(self._columns)
+        self._owned = 0
         return g
 
     def deepCopy(self):
         return self.copy()
 
     def shallowCopy(self):
-        g = Grid(self.width, self.height)
-        g.data = self.data
-        return g
+        return self.copy()
 
     def count(self, item =True ):
-        return sum([x.count(item) for x in self.data])
+        bits = self._bits if item else self._mask & ~self._bits
+        return bin(bits).count('1')
 
     def asList(self, key = True):
+        bits = self._bits if key else self._mask & ~self._bits
+        height = self.height
         list = []
-        for x in range(self.width):
-            for y in range(self.height):
-                if self[x][y] == key: list.append( (x,y) )
+        while bits:
+            lowest = bits & -bits
+            index = lowest.bit_length() - 1
+            list.append( (index // height, index % height) )
+            bits ^= lowest
         return list
 
     def packBits(self):
@@ -281,12 +342,108 @@ class Grid(object):
                 bools.append(False)
         return bools
 
+class GridColumn(list):
+    """
+    Column x of a Grid as a list of booleans, so that reading grid[x][y] is
+    a list lookup.  Writes also set the grid's bits.
+    """
+    __slots__ = ('grid', 'x')
+
+    def __init__(self, grid, x, values):
+        list.__init__(self, values)
+        self.grid = grid
+        self.x = x
+
+    def __setitem__(self, y, value):
+        height = self.grid.height
+        if y < 0: y += height
+        if y < 0 or y >= height: raise IndexError('Grid index out of range')
+        self.grid._setBit(self.x, y, value)
+
 def reconstituteGrid(bitRep):
     if type(bitRep) is not type((1,2)):
         return bitRep
     width, height = bitRep[:2]
     return Grid(width, height, bitRepresentation= bitRep[2:])
 
+class FoodIndex(object):
+    """
+    The food of a Grid, kept so that counting the food and finding the food
+    nearest to a position do not scan the whole grid.
+
+    food is the set of food positions and columns[x] the sorted list of the
+    y coordinates of the food in column x.  An index is never changed: remove
+    returns a new index sharing every column but the one that changed, so
+    successor states share their predecessor's index.  bits records the grid
+    it was built for, so an index that missed a change to the grid is noticed.
+    """
+    def __init__(self, grid=None):
+        self.bits = None
+        self.food = frozenset()
+        self.columns = []
+        if grid is not None:
+            self.bits = grid._bits
+            self.food = frozenset(grid.asList())
+            self.columns = [[] for x in range(grid.width)]
+            for x, y in sorted(self.food):
+                self.columns[x].append(y)
+
+    def __len__(self):
+        return len(self.food)
+
+    def matches(self, grid):
+        return self.bits == grid._bits
+
+    def remove(self, position, grid):
+        "Returns the index of grid, which is this index without position."
+        index = FoodIndex()
+        index.bits = grid._bits
+        index.food = self.food - frozenset([position])
+        index.columns = self.columns
+        if len(index.food) != len(self.food):
+            x, y = position
+            column = self.columns[x][:]
+            column.remove(y)
+            index.columns = self.columns[:]
+            index.columns[x] = column
+        return index
+
+    def nearest(self, position):
+        """
+        Returns the Manhattan distance from position to the nearest food, or
+        None if there is none.  Columns are visited outwards from position
+        until they are farther away than the best food found, and each one
+        is searched with bisection.
+        """
+        if not self.food: return None
+        px, py = position
+        columns = self.columns
+        width = len(columns)
+        x0 = min(max(int(px), 0), width - 1)
+        best = sys.maxsize
+        for offset in range(width):
+            done = True
+            for x in ((x0 - offset, x0 + offset) if offset else (x0,)):
+                if x < 0 or x >= width: continue
+                dx = abs(x - px)
+                if dx >= best: continue
+                done = False
+                column = columns[x]
+                if not column: continue
+                i = bisect_left(column, py)
+                if i < len(column): best = min(best, dx + column[i] - py)
+                if i > 0: best = min(best, dx + py - column[i - 1])
+            if done: break
+        return best
+
+    def nearestInMaze(self, position, distancer):
+        """
+        Returns the maze distance from position to the nearest food, as
+        given by a distanceCalculator.Distancer, or None if there is none.
+        """
+        if not self.food: return None
+        return min([distancer.getDistance(position, food) for food in self.food])
+
 ####################################
 # Parts you shouldn't have to read #
 ####################################
@@ -349,7 +506,7 @@ class Actions(object):
             dx, dy = vec
             next_y = y_int + dy
             next_x = x_int + dx
-            if not walls[next_x][next_y]: possible.append(dir)
+            if not walls.get(next_x, next_y): possible.append(dir)
 
         return possible
 
@@ -365,7 +522,7 @@ class Actions(object):
             if next_x < 0 or next_x == walls.width: continue
             next_y = y_int + dy
             if next_y < 0 or next_y == walls.height: continue
-            if not walls[next_x][next_y]: neighbors.append((next_x, next_y))
+            if not walls.get(next_x, next_y): neighbors.append((next_x, next_y))
         return neighbors
     getLegalNeighbors = staticmethod(getLegalNeighbors)
 
@@ -390,6 +547,9 @@ class GameStateData(object):
             self.layout = prevState.layout
             self._eaten = prevState._eaten
             self.score = prevState.score
+            self._foodIndex = prevState._foodIndex
+        else:
+            self._foodIndex = None
 
         self._foodEaten = None
         self._foodAdded = None
@@ -402,13 +562,31 @@ class GameStateData(object):
     def deepCopy( self ):
         state = GameStateData( self )
         state.food = self.food.deepCopy()
-        state.layout = self.layout.deepCopy()
+        # The layout never changes during a game, so it is shared
+        state.layout = self.layout
         state._agentMoved = self._agentMoved
         state._foodEaten = self._foodEaten
         state._foodAdded = self._foodAdded
         state._capsuleEaten = self._capsuleEaten
         return state
 
+    def getFoodIndex( self ):
+        """
+        Returns the FoodIndex of the food grid, building it again if the grid
+        was changed without going through eatFood.
+        """
+        index = self._foodIndex
+        if index is None or not index.matches(self.food):
+            index = self._foodIndex = FoodIndex(self.food)
+        return index
+
+    def eatFood( self, x, y ):
+        "Removes the food at (x,y), updating the food index instead of rebuilding it."
+        index = self._foodIndex
+        if index is not None and not index.matches(self.food): index = None
+        self.food[x][y] = False
+        if index is not None: self._foodIndex = index.remove((x, y), self.food)
+
     def copyAgentStates( self, agentStates ):
         copiedStates = []
         for agentState in agentStates:
@@ -441,13 +619,10 @@ class GameStateData(object):
 
     def __str__( self ):
         width, height = self.layout.width, self.layout.height
-        map = Grid(width, height)
         if type(self.food) == type((1,2)):
             self.food = reconstituteGrid(self.food)
-        for x in range(width):
-            for y in range(height):
-                food, walls = self.food, self.layout.walls
-                map[x][y] = self._foodWallStr(food[x][y], walls[x][y])
+        food, walls = self.food, self.layout.walls
+        map = [[self._foodWallStr(food[x][y], walls[x][y]) for y in range(height)] for x in range(width)]
 
         for agentState in self.agentStates:
             if agentState == None: continue
@@ -462,7 +637,9 @@ class GameStateData(object):
         for x, y in self.capsules:
             map[x][y] = 'o'
 
-        return str(map) + ("\nScore: %d\n" % self.score)
+        rows = [''.join([map[x][y] for x in range(width)]) for y in range(height)]
+        rows.reverse()
+        return '\n'.join(rows) + ("\nScore: %d\n" % self.score)
 
     def _foodWallStr( self, hasFood, hasWall ):
         if hasFood:
@@ -511,6 +688,132 @@ class GameStateData(object):
             self.agentStates.append( AgentState( Configuration( pos, Directions.STOP), isPacman) )
         self._eaten = [False for a in self.agentStates]
 
+###################
+# Instrumentation #
+###################
+
+# The phases of a ply timed by a GameProfile
+PHASES = ('observation', 'getAction', 'generateSuccessor', 'display', 'rules')
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+class PhaseHistogram(object):
+    """
+    A histogram of the durations of one phase.  Bucket b counts durations of
+    2**(b-1) to 2**b microseconds (bucket 0 those under a microsecond), so
+    adding a duration takes a few integer operations.
+    """
+    NUM_BUCKETS = 32
+
+    def __init__( self ):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.buckets = [0] * self.NUM_BUCKETS
+
+    def add( self, seconds ):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum: self.maximum = seconds
+        self.buckets[min(int(seconds * 1e6).bit_length(), self.NUM_BUCKETS - 1)] += 1
+
+    def merge( self, other ):
+        self.count += other.count
+        self.total += other.total
+        self.maximum = max(self.maximum, other.maximum)
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+    def percentile( self, fraction ):
+        "An upper bound, in seconds, of the given fraction of the durations."
+        seen = 0
+        for b, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= fraction * self.count:
+                return min(2 ** b * 1e-6, self.maximum)
+        return 0.0
+
+    def asDict( self ):
+        buckets = self.buckets[:]
+        while buckets and buckets[-1] == 0: buckets.pop()
+        return {'count': self.count, 'total': self.total,
+                'mean': self.total / self.count if self.count else 0.0,
+                'max': self.maximum, 'p50': self.percentile(0.5), 'p99': self.percentile(0.99),
+                'buckets': buckets}
+
+class GameProfile(object):
+    """
+    Opt-in timings of the phases of every ply of one or more games, with a
+    PhaseHistogram per phase and agent.  Setting game.profile to a
+    GameProfile before game.run() fills it in; without one, run() only
+    pays for a test per phase.
+    """
+    def __init__( self ):
+        self.games = 1
+        self.histograms = {}
+
+    def add( self, phase, agentIndex, seconds ):
+        key = (phase, agentIndex)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = PhaseHistogram()
+        histogram.add(seconds)
+
+    def merge( self, other ):
+        "Adds the timings of another profile to this one."
+        self.games += other.games
+        for key, histogram in other.histograms.items():
+            if key not in self.histograms:
+                self.histograms[key] = PhaseHistogram()
+            self.histograms[key].merge(histogram)
+
+    def asDict( self ):
+        "The histograms of every phase, in total and per agent."
+        phases = {}
+        for phase in PHASES:
+            agents = sorted([i for p, i in self.histograms if p == phase])
+            if not agents: continue
+            total = PhaseHistogram()
+            for i in agents: total.merge(self.histograms[(phase, i)])
+            phases[phase] = total.asDict()
+            phases[phase]['agents'] = dict([(str(i), self.histograms[(phase, i)].asDict()) for i in agents])
+        return {'games': self.games, 'phases': phases}
+
+def writeProfiles( profiles, path ):
+    "Writes the profiles of a run of games, and their sum, to a JSON file."
+    import json
+    total = GameProfile()
+    total.games = 0
+    for profile in profiles: total.merge(profile)
+    with open(path, 'w') as f:
+        json.dump({'total': total.asDict(), 'games': [profile.asDict() for profile in profiles]}, f, indent=1, sort_keys=True)
+
+class GameResult(object):
+    """
+    A picklable summary of a finished Game.  Worker processes send these back
+    instead of whole Game objects, which drag along every agent and display.
+    """
+    def __init__( self, game, index=0, seed=None ):
+        self.index = index
+        self.seed = seed
+        self.score = game.state.getScore()
+        self.win = game.state.isWin()
+        self.lose = game.state.isLose()
+        self.numMoves = len(game.moveHistory)
+        self.moveHistory = game.moveHistory
+        self.agentCrashed = game.agentCrashed
+        self.agentTimeout = game.agentTimeout
+        self.totalAgentTimes = game.totalAgentTimes
+        self.profile = game.profile
+
+    def getScore( self ):
+        return self.score
+
+    def isWin( self ):
+        return self.win
+
+    def isLose( self ):
+        return self.lose
+
 try:
     import boinc
     _BOINC_ENABLED = True
@@ -522,7 +825,8 @@ class Game(object):
     The Game manages the control flow, soliciting actions from agents.
     """
 
-    def __init__( self, agents, display, rules, startingIndex=0, muteAgents=False, catchExceptions=False ):
+    def __init__( self, agents, display, rules, startingIndex=0, muteAgents=False, catchExceptions=False, headless=False,
+                  outputLimit=AGENT_OUTPUT_LIMIT, outputRate=None, binaryLog=False ):
         self.agentCrashed = False
         self.agents = agents
         self.display = display
@@ -531,12 +835,17 @@ class Game(object):
         self.gameOver = False
         self.muteAgents = muteAgents
         self.catchExceptions = catchExceptions
+        self.headless = headless
         self.moveHistory = []
         self.totalAgentTimes = [0 for agent in agents]
         self.totalAgentTimeWarnings = [0 for agent in agents]
         self.agentTimeout = False
-        import io
-        self.agentOutput = [io.StringIO() for agent in agents]
+        self.binaryLog = binaryLog
+        self.trajectory = None
+        self.profile = None
+        # What muted agents print goes to bounded per-agent buffers
+        self.output = OutputCapture(len(agents), outputLimit, outputRate) if muteAgents else None
+        self.agentOutput = self.output.buffers if muteAgents else []
 
     def getProgress(self):
         if self.gameOver:
@@ -550,30 +859,110 @@ class Game(object):
         self.gameOver = True
         self.agentCrashed = True
         self.rules.agentCrash(self, agentIndex)
-
-    OLD_STDOUT = None
-    OLD_STDERR = None
+        self.closeTrajectory()
 
     def mute(self, agentIndex):
-        if not self.muteAgents: return
-        global OLD_STDOUT, OLD_STDERR
-        import io
-        OLD_STDOUT = sys.stdout
-        OLD_STDERR = sys.stderr
-        sys.stdout = self.agentOutput[agentIndex]
-        sys.stderr = self.agentOutput[agentIndex]
+        if self.output is not None: self.output.select(agentIndex)
 
     def unmute(self):
-        if not self.muteAgents: return
-        global OLD_STDOUT, OLD_STDERR
-        # Revert stdout/stderr to originals
-        sys.stdout = OLD_STDOUT
-        sys.stderr = OLD_STDERR
+        if self.output is not None: self.output.select(None)
+
+    def getAgentOutput(self, agentIndex):
+        "The tail of what a muted agent has printed."
+        return self.output.buffers[agentIndex].getvalue() if self.output is not None else ''
+
+    def logObservation( self, agent, observation ):
+        """
+        Appends the printLineData of a BasicAgentAA for its observation to the
+        info file, or to the binary trajectory log with binaryLog.
+        """
+        if (agent.__class__.__name__ == "BasicAgentAA"):
+            if self.trajectory is None:
+                self.trajectory = trajectoryLog.openLog(agent, self.binaryLog)
+            self.trajectory.log(observation)
+
+    def closeTrajectory( self ):
+        "Writes the rest of the game to the info file or trajectory log, if there is one."
+        if self.trajectory is not None:
+            self.trajectory.close()
+            self.trajectory = None
+
+    def _endPhase( self, phase, agentIndex, phaseStart ):
+        "Adds the time since phaseStart to the profile and returns the current time."
+        now = _clock()
+        self.profile.add(phase, agentIndex, now - phaseStart)
+        return now
+
+    def runHeadless( self ):
+        """
+        A high-throughput version of run() for training and evaluation games
+        without a display.  There is no muting, no timeouts and no per-move
+        display update, agent methods are looked up once per game, and agents
+        without an observationFunction observe the current state itself
+        instead of a deep copy.  States are never modified once generated, so
+        those agents must treat the state they receive as read-only.
+        """
+        agents = self.agents
+        numAgents = len( agents )
+        self.display.initialize(self.state.data)
+        self.numMoves = 0
+
+        for i, agent in enumerate(agents):
+            if not agent:
+                print("Agent %d failed to load" % i, file=sys.stderr)
+                self._agentCrash(i, quiet=True)
+                return
+            if hasattr(agent, 'registerInitialState'):
+                agent.registerInitialState(self.state.deepCopy())
+
+        observationFunctions = [getattr(agent, 'observationFunction', None) for agent in agents]
+        actionFunctions = [agent.getAction for agent in agents]
+        rules = self.rules
+        moveHistory = self.moveHistory
+        profile = self.profile
+        agentIndex = self.startingIndex
+        while not self.gameOver:
+            agent = agents[agentIndex]
+            observationFunction = observationFunctions[agentIndex]
+            if profile is not None: phaseStart = _clock()
+            if observationFunction is not None:
+                observation = observationFunction(self.state.deepCopy())
+            else:
+                observation = self.state
+            if profile is not None: phaseStart = self._endPhase('observation', agentIndex, phaseStart)
+            self.logObservation(agent, observation)
+            if profile is not None: phaseStart = _clock()
+            action = actionFunctions[agentIndex](observation)
+            if profile is not None: phaseStart = self._endPhase('getAction', agentIndex, phaseStart)
+            moveHistory.append( (agentIndex, action) )
+            self.state = self.state.generateSuccessor( agentIndex, action )
+            if profile is not None: phaseStart = self._endPhase('generateSuccessor', agentIndex, phaseStart)
+            rules.process(self.state, self)
+            if profile is not None: self._endPhase('rules', agentIndex, phaseStart)
+            agentIndex = ( agentIndex + 1 ) % numAgents
+
+        for agent in agents:
+            if hasattr(agent, 'final'):
+                agent.final( self.state )
+        self.closeTrajectory()
+        self.display.finish()
 
     def run( self ):
         """
         Main control loop for game play.
         """
+        if self.headless and not self.catchExceptions and not self.muteAgents:
+            return self.runHeadless()
+        if self.output is None:
+            return self._run()
+        # Muted agents print into their buffers until the game is over
+        self.output.install()
+        try:
+            return self._run()
+        finally:
+            self.output.uninstall()
+
+    def _run( self ):
         self.display.initialize(self.state.data)
         self.numMoves = 0
 
@@ -594,7 +983,7 @@ class Game(object):
                 self.mute(i)
                 if self.catchExceptions:
                     try:
-                        timed_func = TimeoutFunction(agent.registerInitialState, int(self.rules.getMaxStartupTime(i)))
+                        timed_func = TimeoutFunction(agent.registerInitialState, self.rules.getMaxStartupTime(i))
                         try:
                             start_time = time.time()
                             timed_func(self.state.deepCopy())
@@ -617,6 +1006,8 @@ class Game(object):
 
         agentIndex = self.startingIndex
         numAgents = len( self.agents )
+        hasObservationFunction = ['observationFunction' in dir( agent ) for agent in self.agents]
+        profile = self.profile
         step = 0
         while not self.gameOver:
             # Fetch the next agent
@@ -625,11 +1016,12 @@ class Game(object):
             skip_action = False
                 
             # Generate an observation of the state
-            if 'observationFunction' in dir( agent ):
+            if profile is not None: phaseStart = _clock()
+            if hasObservationFunction[agentIndex]:
                 self.mute(agentIndex)
                 if self.catchExceptions:
                     try:
-                        timed_func = TimeoutFunction(agent.observationFunction, int(self.rules.getMoveTimeout(agentIndex)))
+                        timed_func = TimeoutFunction(agent.observationFunction, self.rules.getMoveTimeout(agentIndex))
                         try:
                             start_time = time.time()
                             observation = timed_func(self.state.deepCopy())
@@ -646,24 +1038,20 @@ class Game(object):
                 self.unmute()
             else:
                 observation = self.state.deepCopy()
+            if profile is not None: self._endPhase('observation', agentIndex, phaseStart)
 
             #Para crear el documento con la información del mapa, pacman, fantasmas, la comida y la puntuación
-            if (agent.__class__.__name__ == "BasicAgentAA"):
-                with open ("info", "a") as myfile:
-                    import os
-                    # Insert header when the file is being opened for the first time
-                    if(os.stat("info").st_size==0):
-                        myfile.write("Width, Height, Walls Map, Pacman Position, Pacman Direction, Legal Actions,  Number of Ghosts, Living Ghosts, Ghosts Positions, Ghosts Directions, Ghosts Distances, Pac Dots, Distance Nearest Pac Dot, Food Map, Capsules Positions, Score\n")
-                    myfile.write(agent.printLineData(observation)) 
+            self.logObservation(agent, observation)
 
 
             # Solicit an action
             action = None
             step += 1
+            if profile is not None: phaseStart = _clock()
             self.mute(agentIndex)
             if self.catchExceptions:
                 try:
-                    timed_func = TimeoutFunction(agent.getAction, int(self.rules.getMoveTimeout(agentIndex)) - int(move_time))
+                    timed_func = TimeoutFunction(agent.getAction, self.rules.getMoveTimeout(agentIndex) - move_time)
                     try:
                         start_time = time.time()
                         if skip_action:
@@ -704,6 +1092,7 @@ class Game(object):
             else:
                 action = agent.getAction(observation)
             self.unmute()
+            if profile is not None: phaseStart = self._endPhase('getAction', agentIndex, phaseStart)
 
             # Execute the action
             self.moveHistory.append( (agentIndex, action) )
@@ -717,14 +1106,17 @@ class Game(object):
                     return
             else:
                 self.state = self.state.generateSuccessor( agentIndex, action )
+            if profile is not None: phaseStart = self._endPhase('generateSuccessor', agentIndex, phaseStart)
 
             # Change the display
             self.display.update( self.state.data )
+            if profile is not None: phaseStart = self._endPhase('display', agentIndex, phaseStart)
             ###idx = agentIndex - agentIndex % 2 + 1
             ###self.display.update( self.state.makeObservation(idx).data )
 
             # Allow for game specific conditions (winning, losing, etc.)
             self.rules.process(self.state, self)
+            if profile is not None: self._endPhase('rules', agentIndex, phaseStart)
             # Track progress
             if agentIndex == numAgents + 1: self.numMoves += 1
             # Next agent
@@ -745,4 +1137,5 @@ class Game(object):
                     self._agentCrash(agentIndex)
                     self.unmute()
                     return
+        self.closeTrajectory()
         self.display.finish()
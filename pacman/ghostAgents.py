@@ -23,6 +23,30 @@ import random
 from util import manhattanDistance
 import util
 
+# Samplers for the action distributions returned so far, keyed by their items
+DISTRIBUTION_SAMPLERS = {}
+MAX_DISTRIBUTION_SAMPLERS = 4096
+
+def getDistributionSampler( dist ):
+    """
+    Returns a util.Sampler for a Counter or list of (prob, action) pairs,
+    reusing the one built for an identical earlier distribution.
+    """
+    if isinstance( dist, dict ):
+        key = tuple( dist.items() )
+    else:
+        key = tuple( dist )
+    sampler = DISTRIBUTION_SAMPLERS.get( key )
+    if sampler == None:
+        if len( DISTRIBUTION_SAMPLERS ) >= MAX_DISTRIBUTION_SAMPLERS:
+            DISTRIBUTION_SAMPLERS.clear()
+        if isinstance( dist, dict ):
+            sampler = util.Sampler( dist )
+        else:
+            sampler = util.Sampler( [p for p, a in dist], [a for p, a in dist] )
+        DISTRIBUTION_SAMPLERS[key] = sampler
+    return sampler
+
 class GhostAgent( Agent ):
     def __init__( self, index ):
         self.index = index
@@ -32,7 +56,7 @@ class GhostAgent( Agent ):
         if len(dist) == 0:
             return Directions.STOP
         else:
-            return util.chooseFromDistribution( dist )
+            return getDistributionSampler( dist ).sample()
 
     def getDistribution(self, state):
         "Returns a Counter encoding a distribution over actions from the provided state."
@@ -83,6 +83,15 @@ SCARED_COLOR = formatColor(1,1,1)
 
 GHOST_VEC_COLORS = list(map(colorToVector, GHOST_COLORS))
 
+# A belief of weight w is drawn in its ghost's colour at intensity w ** .3,
+# quantized to BELIEF_LEVELS steps.  The ramps hold every ghost colour at
+# every step, and the colours of the combinations drawn so far are kept.
+BELIEF_LEVELS = 256
+def beliefRamp(color):
+    return [[0.95 * c * level / (BELIEF_LEVELS - 1) for c in color] for level in range(BELIEF_LEVELS)]
+GHOST_BELIEF_RAMPS = list(map(beliefRamp, GHOST_VEC_COLORS))
+BELIEF_COLOR_CACHE = {}
+
 PACMAN_COLOR = formatColor(255.0/255.0,255.0/255.0,61.0/255)
 PACMAN_SCALE = 0.5
 #pacman_speed = 0.25
@@ -223,6 +232,9 @@ class PacmanGraphics(object):
                                 filled = 1, behind=2)
                 distx.append(block)
         self.distributionImages = dist
+        # The colour each block was last drawn with, and the blocks not drawn black
+        self.distributionColors = [[BACKGROUND_COLOR] * walls.height for x in range(walls.width)]
+        self.shadedCells = set()
 
     def drawStaticObjects(self, state):
         layout = self.layout
@@ -611,25 +623,48 @@ class PacmanGraphics(object):
 
 
     def updateDistributions(self, distributions):
-        "Draws an agent's belief distributions"
-        # copy all distributions so we don't change their state
-        distributions = [x.copy() for x in distributions]
+        """
+        Draws an agent's belief distributions.  Only the blocks whose
+        quantized colour changed since the last call are recoloured.
+        """
         if self.distributionImages == None:
             self.drawDistributions(self.previousState)
-        for x in range(len(self.distributionImages)):
-            for y in range(len(self.distributionImages[0])):
-                image = self.distributionImages[x][y]
-                weights = [dist[ (x,y) ] for dist in distributions]
-
-                if sum(weights) != 0:
-                    pass
-                # Fog of war
-                color = [0.0,0.0,0.0]
-                colors = GHOST_VEC_COLORS[1:] # With Pacman
-                if self.capture: colors = GHOST_VEC_COLORS
-                for weight, gcolor in zip(weights, colors):
-                    color = [min(1.0, c + 0.95 * g * weight ** .3) for c,g in zip(color, gcolor)]
-                changeColor(image, formatColor(*color))
+        ramps = GHOST_BELIEF_RAMPS[1:] # With Pacman
+        if self.capture: ramps = GHOST_BELIEF_RAMPS
+        numGhosts = min(len(distributions), len(ramps))
+        top = BELIEF_LEVELS - 1
+        # Quantized intensities of the cells with some belief; read with items()
+        # because indexing a Counter adds the missing keys
+        levels = {}
+        for ghost in range(numGhosts):
+            for pos, weight in distributions[ghost].items():
+                if weight <= 0: continue
+                level = min(top, int(weight ** .3 * top + 0.5))
+                if level == 0: continue
+                cell = levels.get(pos)
+                if cell is None: cell = levels[pos] = [0] * numGhosts
+                cell[ghost] = level
+        images, drawn = self.distributionImages, self.distributionColors
+        width, height = len(images), len(images[0])
+        for pos in self.shadedCells.union(levels):
+            x, y = pos
+            if not (0 <= x < width and 0 <= y < height): continue
+            cell = levels.get(pos)
+            if cell is None:
+                color = BACKGROUND_COLOR
+            else:
+                key = (self.capture, tuple(cell))
+                color = BELIEF_COLOR_CACHE.get(key)
+                if color is None:
+                    if len(BELIEF_COLOR_CACHE) > 65536: BELIEF_COLOR_CACHE.clear()
+                    color = [0.0, 0.0, 0.0]
+                    for level, ramp in zip(cell, ramps):
+                        color = [c + g for c, g in zip(color, ramp[level])]
+                    color = BELIEF_COLOR_CACHE[key] = formatColor(*[min(1.0, c) for c in color])
+            if drawn[x][y] != color:
+                changeColor(images[x][y], color)
+                drawn[x][y] = color
+        self.shadedCells = set(levels)
         refresh()
 
 class FirstPersonPacmanGraphics(PacmanGraphics):
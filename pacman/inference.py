@@ -13,11 +13,16 @@
 
 
 from builtins import object
+from builtins import range
+from array import array
 import itertools
+import collections
 import util
 import random
 import busters
 import game
+import ghostAgents
+import bustersGhostAgents
 
 class InferenceModule(object):
     """
@@ -233,6 +238,257 @@ class ExactInference(InferenceModule):
     def getBeliefDistribution(self):
         return self.beliefs
 
+# Ghosts whose action distribution only depends on their own position, so
+# their transition model can be computed once per layout.  Only these exact
+# classes qualify: a subclass may override getDistribution.
+STATIONARY_GHOSTS = (ghostAgents.RandomGhost, ghostAgents.StaticGhost,
+                     bustersGhostAgents.StationaryGhost, busters.RandomGhost)
+
+# (ghost type, walls) -> (rowStarts, columns, probabilities)
+TRANSITION_MATRIX_CACHE = {}
+
+def getSuccessorIndices(gameState, agent, ghostPosition, positionIndex):
+    """
+    Returns (successor index, probability) pairs for the ghost controlled by
+    agent moving from ghostPosition, where positionIndex maps the legal
+    positions to their indices.  Moves that leave the legal positions (into
+    the prison row) are dropped.  Places the ghost in the supplied gameState.
+    """
+    conf = game.Configuration(ghostPosition, game.Directions.STOP)
+    gameState.data.agentStates[agent.index] = game.AgentState(conf, False)
+    actionDist = agent.getDistribution(gameState)
+    if isinstance(actionDist, dict):
+        actionDist = [(prob, action) for action, prob in actionDist.items()]
+    successors = []
+    for prob, action in actionDist:
+        successor = game.Actions.getSuccessor(ghostPosition, action)
+        if successor in positionIndex and prob > 0:
+            successors.append((positionIndex[successor], prob))
+    if len(successors) == 0: # The ghost stays put when it has nowhere to go
+        return [(positionIndex[ghostPosition], 1.0)]
+    return successors
+
+def getTransitionMatrix(gameState, agent, legalPositions, positionIndex):
+    """
+    Returns the transition matrix of a ghost in STATIONARY_GHOSTS as
+    (rowStarts, columns, probabilities) arrays in compressed row form, or
+    None for other ghosts, including subclasses of those in the tuple.
+    Matrices are cached per ghost type and layout.
+    """
+    if type(agent) not in STATIONARY_GHOSTS: return None
+    key = (agent.__class__, gameState.getWalls())
+    if key not in TRANSITION_MATRIX_CACHE:
+        rowStarts, columns, probabilities = array('i', [0]), array('i'), array('d')
+        for position in legalPositions:
+            for successor, prob in getSuccessorIndices(gameState, agent, position, positionIndex):
+                columns.append(successor)
+                probabilities.append(prob)
+            rowStarts.append(len(columns))
+        TRANSITION_MATRIX_CACHE[key] = (rowStarts, columns, probabilities)
+    return TRANSITION_MATRIX_CACHE[key]
+
+def getSuccessorSampler(successors):
+    "Returns a util.Sampler over the indices of (successor index, probability) pairs."
+    return util.Sampler([prob for index, prob in successors], [index for index, prob in successors])
+
+def getTransitionSamplers(transitions):
+    "Returns a util.Sampler over the successor indices of every row of a getTransitionMatrix matrix."
+    rowStarts, columns, probabilities = transitions
+    return [util.Sampler(probabilities[rowStarts[i]:rowStarts[i + 1]], columns[rowStarts[i]:rowStarts[i + 1]])
+            for i in range(len(rowStarts) - 1)]
+
+def getPacmanDistances(pacmanPosition, legalPositions, cache):
+    """
+    Manhattan distances from pacmanPosition to every legal position, cached
+    per position in the cache dictionary.
+    """
+    if pacmanPosition not in cache:
+        px, py = pacmanPosition
+        cache[pacmanPosition] = [abs(x - px) + abs(y - py) for x, y in legalPositions]
+    return cache[pacmanPosition]
+
+def getEmissions(noisyDistance, distances):
+    "Returns P(noisyDistance | TrueDistance) for each of the true distances."
+    emission = busters.getObservationDistribution(noisyDistance).get
+    return [emission(d, 0.0) for d in distances]
+
+def systematicResample(weights, n):
+    """
+    Draws n indices in proportion to weights with a single random offset
+    (systematic resampling), through util.Sampler.  The weights must not
+    all be zero.
+    """
+    return util.Sampler(weights).systematicIndices(n)
+
+class ArrayExactInference(InferenceModule):
+    """
+    Exact inference with the beliefs stored as an array over
+    self.legalPositions instead of a Counter.
+
+    The observation update multiplies the beliefs by an emission vector in a
+    single pass.  For ghosts in STATIONARY_GHOSTS the transition model is
+    built once per layout as a sparse matrix in compressed row form, so
+    elapseTime is a sparse matrix-vector product instead of a state copy
+    and a ghost agent call per cell.  Other ghosts fall back to querying
+    the ghost agent, but only from cells with non-zero belief.  NumPy is not
+    a dependency here, so both updates are plain loops over stdlib arrays.
+
+    Use it with -a inference=ArrayExactInference.
+    """
+
+    def initialize(self, gameState):
+        InferenceModule.initialize(self, gameState)
+        self.positionIndex = dict([(p, i) for i, p in enumerate(self.legalPositions)])
+        self.pacmanDistances = {}
+        self.transitions = getTransitionMatrix(gameState, self.ghostAgent,
+                                               self.legalPositions, self.positionIndex)
+
+    def initializeUniformly(self, gameState):
+        "Begin with a uniform distribution over ghost positions."
+        numPositions = len(self.legalPositions)
+        self.beliefs = array('d', [1.0 / numPositions]) * numPositions
+        self.captured = False
+
+    def getSuccessorIndices(self, gameState, index):
+        "Returns (successor index, probability) pairs for the ghost at legal position number index."
+        return getSuccessorIndices(gameState, self.ghostAgent, self.legalPositions[index], self.positionIndex)
+
+    def getPacmanDistances(self, pacmanPosition):
+        "Manhattan distances from pacmanPosition to every legal position, cached per position."
+        return getPacmanDistances(pacmanPosition, self.legalPositions, self.pacmanDistances)
+
+    def getEmissions(self, noisyDistance, pacmanPosition):
+        "Returns P(noisyDistance | ghost at p) for every legal position p."
+        return getEmissions(noisyDistance, self.getPacmanDistances(pacmanPosition))
+
+    def observe(self, observation, gameState):
+        """
+        Multiplies the beliefs by P(noisyDistance | TrueDistance) for every
+        legal position and renormalizes.  A noisy distance of None means the
+        ghost was captured and is in jail.  If the evidence rules out every
+        position the beliefs start over from the uniform prior.
+        """
+        noisyDistance = observation
+        if noisyDistance == None:
+            self.captured = True
+            return
+        emissions = self.getEmissions(noisyDistance, gameState.getPacmanPosition())
+        beliefs = [b * e for b, e in zip(self.beliefs, emissions)]
+        total = sum(beliefs)
+        if total == 0:
+            self.initializeUniformly(gameState)
+            return
+        self.beliefs = array('d', [b / total for b in beliefs])
+
+    def elapseTime(self, gameState):
+        "Pushes the beliefs through the ghost's transition model."
+        if self.captured: return
+        newBeliefs = array('d', [0.0]) * len(self.beliefs)
+        if self.transitions != None:
+            rowStarts, columns, probabilities = self.transitions
+            for index, belief in enumerate(self.beliefs):
+                if belief == 0: continue
+                for k in range(rowStarts[index], rowStarts[index + 1]):
+                    newBeliefs[columns[k]] += belief * probabilities[k]
+        else:
+            for index, belief in enumerate(self.beliefs):
+                if belief == 0: continue
+                for successor, prob in self.getSuccessorIndices(gameState, index):
+                    newBeliefs[successor] += belief * prob
+        total = sum(newBeliefs)
+        if total == 0:
+            self.initializeUniformly(gameState)
+            return
+        if abs(total - 1.0) > 1e-12:
+            newBeliefs = array('d', [b / total for b in newBeliefs])
+        self.beliefs = newBeliefs
+
+    def getBeliefDistribution(self):
+        beliefs = util.Counter()
+        if self.captured:
+            beliefs[self.getJailPosition()] = 1.0
+            return beliefs
+        for position, belief in zip(self.legalPositions, self.beliefs):
+            if belief > 0: beliefs[position] = belief
+        return beliefs
+
+class ArrayParticleFilter(InferenceModule):
+    """
+    A particle filter that stores the particles as an array of indices into
+    self.legalPositions.
+
+    Particles are reweighted by looking their emission probability up in a
+    per-observation vector and resampled systematically in O(N), so 10k+
+    particles run in real time.  Ghosts in STATIONARY_GHOSTS move through
+    the same cached transition matrices as in ArrayExactInference.
+
+    Use it with -a inference=ArrayParticleFilter.
+    """
+
+    def __init__(self, ghostAgent, numParticles=300):
+        InferenceModule.__init__(self, ghostAgent)
+        self.setNumParticles(numParticles)
+
+    def setNumParticles(self, numParticles):
+        self.numParticles = numParticles
+
+    def initialize(self, gameState):
+        InferenceModule.initialize(self, gameState)
+        self.positionIndex = dict([(p, i) for i, p in enumerate(self.legalPositions)])
+        self.pacmanDistances = {}
+        transitions = getTransitionMatrix(gameState, self.ghostAgent,
+                                          self.legalPositions, self.positionIndex)
+        self.samplers = None
+        if transitions != None:
+            self.samplers = getTransitionSamplers(transitions)
+
+    def initializeUniformly(self, gameState):
+        "Spreads the particles evenly over the legal positions."
+        numPositions = len(self.legalPositions)
+        self.particles = array('i', [i % numPositions for i in range(self.numParticles)])
+        self.captured = False
+
+    def observe(self, observation, gameState):
+        noisyDistance = observation
+        if noisyDistance == None:
+            self.captured = True
+            return
+        distances = getPacmanDistances(gameState.getPacmanPosition(), self.legalPositions, self.pacmanDistances)
+        emissions = getEmissions(noisyDistance, distances)
+        weights = [emissions[p] for p in self.particles]
+        if sum(weights) == 0:
+            self.initializeUniformly(gameState)
+            return
+        particles = self.particles
+        self.particles = array('i', [particles[i] for i in systematicResample(weights, self.numParticles)])
+
+    def elapseTime(self, gameState):
+        if self.captured: return
+        counts = collections.Counter(self.particles)
+        samplers = self.samplers
+        if samplers == None:
+            # Query the ghost agent once for every occupied position
+            agent, legalPositions, positionIndex = self.ghostAgent, self.legalPositions, self.positionIndex
+            samplers = dict([(p, getSuccessorSampler(getSuccessorIndices(gameState, agent, legalPositions[p], positionIndex)))
+                             for p in counts])
+        # The particles are interchangeable, so those at a position move together
+        particles = array('i')
+        for p in sorted(counts):
+            particles.extend(samplers[p].sampleMany(counts[p]))
+        self.particles = particles
+
+    def getBeliefDistribution(self):
+        beliefs = util.Counter()
+        if self.captured:
+            beliefs[self.getJailPosition()] = 1.0
+            return beliefs
+        counts = [0] * len(self.legalPositions)
+        for p in self.particles:
+            counts[p] += 1
+        for position, count in zip(self.legalPositions, counts):
+            if count > 0: beliefs[position] = float(count) / self.numParticles
+        return beliefs
+
 class ParticleFilter(InferenceModule):
     """
     A particle filter for approximately tracking a single ghost.
@@ -330,25 +586,29 @@ class MarginalInference(InferenceModule):
     about ghosts.
     """
 
+    def getJointInference(self):
+        "Returns the shared joint inference module."
+        return jointInference
+
     def initializeUniformly(self, gameState):
         "Set the belief state to an initial, prior value."
         if self.index == 1:
-            jointInference.initialize(gameState, self.legalPositions)
-        jointInference.addGhostAgent(self.ghostAgent)
+            self.getJointInference().initialize(gameState, self.legalPositions)
+        self.getJointInference().addGhostAgent(self.ghostAgent)
 
     def observeState(self, gameState):
         "Update beliefs based on the given distance observation and gameState."
         if self.index == 1:
-            jointInference.observeState(gameState)
+            self.getJointInference().observeState(gameState)
 
     def elapseTime(self, gameState):
         "Update beliefs for a time step elapsing from a gameState."
         if self.index == 1:
-            jointInference.elapseTime(gameState)
+            self.getJointInference().elapseTime(gameState)
 
     def getBeliefDistribution(self):
         "Returns the marginal belief over a particular ghost by summing out the others."
-        jointDistribution = jointInference.getBeliefDistribution()
+        jointDistribution = self.getJointInference().getBeliefDistribution()
         dist = util.Counter()
         for t, prob in list(jointDistribution.items()):
             dist[t[self.index - 1]] += prob
@@ -514,6 +774,141 @@ class JointParticleFilter(object):
 # One JointInference module is shared globally across instances of MarginalInference
 jointInference = JointParticleFilter()
 
+class ArrayJointParticleFilter(JointParticleFilter):
+    """
+    A JointParticleFilter that stores the particles as a flat, row-major
+    (numParticles x numGhosts) array of indices into legalPositions.  A
+    captured ghost is stored as -1 and reported at its jail position.
+
+    Weights are products of per-ghost emission vectors and resampling is
+    systematic, as in ArrayParticleFilter.  Ghosts in STATIONARY_GHOSTS
+    move through their cached transition matrices; other ghosts are queried
+    once per distinct particle.
+    """
+
+    def initialize(self, gameState, legalPositions):
+        self.positionIndex = dict([(p, i) for i, p in enumerate(legalPositions)])
+        self.pacmanDistances = {}
+        self.samplers = None
+        JointParticleFilter.initialize(self, gameState, legalPositions)
+
+    def initializeParticles(self):
+        "Spreads each ghost's particles evenly over the legal positions, in independent random orders."
+        numPositions = len(self.legalPositions)
+        columns = []
+        for i in range(self.numGhosts):
+            column = [k % numPositions for k in range(self.numParticles)]
+            random.shuffle(column)
+            columns.append(column)
+        self.particles = array('i', [c[k] for k in range(self.numParticles) for c in columns])
+
+    def sendToJail(self, ghostIndex):
+        "Moves ghost ghostIndex to jail in every particle."
+        for k in range(ghostIndex, len(self.particles), self.numGhosts):
+            self.particles[k] = -1
+
+    def observeState(self, gameState):
+        noisyDistances = gameState.getNoisyGhostDistances()
+        if len(noisyDistances) < self.numGhosts:
+            return
+        numGhosts, numParticles = self.numGhosts, self.numParticles
+        distances = getPacmanDistances(gameState.getPacmanPosition(), self.legalPositions, self.pacmanDistances)
+        weights = [1.0] * numParticles
+        for i, noisyDistance in enumerate(noisyDistances[:numGhosts]):
+            if noisyDistance == None:
+                self.sendToJail(i)
+                continue
+            emissions = getEmissions(noisyDistance, distances)
+            column = self.particles[i::numGhosts]
+            weights = [w * emissions[p] for w, p in zip(weights, column)]
+        if sum(weights) == 0:
+            self.initializeParticles()
+            for i, noisyDistance in enumerate(noisyDistances[:numGhosts]):
+                if noisyDistance == None: self.sendToJail(i)
+            return
+        particles = self.particles
+        newParticles = array('i')
+        for n in systematicResample(weights, numParticles):
+            newParticles.extend(particles[n * numGhosts:(n + 1) * numGhosts])
+        self.particles = newParticles
+
+    def elapseTime(self, gameState):
+        numGhosts = self.numGhosts
+        if self.samplers == None:
+            self.samplers = []
+            for agent in self.ghostAgents:
+                transitions = getTransitionMatrix(gameState, agent, self.legalPositions, self.positionIndex)
+                self.samplers.append(getTransitionSamplers(transitions) if transitions != None else None)
+        moves = {}
+        particles = self.particles
+        for i in range(numGhosts):
+            if self.samplers[i] == None:
+                moves[i] = self.getParticleMoves(gameState, i)
+        for start in range(0, len(particles), numGhosts):
+            particle = tuple(particles[start:start + numGhosts])
+            for i, p in enumerate(particle):
+                if p < 0: continue
+                if i in moves:
+                    particles[start + i] = moves[i][particle].sample()
+                else:
+                    particles[start + i] = self.samplers[i][p].sample()
+
+    def getParticleMoves(self, gameState, ghostIndex):
+        """
+        Returns a dictionary from each distinct particle to a util.Sampler
+        of the moves of ghost ghostIndex in it.
+        Particles where the ghost is in jail are left out, as it stays there.
+        """
+        numGhosts, legalPositions = self.numGhosts, self.legalPositions
+        agent = self.ghostAgents[ghostIndex]
+        moves = {}
+        for k in range(0, len(self.particles), numGhosts):
+            particle = tuple(self.particles[k:k + numGhosts])
+            if particle in moves or particle[ghostIndex] < 0: continue
+            positions = [legalPositions[p] if p >= 0 else self.getJailPosition(i)
+                         for i, p in enumerate(particle)]
+            setGhostPositions(gameState, positions)
+            moves[particle] = getSuccessorSampler(getSuccessorIndices(gameState, agent, positions[ghostIndex], self.positionIndex))
+        return moves
+
+    def getMarginalDistribution(self, ghostIndex):
+        "Returns the belief over the position of ghost ghostIndex alone."
+        counts = {}
+        for p in self.particles[ghostIndex::self.numGhosts]:
+            counts[p] = counts.get(p, 0) + 1
+        dist = util.Counter()
+        for p, count in counts.items():
+            position = self.legalPositions[p] if p >= 0 else self.getJailPosition(ghostIndex)
+            dist[position] = float(count) / self.numParticles
+        return dist
+
+    def getBeliefDistribution(self):
+        numGhosts = self.numGhosts
+        jail = [self.getJailPosition(i) for i in range(numGhosts)]
+        dist = util.Counter()
+        for k in range(0, len(self.particles), numGhosts):
+            particle = tuple([self.legalPositions[p] if p >= 0 else jail[i]
+                              for i, p in enumerate(self.particles[k:k + numGhosts])])
+            dist[particle] += 1
+        dist.divideAll(self.numParticles)
+        return dist
+
+# The ArrayJointParticleFilter shared by instances of ArrayMarginalInference
+arrayJointInference = ArrayJointParticleFilter()
+
+class ArrayMarginalInference(MarginalInference):
+    """
+    MarginalInference over the shared ArrayJointParticleFilter.
+
+    Use it with -a inference=ArrayMarginalInference.
+    """
+
+    def getJointInference(self):
+        return arrayJointInference
+
+    def getBeliefDistribution(self):
+        return arrayJointInference.getMarginalDistribution(self.index - 1)
+
 def getPositionDistributionForGhost(gameState, ghostIndex, agent):
     """
     Returns the distribution over positions for a ghost, using the supplied
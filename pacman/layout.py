@@ -12,16 +12,24 @@
 # Pieter Abbeel (pabbeel@cs.berkeley.edu).
 
 
+from __future__ import print_function
 from builtins import zip
 from builtins import range
 from builtins import object
 from util import manhattanDistance
 from game import Grid
-import os
+from game import Directions
+from array import array
+import os, sys, zlib, struct, hashlib
 import random
-from functools import reduce
 
 VISIBILITY_MATRIX_CACHE = {}
+# Parsed layouts by the sha1 digest of their text (see parseLayout)
+PARSED_LAYOUTS = {}
+
+# The rays of the visibility matrix: direction, dx, dy
+_RAYS = ((Directions.NORTH, 0, 1), (Directions.SOUTH, 0, -1), (Directions.EAST, 1, 0), (Directions.WEST, -1, 0))
+_RAY_INDEX = dict([(direction, ray) for ray, (direction, dx, dy) in enumerate(_RAYS)])
 
 class Layout(object):
     """
@@ -39,35 +47,42 @@ class Layout(object):
         self.processLayoutText(layoutText)
         self.layoutText = layoutText
         self.totalFood = len(self.food.asList())
-        # self.initializeVisibilityMatrix()
+        self.visibility = None # see initializeVisibilityMatrix
 
     def getNumGhosts(self):
         return self.numGhosts
 
     def initializeVisibilityMatrix(self):
-        global VISIBILITY_MATRIX_CACHE
-        if reduce(str.__add__, self.layoutText) not in VISIBILITY_MATRIX_CACHE:
-            from game import Directions
-            vecs = [(-0.5,0), (0.5,0),(0,-0.5),(0,0.5)]
-            dirs = [Directions.NORTH, Directions.SOUTH, Directions.WEST, Directions.EAST]
-            vis = Grid(self.width, self.height, {Directions.NORTH:set(), Directions.SOUTH:set(), Directions.EAST:set(), Directions.WEST:set(), Directions.STOP:set()})
-            for x in range(self.width):
-                for y in range(self.height):
-                    if self.walls[x][y] == False:
-                        for vec, direction in zip(vecs, dirs):
-                            dx, dy = vec
-                            nextx, nexty = x + dx, y + dy
-                            while (nextx + nexty) != int(nextx) + int(nexty) or not self.walls[int(nextx)][int(nexty)] :
-                                vis[x][y][direction].add((nextx, nexty))
-                                nextx, nexty = x + dx, y + dy
-            self.visibility = vis
-            VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)] = vis
-        else:
-            self.visibility = VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)]
+        """
+        Marches a ray from every open cell in each direction until it hits
+        a wall.  Rays are straight, so what Pacman sees from (x, y) facing a
+        direction is every half-step along the ray up to its length, which
+        is stored in visibility[4 * (x * height + y) + ray].  Layouts with
+        the same text share the matrix.
+        """
+        key = layoutKey(self.layoutText)
+        if key not in VISIBILITY_MATRIX_CACHE:
+            walls = self.walls
+            width, height = self.width, self.height
+            vis = array('H', [0]) * (4 * width * height)
+            for x in range(width):
+                for y in range(height):
+                    if walls.get(x, y): continue
+                    for ray, (direction, dx, dy) in enumerate(_RAYS):
+                        cells = 0
+                        nextx, nexty = x + dx, y + dy
+                        while 0 <= nextx < width and 0 <= nexty < height and not walls.get(nextx, nexty):
+                            cells += 1
+                            nextx, nexty = nextx + dx, nexty + dy
+                        # The half-steps between the open cells, and the one before the wall
+                        vis[4 * (x * height + y) + ray] = 2 * cells + 1
+            VISIBILITY_MATRIX_CACHE[key] = vis
+        self.visibility = VISIBILITY_MATRIX_CACHE[key]
+        return self.visibility
 
     def isWall(self, pos):
         x, col = pos
-        return self.walls[x][col]
+        return self.walls.get(x, col)
 
     def getRandomLegalPosition(self):
         x = random.choice(list(range(self.width)))
@@ -87,14 +102,25 @@ class Layout(object):
         return pos
 
     def isVisibleFrom(self, ghostPos, pacPos, pacDirection):
-        row, col = [int(x) for x in pacPos]
-        return ghostPos in self.visibility[row][col][pacDirection]
+        ray = _RAY_INDEX.get(pacDirection)
+        if ray is None or ghostPos is None: return False
+        x, y = [int(c) for c in pacPos]
+        direction, dx, dy = _RAYS[ray]
+        if dx:
+            halfSteps, offset = 2 * (ghostPos[0] - x) * dx, ghostPos[1] - y
+        else:
+            halfSteps, offset = 2 * (ghostPos[1] - y) * dy, ghostPos[0] - x
+        if offset != 0 or halfSteps <= 0 or halfSteps != int(halfSteps): return False
+        visibility = self.visibility
+        if visibility is None: visibility = self.initializeVisibilityMatrix()
+        return halfSteps <= visibility[4 * (x * self.height + y) + ray]
 
     def __str__(self):
         return "\n".join(self.layoutText)
 
     def deepCopy(self):
-        return Layout(self.layoutText[:])
+        "Layouts never change once parsed, so copies share the original."
+        return self
 
     def processLayoutText(self, layoutText):
         """
@@ -132,22 +158,209 @@ class Layout(object):
         elif layoutChar in  ['1', '2', '3', '4']:
             self.agentPositions.append( (int(layoutChar), (x,y)))
             self.numGhosts += 1
-def getLayout(name, back = 2):
-    if name.endswith('.lay'):
-        layout = tryToLoad('layouts/' + name)
-        if layout == None: layout = tryToLoad(name)
-    else:
-        layout = tryToLoad('layouts/' + name + '.lay')
-        if layout == None: layout = tryToLoad(name + '.lay')
-    if layout == None and back >= 0:
-        curdir = os.path.abspath('.')
-        os.chdir('..')
-        layout = getLayout(name, back -1)
-        os.chdir(curdir)
+
+def layoutKey(layoutText):
+    "The sha1 digest of the text of a layout, which identifies its parsed Layout."
+    return hashlib.sha1('\n'.join(layoutText).encode('utf-8')).digest()
+
+def parseLayout(layoutText):
+    """
+    Returns the Layout of layoutText, parsing it only the first time a
+    layout with that text is seen.
+    """
+    key = layoutKey(layoutText)
+    layout = PARSED_LAYOUTS.get(key)
+    if layout is None:
+        layout = PARSED_LAYOUTS[key] = Layout(list(layoutText))
     return layout
 
+####################
+# Compiled layouts #
+####################
+
+# A compiled layout file (.layc) holds parsed layouts, so loading them does
+# not go through processLayoutChar.  It is the magic 'PMLY', a version and
+# the number of layouts followed by a zlib-compressed body with, for every
+# layout, its name, its text, its width, height and number of ghosts and
+# four arrays of cells x * height + y: walls, food, capsules and agent
+# positions (shifted left one bit, with the low bit set for Pacman).
+
+_MAGIC = b'PMLY'
+_VERSION = 1
+_FILE_HEADER = struct.Struct('<4sBI')
+_SIZES = struct.Struct('<HHH')
+
+def _packCells(cells):
+    cells = array('I', cells)
+    if sys.byteorder != 'little': cells.byteswap()
+    return struct.pack('<I', len(cells)) + cells.tobytes()
+
+def _unpackCells(buf, offset):
+    length, = struct.unpack_from('<I', buf, offset)
+    offset += 4
+    cells = array('I')
+    cells.frombytes(buf[offset:offset + 4 * length])
+    if sys.byteorder != 'little': cells.byteswap()
+    return cells, offset + 4 * length
+
+def _packString(text, format):
+    data = text.encode('utf-8')
+    return struct.pack(format, len(data)) + data
+
+def _unpackString(buf, offset, format):
+    length, = struct.unpack_from(format, buf, offset)
+    offset += struct.calcsize(format)
+    return buf[offset:offset + length].decode('utf-8'), offset + length
+
+def compileLayouts(path, layouts):
+    "Writes the (name, Layout) pairs in layouts to a compiled layout file."
+    parts = []
+    for name, layout in layouts:
+        height = layout.height
+        parts.append(_packString(name, '<H'))
+        parts.append(_packString('\n'.join(layout.layoutText), '<I'))
+        parts.append(_SIZES.pack(layout.width, height, layout.numGhosts))
+        parts.append(_packCells([x * height + y for x, y in layout.walls.asList()]))
+        parts.append(_packCells([x * height + y for x, y in layout.food.asList()]))
+        parts.append(_packCells([x * height + y for x, y in layout.capsules]))
+        parts.append(_packCells([(x * height + y) << 1 | int(isPacman) for isPacman, (x, y) in layout.agentPositions]))
+    with open(path, 'wb') as f:
+        f.write(_FILE_HEADER.pack(_MAGIC, _VERSION, len(parts) // 7))
+        f.write(zlib.compress(b''.join(parts)))
+
+def readCompiledLayouts(path):
+    "Returns the (name, Layout) pairs in a compiled layout file."
+    with open(path, 'rb') as f:
+        header = f.read(_FILE_HEADER.size)
+        if len(header) < _FILE_HEADER.size: raise Exception('%s is not a compiled layout file' % path)
+        magic, version, count = _FILE_HEADER.unpack(header)
+        if magic != _MAGIC or version != _VERSION:
+            raise Exception('%s is not a compiled layout file' % path)
+        buf = zlib.decompress(f.read())
+    layouts = []
+    offset = 0
+    for i in range(count):
+        name, offset = _unpackString(buf, offset, '<H')
+        text, offset = _unpackString(buf, offset, '<I')
+        layoutText = text.split('\n')
+        key = layoutKey(layoutText)
+        width, height, numGhosts = _SIZES.unpack_from(buf, offset)
+        offset += _SIZES.size
+        arrays = []
+        for j in range(4):
+            cells, offset = _unpackCells(buf, offset)
+            arrays.append(cells)
+        if key not in PARSED_LAYOUTS:
+            PARSED_LAYOUTS[key] = _buildLayout(layoutText, width, height, numGhosts, *arrays)
+        layouts.append((name, PARSED_LAYOUTS[key]))
+    return layouts
+
+def _buildLayout(layoutText, width, height, numGhosts, walls, food, capsules, agents):
+    "Makes a Layout from compiled cells without parsing its text."
+    layout = Layout.__new__(Layout)
+    layout.width = width
+    layout.height = height
+    layout.walls = Grid(width, height, False)
+    layout.food = Grid(width, height, False)
+    for grid, cells in ((layout.walls, walls), (layout.food, food)):
+        for cell in cells:
+            grid[cell // height][cell % height] = True
+    layout.capsules = [(cell // height, cell % height) for cell in capsules]
+    layout.agentPositions = [(bool(cell & 1), ((cell >> 1) // height, (cell >> 1) % height)) for cell in agents]
+    layout.numGhosts = numGhosts
+    layout.layoutText = layoutText
+    layout.visibility = None
+    layout.totalFood = len(food)
+    return layout
+
+############
+# Registry #
+############
+
+class LayoutRegistry(object):
+    """
+    Finds layouts by name and keeps them parsed.
+
+    A name is looked up first among the layouts preloaded with preload(),
+    then in the layouts directory and the current directory, then in those
+    of up to back parent directories, as NAME.lay or in a compiled
+    layouts.layc.  Each name is resolved once per working directory.
+    """
+
+    def __init__(self):
+        self.preloaded = {}
+        self.resolved = {}
+        self.compiled = {}
+
+    def preload(self, path):
+        """
+        Loads every layout in a directory (its .lay and .layc files) or in
+        a single layout file, so that getLayout finds them by name.
+        """
+        if os.path.isdir(path):
+            paths = [os.path.join(path, f) for f in sorted(os.listdir(path))]
+        else:
+            paths = [path]
+        for fullname in paths:
+            if fullname.endswith('.layc'):
+                for name, layout in self._readCompiled(fullname):
+                    self.preloaded[name] = layout
+            elif fullname.endswith('.lay'):
+                layout = tryToLoad(fullname)
+                if layout is not None:
+                    self.preloaded[os.path.basename(fullname)[:-len('.lay')]] = layout
+
+    def getLayout(self, name, back=2):
+        key = name[:-len('.lay')] if name.endswith('.lay') else name
+        if key in self.preloaded: return self.preloaded[key]
+        resolvedKey = (os.getcwd(), name, back)
+        layout = self.resolved.get(resolvedKey)
+        if layout is None:
+            layout = self._find(name, key, back)
+            if layout is not None: self.resolved[resolvedKey] = layout
+        return layout
+
+    def _find(self, name, key, back):
+        fileName = name if name.endswith('.lay') else name + '.lay'
+        directory = os.path.abspath('.')
+        for level in range(back + 2):
+            for fullname in (os.path.join(directory, 'layouts', fileName), os.path.join(directory, fileName)):
+                layout = tryToLoad(fullname)
+                if layout is not None: return layout
+            compiled = os.path.join(directory, 'layouts.layc')
+            if os.path.exists(compiled):
+                layouts = dict(self._readCompiled(compiled))
+                if key in layouts: return layouts[key]
+            directory = os.path.dirname(directory)
+        return None
+
+    def _readCompiled(self, path):
+        path = os.path.abspath(path)
+        if path not in self.compiled:
+            self.compiled[path] = readCompiledLayouts(path)
+        return self.compiled[path]
+
+LAYOUTS = LayoutRegistry()
+
+def getLayout(name, back = 2):
+    return LAYOUTS.getLayout(name, back)
+
 def tryToLoad(fullname):
     if(not os.path.exists(fullname)): return None
     f = open(fullname)
-    try: return Layout([line.strip() for line in f])
+    try: return parseLayout([line.strip() for line in f])
     finally: f.close()
+
+if __name__ == '__main__':
+    usage = 'USAGE: python layout.py compile OUTPUT.layc LAYOUT_FILE_OR_DIRECTORY...\n' \
+            '       python layout.py list COMPILED_LAYOUTS'
+    if len(sys.argv) > 3 and sys.argv[1] == 'compile':
+        registry = LayoutRegistry()
+        for path in sys.argv[3:]:
+            registry.preload(path)
+        compileLayouts(sys.argv[2], sorted(registry.preloaded.items()))
+    elif len(sys.argv) == 3 and sys.argv[1] == 'list':
+        for name, layout in readCompiledLayouts(sys.argv[2]):
+            print('%s\t%dx%d\t%d ghosts\t%d food' % (name, layout.width, layout.height, layout.numGhosts, len(layout.food.asList())))
+    else:
+        print(usage)
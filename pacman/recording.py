@@ -0,0 +1,293 @@
+# recording.py
+# ------------
+# Compact recordings of Pacman games, written by pacman.py -r and replayed
+# with pacman.py --replay.
+#
+# A recording file holds one or more games, so that many games can be kept
+# and indexed together.  It is the magic 'PMRG' and a version followed by
+# records, each one a type byte, the length of its payload and the payload:
+#
+#   L  a layout: its fingerprint and its text, compressed with zlib.  Each
+#      layout is stored once per file, however many games are played on it.
+#   G  a game: a fixed-size summary (layout fingerprint, plies, agents,
+#      keyframe interval, score and result) followed by a zlib-compressed
+#      body with one byte per ply (agent index and direction) and a
+#      keyframe of the state every keyframeInterval plies.
+#
+# The summaries can be read without decompressing the games, and the
+# keyframes let a replay start at any ply after simulating at most
+# keyframeInterval - 1 moves.
+#
+#   python recording.py index recorded-game-*        lists the games in the files
+#   python recording.py pack games.rec recorded-*    copies games into one file
+
+from __future__ import print_function
+from builtins import zip
+from builtins import range
+from builtins import object
+from array import array
+import io, os, sys, zlib, struct, hashlib
+
+KEYFRAME_INTERVAL = 64
+
+DIRECTIONS = ('North', 'South', 'East', 'West', 'Stop')
+_DIRECTION_CODES = dict([(d, i) for i, d in enumerate(DIRECTIONS)])
+# Each ply is one byte: the agent index in the top five bits and the
+# direction code in the bottom three, so at most 32 agents can be recorded.
+MAX_AGENTS = 32
+
+_MAGIC = b'PMRG'
+_VERSION = 1
+_FILE_HEADER = struct.Struct('<4sB')
+_RECORD_HEADER = struct.Struct('<cI')
+_LAYOUT = b'L'
+_GAME = b'G'
+# layout fingerprint, plies, agents, keyframe interval, score, win
+_SUMMARY = struct.Struct('<20sIBHdB')
+# score, whether it is a float, win, lose, agents
+_KEYFRAME = struct.Struct('<dBBBB')
+# x, y, which of them are floats, direction, scared timer, food carried, food returned
+_AGENT = struct.Struct('<ddBbhHH')
+
+def layoutFingerprint(layoutText):
+    "The sha1 digest of the text of a layout."
+    return hashlib.sha1('\n'.join(layoutText).encode('utf-8')).digest()
+
+#############
+# Keyframes #
+#############
+
+def encodeState(state):
+    "Packs the parts of a GameState that change during a game."
+    data = state.data
+    parts = [_KEYFRAME.pack(data.score, int(type(data.score) is float), int(data._win), int(data._lose), len(data.agentStates))]
+    for agentState in data.agentStates:
+        x, y = agentState.configuration.getPosition()
+        floats = int(type(x) is float) | int(type(y) is float) << 1
+        parts.append(_AGENT.pack(x, y, floats, _DIRECTION_CODES[agentState.configuration.getDirection()],
+                                 agentState.scaredTimer, getattr(agentState, 'numCarrying', 0),
+                                 getattr(agentState, 'numReturned', 0)))
+    height = data.food.height
+    food = array('H', [x * height + y for x, y in data.food.asList()])
+    capsules = array('H')
+    for x, y in data.capsules:
+        capsules.extend((x, y))
+    for cells in (food, capsules):
+        if sys.byteorder != 'little': cells.byteswap()
+        parts.append(struct.pack('<I', len(cells)) + cells.tobytes())
+    return b''.join(parts)
+
+def decodeState(buf, initialState):
+    "Returns a copy of initialState with the parts packed by encodeState."
+    from game import Configuration
+    state = initialState.deepCopy()
+    data = state.data
+    score, scoreIsFloat, win, lose, numAgents = _KEYFRAME.unpack_from(buf, 0)
+    data.score = score if scoreIsFloat else int(score)
+    data._win, data._lose = bool(win), bool(lose)
+    data._eaten = [False] * numAgents
+    offset = _KEYFRAME.size
+    for agentState in data.agentStates:
+        x, y, floats, direction, scaredTimer, numCarrying, numReturned = _AGENT.unpack_from(buf, offset)
+        offset += _AGENT.size
+        position = (x if floats & 1 else int(x), y if floats & 2 else int(y))
+        agentState.configuration = Configuration(position, DIRECTIONS[direction])
+        agentState.scaredTimer = scaredTimer
+        if hasattr(agentState, 'numCarrying'): agentState.numCarrying = numCarrying
+        if hasattr(agentState, 'numReturned'): agentState.numReturned = numReturned
+    cellLists = []
+    for i in range(2):
+        length, = struct.unpack_from('<I', buf, offset)
+        offset += 4
+        cells = array('H')
+        cells.frombytes(buf[offset:offset + 2 * length])
+        if sys.byteorder != 'little': cells.byteswap()
+        offset += 2 * length
+        cellLists.append(cells)
+    food, capsules = cellLists
+    height = data.food.height
+    for x, y in data.food.asList():
+        data.food[x][y] = False
+    for cell in food:
+        data.food[cell // height][cell % height] = True
+    data.capsules = [(capsules[i], capsules[i + 1]) for i in range(0, len(capsules), 2)]
+    return state
+
+##############
+# Recordings #
+##############
+
+class Recording(object):
+    """
+    A recorded game: its layout, the (agentIndex, action) of every ply and a
+    keyframe every keyframeInterval plies.  keyframes[k] is the state after
+    (k + 1) * keyframeInterval plies.
+    """
+
+    def __init__(self, layoutText, numAgents, actions, keyframeInterval, keyframes, score, win):
+        self.layoutText = layoutText
+        self.numAgents = numAgents
+        self.actions = actions
+        self.keyframeInterval = keyframeInterval
+        self.keyframes = keyframes
+        self.score = score
+        self.win = win
+
+    def __len__(self):
+        return len(self.actions)
+
+    def getLayout(self):
+        import layout
+        return layout.parseLayout(self.layoutText)
+
+    def getInitialState(self, stateClass):
+        "The state before the first ply, as an instance of stateClass (like pacman.GameState)."
+        state = stateClass()
+        state.initialize(self.getLayout(), self.numAgents - 1)
+        return state
+
+    def stateAt(self, initialState, ply):
+        """
+        Returns the state after the first ply plies, starting from the
+        closest keyframe instead of the initial state.
+        """
+        if not 0 <= ply <= len(self.actions):
+            raise IndexError('The game has %d plies, not %d' % (len(self.actions), ply))
+        k = min(ply // self.keyframeInterval, len(self.keyframes))
+        if k == 0:
+            state = initialState
+        else:
+            state = decodeState(self.keyframes[k - 1], initialState)
+        for agentIndex, action in self.actions[k * self.keyframeInterval:ply]:
+            state = state.generateSuccessor(agentIndex, action)
+        return state
+
+def makeRecording(layout, initialState, moveHistory, keyframeInterval=KEYFRAME_INTERVAL):
+    "Records a game, replaying its moveHistory from initialState to take the keyframes."
+    numAgents = len(initialState.data.agentStates)
+    if numAgents > MAX_AGENTS:
+        raise ValueError('Cannot record a game with %d agents: recordings hold at most %d' % (numAgents, MAX_AGENTS))
+    keyframes = []
+    state = initialState
+    for ply, (agentIndex, action) in enumerate(moveHistory):
+        state = state.generateSuccessor(agentIndex, action)
+        if (ply + 1) % keyframeInterval == 0:
+            keyframes.append(encodeState(state))
+    return Recording(list(layout.layoutText), numAgents, list(moveHistory),
+                     keyframeInterval, keyframes, state.getScore(), state.isWin())
+
+def _encodeGame(recording, fingerprint):
+    actions = bytearray([agentIndex << 3 | _DIRECTION_CODES[action] for agentIndex, action in recording.actions])
+    offsets = array('I')
+    position = 0
+    for keyframe in recording.keyframes:
+        offsets.append(position)
+        position += len(keyframe)
+    if sys.byteorder != 'little': offsets.byteswap()
+    body = struct.pack('<I', len(recording.keyframes)) + bytes(actions) + offsets.tobytes() + b''.join(recording.keyframes)
+    summary = _SUMMARY.pack(fingerprint, len(recording.actions), recording.numAgents,
+                            recording.keyframeInterval, recording.score, int(recording.win))
+    return summary + zlib.compress(body)
+
+def _decodeGame(payload, layoutText):
+    fingerprint, plies, numAgents, keyframeInterval, score, win = _SUMMARY.unpack_from(payload, 0)
+    body = zlib.decompress(payload[_SUMMARY.size:])
+    numKeyframes, = struct.unpack_from('<I', body, 0)
+    offset = 4
+    actions = [(code >> 3, DIRECTIONS[code & 7]) for code in bytearray(body[offset:offset + plies])]
+    offset += plies
+    offsets = array('I')
+    offsets.frombytes(body[offset:offset + 4 * numKeyframes])
+    if sys.byteorder != 'little': offsets.byteswap()
+    offset += 4 * numKeyframes
+    ends = list(offsets[1:]) + [len(body) - offset]
+    keyframes = [body[offset + start:offset + end] for start, end in zip(offsets, ends)]
+    return Recording(layoutText, numAgents, actions, keyframeInterval, keyframes, score, bool(win))
+
+#########
+# Files #
+#########
+
+def _readRecords(f, path):
+    header = f.read(_FILE_HEADER.size)
+    magic, version = _FILE_HEADER.unpack(header) if len(header) == _FILE_HEADER.size else (None, None)
+    if magic != _MAGIC or version != _VERSION:
+        raise Exception('%s is not a game recording' % path)
+    while True:
+        offset = f.tell()
+        header = f.read(_RECORD_HEADER.size)
+        if len(header) < _RECORD_HEADER.size: return
+        kind, length = _RECORD_HEADER.unpack(header)
+        yield kind, offset, length
+
+def isRecording(path):
+    with io.open(path, 'rb') as f:
+        return f.read(len(_MAGIC)) == _MAGIC
+
+def writeRecordings(path, recordings):
+    """
+    Appends recordings to the file at path, storing each layout that is
+    not in the file yet.
+    """
+    fingerprints = set()
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with io.open(path, 'rb') as f:
+            for kind, offset, length in _readRecords(f, path):
+                if kind == _LAYOUT: fingerprints.add(f.read(20))
+                f.seek(offset + _RECORD_HEADER.size + length)
+    with io.open(path, 'ab') as f:
+        if f.tell() == 0: f.write(_FILE_HEADER.pack(_MAGIC, _VERSION))
+        for recording in recordings:
+            fingerprint = layoutFingerprint(recording.layoutText)
+            if fingerprint not in fingerprints:
+                payload = fingerprint + zlib.compress('\n'.join(recording.layoutText).encode('utf-8'))
+                f.write(_RECORD_HEADER.pack(_LAYOUT, len(payload)) + payload)
+                fingerprints.add(fingerprint)
+            payload = _encodeGame(recording, fingerprint)
+            f.write(_RECORD_HEADER.pack(_GAME, len(payload)) + payload)
+
+def readRecordings(path):
+    "Yields the recordings in a file."
+    layouts = {}
+    with io.open(path, 'rb') as f:
+        for kind, offset, length in _readRecords(f, path):
+            payload = f.read(length)
+            if kind == _LAYOUT:
+                layouts[payload[:20]] = zlib.decompress(payload[20:]).decode('utf-8').split('\n')
+            elif kind == _GAME:
+                yield _decodeGame(payload, layouts[payload[:20]])
+
+def loadRecording(path, index=0):
+    "Returns the index-th recording in a file."
+    for i, recording in enumerate(readRecordings(path)):
+        if i == index: return recording
+    raise IndexError('%s has no game %d' % (path, index))
+
+def indexRecordings(paths):
+    """
+    Lists the games in the given files without decompressing them, as
+    (path, index, plies, agents, score, win) tuples.
+    """
+    games = []
+    for path in paths:
+        with io.open(path, 'rb') as f:
+            index = 0
+            for kind, offset, length in _readRecords(f, path):
+                if kind == _GAME:
+                    fingerprint, plies, numAgents, keyframeInterval, score, win = _SUMMARY.unpack(f.read(_SUMMARY.size))
+                    games.append((path, index, plies, numAgents, score, bool(win)))
+                    index += 1
+                f.seek(offset + _RECORD_HEADER.size + length)
+    return games
+
+if __name__ == '__main__':
+    usage = 'USAGE: python recording.py index RECORDING...\n' \
+            '       python recording.py pack OUTPUT RECORDING...'
+    if len(sys.argv) > 2 and sys.argv[1] == 'index':
+        for path, index, plies, numAgents, score, win in indexRecordings(sys.argv[2:]):
+            print('%s\t%d\t%d plies\t%d agents\t%s\t%s' % (path, index, plies, numAgents, score, ['Loss', 'Win'][win]))
+    elif len(sys.argv) > 3 and sys.argv[1] == 'pack':
+        for path in sys.argv[3:]:
+            writeRecordings(sys.argv[2], readRecordings(path))
+    else:
+        print(usage)
@@ -0,0 +1,425 @@
+# trajectoryLog.py
+# ----------------
+# Logs of the states observed by Pacman.  By default every tick gets the
+# CSV line of the agent's printLineData in the info file.  The compact binary
+# log, asked for with --binaryLog, replaces the info file for agents whose
+# printLineData is the stock one, which it can rebuild.
+#
+# A log is the magic 'PMTL' and a version followed by records, each one a
+# type byte, the length of its payload and the payload compressed with zlib:
+#
+#   G  a game: everything that does not change during the game (json), like
+#      the size, the walls map and the food at the first tick
+#   C  a chunk of up to chunkSize ticks of the last game, stored column by
+#      column, each column as typed arrays (little endian)
+#
+# Food is logged as the cells whose food changed since the previous tick, so
+# a tick costs a few dozen bytes before compression.  The records of a game
+# are kept in memory and appended to the log with a single write when the
+# game ends, so games played at the same time by several processes (as with
+# --workers) never interleave.  A log cut short by a crash is read up to its
+# last complete record.
+#
+#   python trajectoryLog.py export info.traj info      writes the old info file
+#   python trajectoryLog.py summary info.traj
+
+from __future__ import print_function
+from builtins import zip
+from builtins import range
+from builtins import object
+from array import array
+import io, os, sys, json, zlib, struct, tempfile
+
+INFO_FILE = 'info'
+TRAJECTORY_FILE = 'info.traj'
+
+CSV_HEADER = "Width, Height, Walls Map, Pacman Position, Pacman Direction, Legal Actions,  Number of Ghosts, Living Ghosts, Ghosts Positions, Ghosts Directions, Ghosts Distances, Pac Dots, Distance Nearest Pac Dot, Food Map, Capsules Positions, Score\n"
+
+_MAGIC = b'PMTL'
+_VERSION = 1
+_FILE_HEADER = struct.Struct('<4sB')
+_RECORD_HEADER = struct.Struct('<cI')
+_ARRAY_HEADER = struct.Struct('<cI')
+_GAME = b'G'
+_CHUNK = b'C'
+
+# Values of the symbol columns, stored as their index in this tuple
+SYMBOLS = (None, False, True, 'North', 'South', 'East', 'West', 'Stop')
+_SYMBOL_CODES = dict([(s, i) for i, s in enumerate(SYMBOLS) if s is not None])
+_NULL_INT = -2 ** 31
+
+# name, kind and values per tick: 'ghosts' is one per ghost, 'ghosts+1' one
+# per agent and None a variable number
+COLUMNS = (('pacmanPosition', 'number', 2),
+           ('pacmanDirection', 'symbol', 1),
+           ('legalActions', 'symbol', None),
+           ('livingGhosts', 'symbol', 'ghosts+1'),
+           ('ghostPositions', 'number', 'ghosts*2'),
+           ('ghostDirections', 'symbol', 'ghosts'),
+           ('ghostDistances', 'number', 'ghosts'),
+           ('numFood', 'number', 1),
+           ('nearestFood', 'number', 1),
+           ('foodChanges', 'number', None),
+           ('capsules', 'number', None),
+           ('score', 'number', 1))
+
+def _columnWidth(width, numGhosts):
+    if width == 'ghosts+1': return numGhosts + 1
+    if width == 'ghosts*2': return 2 * numGhosts
+    if width == 'ghosts': return numGhosts
+    return width
+
+#############
+# Encoding  #
+#############
+
+def _encodeArray(typecode, values):
+    data = array(typecode, values)
+    if sys.byteorder != 'little': data.byteswap()
+    return _ARRAY_HEADER.pack(typecode.encode('ascii'), len(data)) + data.tobytes()
+
+def _decodeArray(buf, offset):
+    typecode, length = _ARRAY_HEADER.unpack_from(buf, offset)
+    typecode = typecode.decode('ascii')
+    data = array(typecode)
+    start = offset + _ARRAY_HEADER.size
+    end = start + length * data.itemsize
+    data.frombytes(buf[start:end])
+    if sys.byteorder != 'little': data.byteswap()
+    return data, end
+
+def _encodeNumbers(values):
+    """
+    Integers (and None) are stored as 32-bit ints; a column with any float or
+    larger integer is stored as doubles, with None as NaN.
+    """
+    if all([v is None or (type(v) is int and _NULL_INT < v < 2 ** 31) for v in values]):
+        return _encodeArray('i', [_NULL_INT if v is None else v for v in values])
+    return _encodeArray('d', [float('nan') if v is None else v for v in values])
+
+def _decodeNumbers(buf, offset):
+    data, offset = _decodeArray(buf, offset)
+    if data.typecode == 'i':
+        return [None if v == _NULL_INT else v for v in data], offset
+    return [None if v != v else v for v in data], offset
+
+def _encodeSymbols(values):
+    return _encodeArray('b', [0 if v is None else _SYMBOL_CODES[v] for v in values])
+
+def _decodeSymbols(buf, offset):
+    data, offset = _decodeArray(buf, offset)
+    return [SYMBOLS[v] for v in data], offset
+
+_ENCODERS = {'number': _encodeNumbers, 'symbol': _encodeSymbols}
+_DECODERS = {'number': _decodeNumbers, 'symbol': _decodeSymbols}
+
+###########
+# Writers #
+###########
+
+# The stock printLineData of the agents, whose lines formatLine rebuilds
+def printLineData(self, gameState):
+    infoMapa = str(gameState.data.layout.width)+","+str(gameState.data.layout.height)+",("+str(gameState.getWalls()).replace('\n',',')+"),"
+    infoPacman = str(gameState.getPacmanPosition())+","+gameState.data.agentStates[0].getDirection() + "," + str(gameState.getLegalPacmanActions())+","
+    infoGhosts = str(gameState.getNumAgents() - 1)+","+str(gameState.getLivingGhosts())+","+str(gameState.getGhostPositions())+","+str([gameState.getGhostDirections().get(i) for i in range(0, gameState.getNumAgents() - 1)])+","+str(gameState.data.ghostDistances) + ","
+    infoComida = str(gameState.getNumFood())+","+str(gameState.getDistanceNearestFood())+",("+str(gameState.getFood()).replace('\n',',')+"),"+str(gameState.getCapsules()) + ","
+    infoTotal = infoMapa+infoPacman+infoGhosts+infoComida+str(gameState.getScore())+"\n"
+    return infoTotal
+
+def _codeKey(code):
+    "What a code object does, leaving out where it was defined."
+    consts = tuple([_codeKey(c) if hasattr(c, 'co_code') else c for c in code.co_consts])
+    return (code.co_code, consts, code.co_names, code.co_varnames)
+
+def hasStockLineData(agent):
+    "Whether agent's printLineData is the same code as the stock one."
+    function = getattr(getattr(agent, 'printLineData', None), '__func__', None)
+    return function is not None and _codeKey(function.__code__) == _codeKey(printLineData.__code__)
+
+def openLog(agent, binary=False, path=None):
+    """
+    Returns a writer for the observations of agent: a TrajectoryWriter if
+    binary and agent has the stock printLineData, otherwise an InfoWriter of
+    its printLineData lines.  path defaults to TRAJECTORY_FILE or INFO_FILE.
+    """
+    if binary and hasStockLineData(agent):
+        return TrajectoryWriter(path or TRAJECTORY_FILE)
+    return InfoWriter(agent.printLineData, path or INFO_FILE)
+
+class InfoWriter(object):
+    """
+    Appends the lines that lineData(gameState) returns for every tick to an
+    info file, with the CSV header at the top of a new file.  Like the
+    TrajectoryWriter, the lines of a game are appended in one write when
+    endGame is called.
+    """
+
+    def __init__(self, lineData, path=INFO_FILE):
+        _createLog(path, CSV_HEADER.encode('utf-8'))
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | getattr(os, 'O_BINARY', 0))
+        self.lineData = lineData
+        self.lines = []
+
+    def log(self, gameState):
+        self.lines.append(self.lineData(gameState))
+
+    def endGame(self):
+        "Appends the lines of the current game to the file in one write."
+        data = ''.join(self.lines).encode('utf-8')
+        while data:
+            data = data[os.write(self.fd, data):]
+        self.lines = []
+
+    def close(self):
+        if self.fd is None: return
+        self.endGame()
+        os.close(self.fd)
+        self.fd = None
+
+class TrajectoryWriter(object):
+    """
+    Appends the states observed in one or more games to a trajectory log.
+
+    log(gameState) buffers the dynamic fields of a tick; the first tick of a
+    game starts its game record.  endGame must be called when a game is
+    over, which appends all of its records to the log at once, and close
+    when the log is no longer needed.
+    """
+
+    def __init__(self, path=TRAJECTORY_FILE, chunkSize=4096, compressLevel=6):
+        _createLog(path)
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | getattr(os, 'O_BINARY', 0))
+        self.chunkSize = chunkSize
+        self.compressLevel = compressLevel
+        self.records = []
+        self.inGame = False
+
+    def _writeRecord(self, kind, payload):
+        payload = zlib.compress(payload, self.compressLevel)
+        self.records.append(_RECORD_HEADER.pack(kind, len(payload)) + payload)
+
+    def beginGame(self, gameState):
+        "Writes the static fields of the game gameState belongs to."
+        if self.inGame: self.endGame()
+        layout = gameState.data.layout
+        self.height = layout.height
+        self.numGhosts = gameState.getNumAgents() - 1
+        self.food = gameState.data.getFoodIndex()
+        game = {'width': layout.width, 'height': layout.height,
+                'walls': str(gameState.getWalls()).replace('\n', ','),
+                'food': sorted([x * self.height + y for x, y in self.food.food]),
+                'numGhosts': self.numGhosts}
+        self._writeRecord(_GAME, json.dumps(game, sort_keys=True).encode('utf-8'))
+        self.columns = [[] for column in COLUMNS]
+        self.lengths = [[] for column in COLUMNS]
+        self.ticks = 0
+        self.inGame = True
+
+    def log(self, gameState):
+        "Buffers one tick, flushing a chunk when the buffer is full."
+        if not self.inGame: self.beginGame(gameState)
+        food = gameState.data.getFoodIndex()
+        if food is self.food:
+            foodChanges = []
+        else:
+            height = self.height
+            foodChanges = sorted([x * height + y for x, y in food.food.symmetric_difference(self.food.food)])
+            self.food = food
+        numGhosts = self.numGhosts
+        ghostDirections = gameState.getGhostDirections()
+        ghostPositions = []
+        for position in gameState.getGhostPositions():
+            ghostPositions.extend((None, None) if position is None else position)
+        capsules = []
+        for position in gameState.getCapsules():
+            capsules.extend(position)
+        row = (gameState.getPacmanPosition(),
+               (gameState.data.agentStates[0].getDirection(),),
+               gameState.getLegalPacmanActions(),
+               gameState.getLivingGhosts(),
+               ghostPositions,
+               [ghostDirections.get(i) for i in range(0, numGhosts)],
+               gameState.data.ghostDistances,
+               (gameState.getNumFood(),),
+               (gameState.getDistanceNearestFood(),),
+               foodChanges,
+               capsules,
+               (gameState.getScore(),))
+        columns, lengths = self.columns, self.lengths
+        for i, values in enumerate(row):
+            columns[i].extend(values)
+            if COLUMNS[i][2] is None: lengths[i].append(len(values))
+        self.ticks += 1
+        if self.ticks >= self.chunkSize: self.flush()
+
+    def flush(self):
+        "Compresses the buffered ticks into a chunk of the current game."
+        if self.inGame and self.ticks:
+            parts = [struct.pack('<I', self.ticks)]
+            for i, (name, kind, width) in enumerate(COLUMNS):
+                if width is None:
+                    parts.append(_encodeArray('i', self.lengths[i]))
+                parts.append(_ENCODERS[kind](self.columns[i]))
+            self._writeRecord(_CHUNK, b''.join(parts))
+            self.columns = [[] for column in COLUMNS]
+            self.lengths = [[] for column in COLUMNS]
+            self.ticks = 0
+
+    def endGame(self):
+        "Appends the records of the current game to the log in one write."
+        self.flush()
+        data = b''.join(self.records)
+        while data:
+            data = data[os.write(self.fd, data):]
+        self.records = []
+        self.inGame = False
+
+    def close(self):
+        if self.fd is None: return
+        self.endGame()
+        os.close(self.fd)
+        self.fd = None
+
+def _createLog(path, header=_FILE_HEADER.pack(_MAGIC, _VERSION)):
+    """
+    Writes the header of a new or empty log.  A new log is written to a
+    temporary file that is then linked to path, so a process appending to a
+    log that another one has just created never finds it headerless.
+    """
+    if os.path.exists(path):
+        if os.path.getsize(path) == 0:
+            with io.open(path, 'ab') as f: f.write(header)
+        return
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmpPath = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with io.open(fd, 'wb') as f:
+            f.write(header)
+        os.chmod(tmpPath, 0o644) # mkstemp files are private
+        try:
+            os.link(tmpPath, path)
+        except OSError:
+            # Created by another process in the meantime, or no hard links
+            if not os.path.exists(path): os.replace(tmpPath, path)
+    finally:
+        if os.path.exists(tmpPath): os.remove(tmpPath)
+
+##########
+# Reader #
+##########
+
+def _readRecords(f, path):
+    header = f.read(_FILE_HEADER.size)
+    if len(header) < _FILE_HEADER.size: return
+    magic, version = _FILE_HEADER.unpack(header)
+    if magic != _MAGIC or version != _VERSION:
+        raise Exception('%s is not a trajectory log' % path)
+    while True:
+        offset = f.tell()
+        header = f.read(_RECORD_HEADER.size)
+        if len(header) < _RECORD_HEADER.size: return
+        if header.startswith(_MAGIC):
+            raise Exception('%s has a second file header at byte %d; it was written by '
+                            'several processes at once' % (path, offset))
+        kind, length = _RECORD_HEADER.unpack(header)
+        if kind not in (_GAME, _CHUNK):
+            raise Exception('%s has an unknown record at byte %d' % (path, offset))
+        payload = f.read(length)
+        if len(payload) < length: return # Cut short by a crash
+        yield kind, zlib.decompress(payload)
+
+def _decodeChunk(payload, numGhosts):
+    "Returns the ticks of a chunk as lists of per-tick values, one per column."
+    ticks, = struct.unpack_from('<I', payload, 0)
+    offset = 4
+    decoded = []
+    for name, kind, width in COLUMNS:
+        width = _columnWidth(width, numGhosts)
+        if width is None:
+            lengths, offset = _decodeArray(payload, offset)
+        else:
+            lengths = [width] * ticks
+        values, offset = _DECODERS[kind](payload, offset)
+        perTick, start = [], 0
+        for length in lengths:
+            perTick.append(values[start:start + length])
+            start += length
+        decoded.append(perTick)
+    return decoded
+
+def iterTicks(path):
+    """
+    Streams the ticks of a log one chunk at a time.  Yields (game, tick)
+    pairs, where game is the dict of static fields of the game and tick a
+    dict of the fields of one tick, plus 'food', the set of cells (x, y)
+    with food at that tick.
+    """
+    with io.open(path, 'rb') as f:
+        game = None
+        for kind, payload in _readRecords(f, path):
+            if kind == _GAME:
+                game = json.loads(payload.decode('utf-8'))
+                height = game['height']
+                food = set([(cell // height, cell % height) for cell in game['food']])
+            elif kind == _CHUNK:
+                columns = _decodeChunk(payload, game['numGhosts'])
+                for values in zip(*columns):
+                    tick = dict([(name, value) for (name, kind, width), value in zip(COLUMNS, values)])
+                    for cell in tick['foodChanges']:
+                        food ^= set([(cell // height, cell % height)])
+                    tick['food'] = frozenset(food)
+                    yield game, tick
+
+def readGames(path):
+    "Yields (game, ticks) for every game in a log."
+    game, ticks = None, []
+    for tickGame, tick in iterTicks(path):
+        if tickGame is not game:
+            if game is not None: yield game, ticks
+            game, ticks = tickGame, []
+        ticks.append(tick)
+    if game is not None: yield game, ticks
+
+#############
+# CSV files #
+#############
+
+def _pairs(values):
+    return [tuple(values[i:i + 2]) for i in range(0, len(values), 2)]
+
+def _mapString(width, height, cells):
+    "The str() of a Grid, with its rows joined by commas as in the info file."
+    rows = [['F'] * width for y in range(height)]
+    for x, y in cells:
+        rows[height - 1 - y][x] = 'T'
+    return ','.join([''.join(row) for row in rows])
+
+def formatLine(game, tick):
+    "Returns the line of the info file for a tick."
+    ghostPositions = [None if x is None else (x, y) for x, y in _pairs(tick['ghostPositions'])]
+    infoMapa = str(game['width']) + "," + str(game['height']) + ",(" + game['walls'] + "),"
+    infoPacman = str(tuple(tick['pacmanPosition'])) + "," + tick['pacmanDirection'][0] + "," + str(tick['legalActions']) + ","
+    infoGhosts = str(game['numGhosts']) + "," + str(tick['livingGhosts']) + "," + str(ghostPositions) + "," + str(tick['ghostDirections']) + "," + str(tick['ghostDistances']) + ","
+    infoComida = str(tick['numFood'][0]) + "," + str(tick['nearestFood'][0]) + ",(" + _mapString(game['width'], game['height'], tick['food']) + ")," + str(_pairs(tick['capsules'])) + ","
+    return infoMapa + infoPacman + infoGhosts + infoComida + str(tick['score'][0]) + "\n"
+
+def exportCsv(path, csvPath):
+    "Writes the ticks of a log to csvPath in the format of the info file."
+    with open(csvPath, 'w') as f:
+        f.write(CSV_HEADER)
+        for game, tick in iterTicks(path):
+            f.write(formatLine(game, tick))
+
+if __name__ == '__main__':
+    usage = 'USAGE: python trajectoryLog.py export TRAJECTORY_LOG CSV_FILE\n' \
+            '       python trajectoryLog.py summary TRAJECTORY_LOG'
+    if len(sys.argv) == 4 and sys.argv[1] == 'export':
+        exportCsv(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) == 3 and sys.argv[1] == 'summary':
+        games = ticks = 0
+        for game, gameTicks in readGames(sys.argv[2]):
+            games += 1
+            ticks += len(gameTicks)
+        print('%d games, %d ticks' % (games, ticks))
+    else:
+        print(usage)
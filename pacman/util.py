@@ -25,7 +25,12 @@ from builtins import object
 from future.utils import raise_
 import sys
 import inspect
-import heapq, random
+import heapq, random, bisect
+from array import array
+try:
+    from itertools import accumulate
+except ImportError: # Python 2
+    accumulate = None
 import io
 
 
@@ -463,39 +468,134 @@ def normalize(vectorOrCounter):
         if s == 0: return vector
         return [old_div(el, s) for el in vector]
 
-def nSample(distribution, values, n):
-    if sum(distribution) != 1:
-        distribution = normalize(distribution)
-    rand = [random.random() for i in range(n)]
-    rand.sort()
-    samples = []
-    samplePos, distPos, cdf = 0,0, distribution[0]
-    while samplePos < n:
-        if rand[samplePos] < cdf:
-            samplePos += 1
-            samples.append(values[distPos])
+class Sampler(object):
+    """
+    Draws values from a fixed discrete distribution.
+
+    The distribution is preprocessed once into cumulative probabilities, so
+    every draw is a binary search, O(log n), using one random number.  Draws
+    map random numbers to values exactly as sample does, so seeded games are
+    unchanged.  The distribution is either a Counter or a list of
+    probabilities with a matching list of values (by default the indices of
+    the probabilities), and need not be normalized.
+    """
+
+    def __init__(self, distribution, values=None):
+        if isinstance(distribution, dict):
+            items = sorted(distribution.items())
+            distribution = [i[1] for i in items]
+            values = [i[0] for i in items]
+        if accumulate is not None:
+            cumulative = array('d', accumulate(distribution))
         else:
-            distPos += 1
-            cdf += distribution[distPos]
-    return samples
+            cumulative = array('d')
+            total = 0.0
+            for prob in distribution:
+                total += prob
+                cumulative.append(total)
+        self.values = list(values) if values is not None else range(len(cumulative))
+        self.cumulative = cumulative
+        self.total = cumulative[-1] if cumulative else 0.0
+        self.last = len(self.values) - 1
+
+    def sampleIndex(self):
+        "Returns the index of a value drawn from the distribution."
+        # random() < 1 and total is the last cumulative value, so the search
+        # never runs past the last value
+        return bisect.bisect_left(self.cumulative, random.random() * self.total)
+
+    def sample(self):
+        "Returns a value drawn from the distribution."
+        return self.values[bisect.bisect_left(self.cumulative, random.random() * self.total)]
+
+    def sampleIndices(self, n):
+        "Returns an array of n independently drawn indices."
+        cumulative, total = self.cumulative, self.total
+        search, rand = bisect.bisect_left, random.random
+        return array('i', [search(cumulative, rand() * total) for i in range(n)])
+
+    def sampleMany(self, n):
+        "Returns a list of n independently drawn values."
+        values = self.values
+        return [values[i] for i in self.sampleIndices(n)]
+
+    def systematicIndices(self, n):
+        """
+        Returns an array of n indices drawn with a single random offset
+        (systematic resampling), in O(n + len(values)).  The indices are in
+        ascending order, and each index k appears within one of n times its
+        probability.
+        """
+        cumulative, last = self.cumulative, self.last
+        step = self.total / n
+        target = random.random() * step
+        indices = array('i')
+        i = 0
+        for k in range(n):
+            while target >= cumulative[i] and i < last:
+                i += 1
+            indices.append(i)
+            target += step
+        return indices
+
+class AliasSampler(Sampler):
+    """
+    A Sampler that uses Vose's alias method: O(n) preprocessing and O(1)
+    draws from one random number.  Draws are not the same as Sampler's for
+    the same random numbers.
+    """
+
+    def __init__(self, distribution, values=None):
+        Sampler.__init__(self, distribution, values)
+        n = len(self.values)
+        scaled = [0.0] * n
+        previous = 0.0
+        for i, cumulative in enumerate(self.cumulative):
+            scaled[i] = (cumulative - previous) * n / self.total
+            previous = cumulative
+        self.probability = array('d', [1.0]) * n
+        self.alias = array('i', range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1.0
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+        # Whatever is left over has probability 1 up to rounding error
+
+    def sampleIndex(self):
+        r = random.random() * len(self.probability)
+        i = int(r)
+        if r - i < self.probability[i]: return i
+        return self.alias[i]
+
+    def sample(self):
+        return self.values[self.sampleIndex()]
+
+    def sampleIndices(self, n):
+        probability, alias = self.probability, self.alias
+        size, rand = len(probability), random.random
+        indices = array('i')
+        for k in range(n):
+            r = rand() * size
+            i = int(r)
+            indices.append(i if r - i < probability[i] else alias[i])
+        return indices
+
+def nSample(distribution, values, n):
+    sampler = Sampler(distribution, values)
+    return [sampler.values[i] for i in sorted(sampler.sampleIndices(n))]
 
 def sample(distribution, values = None):
-    if type(distribution) == Counter:
-        items = sorted(distribution.items())
-        distribution = [i[1] for i in items]
-        values = [i[0] for i in items]
-    if sum(distribution) != 1:
-        distribution = normalize(distribution)
-    choice = random.random()
-    i, total= 0, distribution[0]
-    while choice > total:
-        i += 1
-        total += distribution[i]
-    return values[i]
+    return Sampler(distribution, values).sample()
 
 def sampleFromCounter(ctr):
-    items = sorted(ctr.items())
-    return sample([v for k,v in items], [k for k,v in items])
+    return Sampler(ctr).sample()
 
 def getProbability(value, distribution, values):
     """
@@ -516,11 +616,8 @@ def chooseFromDistribution( distribution ):
     "Takes either a counter or a list of (prob, key) pairs and samples"
     if type(distribution) == dict or type(distribution) == Counter:
         return sample(distribution)
-    r = random.random()
-    base = 0.0
-    for prob, element in distribution:
-        base += prob
-        if r <= base: return element
+    return Sampler([prob for prob, element in distribution],
+                   [element for prob, element in distribution]).sample()
 
 def nearestPoint( pos ):
     """
@@ -592,48 +689,236 @@ def pause():
 
 # code to handle timeouts
 #
-# FIXME
-# NOTE: TimeoutFuncton is NOT reentrant.  Later timeouts will silently
-# disable earlier timeouts.  Could be solved by maintaining a global list
-# of active time outs.  Currently, questions which have test cases calling
-# this have all student code so wrapped.
+# Timed calls are registered with a single DeadlineScheduler, whose watchdog
+# thread raises TimeoutFunctionException in the thread of any call that runs
+# past its deadline.  Unlike one SIGALRM per call it works from any thread,
+# has sub-millisecond resolution and is reentrant: nested timed calls each
+# keep their own deadline.
 #
-import signal
+import threading
+import itertools
 import time
+try:
+    import ctypes
+    _setAsyncExc = ctypes.pythonapi.PyThreadState_SetAsyncExc
+except (ImportError, AttributeError):
+    _setAsyncExc = None
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
 class TimeoutFunctionException(Exception):
     """Exception to raise on a timeout"""
     pass
 
+# Fields of the deadline entries, and the claims the calling thread and the
+# watchdog append to an entry's claim list.  Appending is atomic, so the
+# first claim decides whether the call returned in time or timed out.
+_DEADLINE, _ORDER, _THREAD, _CLAIMS = list(range(4))
+_RETURNED, _FIRED, _RAISED = list(range(3))
+
+class DeadlineScheduler(object):
+    """
+    Interrupts calls that run past their deadline.
+
+    call() pushes the deadline of a call onto a heap; a daemon watchdog
+    thread sleeps until the earliest deadline and, if that call is still
+    running, raises TimeoutFunctionException in its thread.  Calls blocked
+    in C code (like time.sleep) only see the exception when they return to
+    Python, and where exceptions cannot be raised in other threads late
+    calls are detected when they return, so the time taken is always
+    checked again after the call.
+
+    An exception raised in another thread can arrive at any point of its
+    Python code, so a call that lost its entry to the watchdog never takes
+    the lock again, and the lock is only taken with a plain with statement
+    on the lock itself, which releases it wherever the exception arrives.
+    Returned calls stay in the heap until they reach its top or the heap
+    doubles in size since it was last compacted.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.heap = []
+        self.compactSize = 64
+        self.order = itertools.count()
+        self.watchdog = None
+
+    def call(self, timeout, function, *args, **keyArgs):
+        "Returns function(*args, **keyArgs), or raises TimeoutFunctionException after timeout seconds."
+        if timeout <= 0: raise TimeoutFunctionException()
+        entry = [_monotonic() + timeout, next(self.order), threading.current_thread().ident, []]
+        try:
+            with self.lock:
+                heapq.heappush(self.heap, entry)
+                if self.watchdog is None or not self.watchdog.is_alive():
+                    self.watchdog = threading.Thread(target=self._watch, name='DeadlineScheduler')
+                    self.watchdog.daemon = True
+                    self.watchdog.start()
+                if self.heap[0] is entry: self.condition.notify()
+            result = function(*args, **keyArgs)
+        finally:
+            self._finish(entry)
+        if _monotonic() >= entry[_DEADLINE]:
+            raise TimeoutFunctionException()
+        return result
+
+    def _finish(self, entry):
+        """
+        Claims a returned call.  If the watchdog claimed it first, it has
+        already taken it off the heap and raises TimeoutFunctionException in
+        this thread, so this only waits for that exception.
+        """
+        claims = entry[_CLAIMS]
+        claims.append(_RETURNED)
+        if claims[0] is not _RETURNED:
+            while _RAISED not in claims: time.sleep(0)
+            if _setAsyncExc is not None:
+                # Drop the exception if it has not been raised yet
+                _setAsyncExc(ctypes.c_ulong(entry[_THREAD]), None)
+            raise TimeoutFunctionException()
+        with self.lock:
+            if len(self.heap) > self.compactSize:
+                self.heap = [e for e in self.heap if not e[_CLAIMS]]
+                heapq.heapify(self.heap)
+                self.compactSize = max(64, 2 * len(self.heap))
+
+    def _watch(self):
+        with self.condition:
+            while True:
+                heap = self.heap
+                while heap and heap[0][_CLAIMS]: heapq.heappop(heap)
+                if not heap:
+                    self.condition.wait()
+                    continue
+                wait = heap[0][_DEADLINE] - _monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+                entry = heapq.heappop(heap)
+                claims = entry[_CLAIMS]
+                claims.append(_FIRED)
+                if claims[0] is not _FIRED: continue
+                if _setAsyncExc is not None:
+                    _setAsyncExc(ctypes.c_ulong(entry[_THREAD]), ctypes.py_object(TimeoutFunctionException))
+                claims.append(_RAISED)
+
+DEADLINES = DeadlineScheduler()
 
 class TimeoutFunction(object):
+    """
+    Wraps a function so that calls to it raise TimeoutFunctionException
+    after timeout seconds, which need not be a whole number.
+    """
     def __init__(self, function, timeout):
         self.timeout = timeout
         self.function = function
 
-    def handle_timeout(self, signum, frame):
-        raise TimeoutFunctionException()
-
     def __call__(self, *args, **keyArgs):
-        # If we have SIGALRM signal, use it to cause an exception if and
-        # when this function runs too long.  Otherwise check the time taken
-        # after the method has returned, and throw an exception then.
-        if hasattr(signal, 'SIGALRM'):
-            old = signal.signal(signal.SIGALRM, self.handle_timeout)
-            signal.alarm(self.timeout)
-            try:
-                result = self.function(*args, **keyArgs)
-            finally:
-                signal.signal(signal.SIGALRM, old)
-            signal.alarm(0)
-        else:
-            startTime = time.time()
-            result = self.function(*args, **keyArgs)
-            timeElapsed = time.time() - startTime
-            if timeElapsed >= self.timeout:
-                self.handle_timeout(None, None)
-        return result
+        return DEADLINES.call(self.timeout, self.function, *args, **keyArgs)
+
+
+
+# code to capture what agents print
+#
+# An OutputCapture replaces sys.stdout and sys.stderr once for a whole game
+# and routes each write to the RingBuffer of the agent being called, or to
+# the original stream between agent calls.  The buffers only keep the tail
+# of an agent's output, so chatty agents cannot grow memory without bound.
+#
+import collections
+
+AGENT_OUTPUT_LIMIT = 4096
+
+class RingBuffer(object):
+    """
+    A write-only stream that keeps the last limit characters written to it.
+    If rate is given, only the first rate writes after each reset() are
+    kept.  dropped counts the characters that were discarded.
+    """
+    def __init__(self, limit=AGENT_OUTPUT_LIMIT, rate=None):
+        self.limit = limit
+        self.rate = rate
+        self.chunks = collections.deque()
+        self.size = 0
+        self.writes = 0
+        self.dropped = 0
+
+    def write(self, text):
+        if self.rate is not None:
+            self.writes += 1
+            if self.writes > self.rate:
+                self.dropped += len(text)
+                return len(text)
+        self.chunks.append(text)
+        self.size += len(text)
+        while self.size > self.limit:
+            excess = self.size - self.limit
+            first = self.chunks[0]
+            if len(first) <= excess:
+                self.chunks.popleft()
+                excess = len(first)
+            else:
+                self.chunks[0] = first[excess:]
+            self.size -= excess
+            self.dropped += excess
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def reset(self):
+        "Starts a new period for the rate limit."
+        self.writes = 0
+
+    def getvalue(self):
+        return ''.join(self.chunks)
 
+class _CapturedStream(object):
+    "Stands in for sys.stdout or sys.stderr while an OutputCapture is installed."
+    def __init__(self, capture, stream):
+        self.capture = capture
+        self.stream = stream
 
+    def write(self, text):
+        buffer = self.capture.current
+        if buffer is None: return self.stream.write(text)
+        return buffer.write(text)
+
+    def flush(self):
+        if self.capture.current is None: self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class OutputCapture(object):
+    """
+    One RingBuffer per agent.  select(agentIndex) sends what is printed
+    from then on to that agent's buffer, resetting its rate limit, and
+    select(None) lets it through again; neither touches sys.stdout.
+    """
+    def __init__(self, numAgents, limit=AGENT_OUTPUT_LIMIT, rate=None):
+        self.buffers = [RingBuffer(limit, rate) for i in range(numAgents)]
+        self.current = None
+        self.streams = None
+
+    def select(self, agentIndex):
+        if agentIndex is None:
+            self.current = None
+        else:
+            self.current = self.buffers[agentIndex]
+            self.current.reset()
+
+    def install(self):
+        self.current = None
+        self.streams = sys.stdout, sys.stderr
+        sys.stdout = _CapturedStream(self, sys.stdout)
+        sys.stderr = _CapturedStream(self, sys.stderr)
+
+    def uninstall(self):
+        if self.streams is None: return
+        sys.stdout, sys.stderr = self.streams
+        self.streams = None
+        self.current = None
 
 _ORIGINAL_STDOUT = None
 _ORIGINAL_STDERR = None
@@ -22,6 +22,7 @@ from game import Directions
 from keyboardAgents import KeyboardAgent
 import inference
 import busters
+import qtableStore
 
 class NullGraphics(object):
     "Placeholder for graphics"
@@ -281,11 +282,15 @@ class BasicAgentAA(BustersAgent):
         return "XXXXXXXXXX"
 
 class QLearningAgent(BustersAgent):
+    def __init__(self, qtableFile = "qtable.txt", **args):
+        BustersAgent.__init__(self, **args)
+        self.qtableFile = qtableFile
+
     def registerInitialState(self, gameState):
         "Initialize Q-values"
         self.actions = {"North":0, "East":1, "South":2, "West":3}
-        self.table_file = open("qtable.txt", "r+")
-        self.q_table = self.readQtable()
+        if not hasattr(self, "q_table"): # Read once, so the table keeps learning across games
+            self.q_table = self.readQtable()
         self.epsilon = 0
         self.alpha = 0
         self.discount = 0
@@ -296,30 +301,17 @@ class QLearningAgent(BustersAgent):
 
     def __del__(self):
         "Destructor. Invokation at the end of each episode"
-        self.writeQtable()
-        self.table_file.close()
+        if hasattr(self, "q_table"):
+            self.writeQtable()
 
     def readQtable(self):
-        "Read qtable from disc"
-        table = self.table_file.readlines()
-        q_table = []
-
-        for i, line in enumerate(table):
-            row = line.split()
-            row = [float(x) for x in row]
-            q_table.append(row)
-
-        return q_table
+        "Read qtable from disc (text for .txt files, binary otherwise)"
+        actionNames = sorted(self.actions, key=self.actions.get)
+        return qtableStore.loadQtable(self.qtableFile, actionNames)
 
     def writeQtable(self):
-        "Write qtable to disc"
-        self.table_file.seek(0)
-        self.table_file.truncate()
-
-        for line in self.q_table:
-            for item in line:
-                self.table_file.write(str(item)+" ")
-            self.table_file.write("\n")
+        "Write qtable to disc, replacing the old file atomically"
+        qtableStore.saveQtable(self.q_table, self.qtableFile)
 
     def getState(self, gameState):
         state = ["None", 0]
@@ -450,8 +442,8 @@ class QLearningAgent(BustersAgent):
           there are no legal actions, which is the case at the
           terminal state, you should return a value of 0.0.
         """
-        legalActions = gameState.getLegalActions()
-        legalActions.remove('Stop')
+        if len(gameState.getLegalActions()) == 0:
+            return 0.0
 
         return max(self.q_table[self.computePosition(gameState)])
 
@@ -33,7 +33,9 @@ from __future__ import print_function
 
 from builtins import str
 from builtins import object
-import threading, sys, time, random
+from array import array
+from collections import deque
+import threading, sys, time, random, os, struct, hashlib, mmap, tempfile
 
 class Distancer(object):
   def __init__(self, layout, background=True, default=10000):
@@ -61,6 +63,9 @@ class Distancer(object):
   def getDistance(self, pos1, pos2):
     """
     The getDistance function is the only one you'll need after you create the object.
+
+    Cells that cannot reach each other are sys.maxsize apart, and positions
+    that are not free cells of the layout raise an exception.
     """
     if self._distances == None:
       return manhattanDistance(pos1, pos2)
@@ -78,11 +83,10 @@ class Distancer(object):
     return bestDistance
 
   def getDistanceOnGrid(self, pos1, pos2):
-    key = (pos1, pos2)
-    if key in self._distances:
-      return self._distances[key]
-    else:
-      raise Exception("Positions not in grid: " + str(key))
+    distance = self._distances.getDistance(pos1, pos2)
+    if distance is None:
+      raise Exception("Positions not in grid: " + str((pos1, pos2)))
+    return distance
 
   def isReadyForMazeDistance(self):
     return self._distances != None
@@ -134,7 +138,10 @@ class DistanceCalculator(threading.Thread):
       if distanceThread != None: raise Exception('Multiple distance threads')
       distanceThread = self
 
-      distances = computeDistances(self.layout)
+      distances = loadDistanceTable(self.layout.walls)
+      if distances == None:
+        distances = computeDistanceTable(self.layout)
+        saveDistanceTable(self.layout.walls, distances)
       print('[Distancer]: Switching to maze distances', file=sys.stdout)
 
       distanceMap[self.layout.walls] = distances
@@ -145,7 +152,205 @@ class DistanceCalculator(threading.Thread):
     distanceMapSemaphore.release()
     self.distancer._distances = distances
 
+UNREACHABLE = 0xFFFF
+
+class DistanceTable(object):
+  """
+  All-pairs maze distances for one layout.
+
+  Every free cell gets a dense integer index and the distances are kept
+  row-major in a single unsigned 16-bit array, so a table costs
+  2 * numCells**2 bytes instead of one dict entry per pair of cells.
+  Pairs that cannot reach each other hold UNREACHABLE.
+  """
+  def __init__(self, width, height, cells, distances):
+    self.width = width
+    self.height = height
+    self.cells = cells
+    self.numCells = len(cells)
+    self.distances = distances
+    # Flat position -> index lookup, -1 for walls
+    self.index = array('i', [-1]) * (width * height)
+    for i, (x, y) in enumerate(cells):
+      self.index[x * height + y] = i
+
+  def cellIndex(self, pos):
+    """
+    Returns the dense index of a grid position, or None if it is a wall
+    or lies outside the layout.
+    """
+    x, y = int(pos[0]), int(pos[1])
+    if x < 0 or y < 0 or x >= self.width or y >= self.height:
+      return None
+    i = self.index[x * self.height + y]
+    if i < 0:
+      return None
+    return i
+
+  def getDistance(self, pos1, pos2):
+    """
+    Returns the maze distance between two grid positions, sys.maxsize if
+    they are not connected and None if either one is not a free cell.
+    """
+    i = self.cellIndex(pos1)
+    j = self.cellIndex(pos2)
+    if i is None or j is None:
+      return None
+    distance = self.distances[i * self.numCells + j]
+    if distance == UNREACHABLE:
+      return sys.maxsize
+    return distance
+
+  def __contains__(self, key):
+    pos1, pos2 = key
+    return self.cellIndex(pos1) is not None and self.cellIndex(pos2) is not None
+
+  def __getitem__(self, key):
+    distance = self.getDistance(*key)
+    if distance is None:
+      raise KeyError(key)
+    return distance
+
+def computeDistanceTable(layout):
+  """
+  Computes all-pairs maze distances with one breadth-first search per free
+  cell.  Moves have unit cost, so BFS gives the same result as Dijkstra
+  without the priority queue.
+  """
+  walls = layout.walls
+  width, height = walls.width, walls.height
+  cells = walls.asList(False)
+  table = DistanceTable(width, height, cells, None)
+  index = table.index
+  numCells = table.numCells
+
+  neighbors = []
+  for x, y in cells:
+    adjacent = []
+    for nx, ny in ((x, y+1), (x, y-1), (x+1, y), (x-1, y)):
+      if 0 <= nx < width and 0 <= ny < height and index[nx * height + ny] >= 0:
+        adjacent.append(index[nx * height + ny])
+    neighbors.append(adjacent)
+
+  distances = array('H', [UNREACHABLE]) * (numCells * numCells)
+  for source in range(numCells):
+    row = source * numCells
+    distances[row + source] = 0
+    queue = deque([source])
+    while queue:
+      node = queue.popleft()
+      nextDist = distances[row + node] + 1
+      for other in neighbors[node]:
+        if distances[row + other] == UNREACHABLE:
+          distances[row + other] = nextDist
+          queue.append(other)
+  table.distances = distances
+  return table
+
+#########################################
+# PERSISTENT CACHE OF DISTANCE TABLES   #
+#########################################
+
+# Directory holding one memory-mapped table per wall layout.  Override it with
+# the PACMAN_DISTANCE_CACHE environment variable, or set it to None to only
+# keep distances in memory.
+DISTANCE_CACHE_DIR = os.environ.get('PACMAN_DISTANCE_CACHE',
+                                    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.distanceCache'))
+
+_CACHE_MAGIC = b'PMDT'
+_CACHE_VERSION = 1
+# magic, version, little endian flag, width, height, number of free cells
+_CACHE_HEADER = struct.Struct('<4sBBHHI')
+
+# The umask can only be read by setting it, so it is read once here rather
+# than from the thread that saves the tables.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def wallsFingerprint(walls):
+  """
+  Returns a stable hex digest identifying a wall grid.  Unlike hash(walls)
+  it is the same in every process, so it can name files on disk.
+  """
+  digest = hashlib.sha1(('%d,%d\n' % (walls.width, walls.height)).encode('ascii'))
+  digest.update(str(walls).encode('ascii'))
+  return digest.hexdigest()
+
+def distanceCachePath(walls):
+  if DISTANCE_CACHE_DIR == None: return None
+  return os.path.join(DISTANCE_CACHE_DIR, wallsFingerprint(walls) + '.dist')
+
+def loadDistanceTable(walls):
+  """
+  Maps a previously saved DistanceTable for these walls into memory.  The
+  distances are read lazily by the OS and shared between every process that
+  maps the same file.  Returns None if there is no usable cache entry.
+  """
+  path = distanceCachePath(walls)
+  if path == None or not os.path.exists(path): return None
+  try:
+    f = open(path, 'rb')
+    try:
+      buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+      f.close()
+    magic, version, littleEndian, width, height, numCells = _CACHE_HEADER.unpack_from(buf, 0)
+    if magic != _CACHE_MAGIC or version != _CACHE_VERSION: return None
+    if bool(littleEndian) != (sys.byteorder == 'little'): return None
+    if width != walls.width or height != walls.height: return None
+    cellsStart = _CACHE_HEADER.size
+    distStart = cellsStart + 4 * numCells
+    if len(buf) != distStart + 2 * numCells * numCells: return None
+    coords = array('H', buf[cellsStart:distStart])
+    cells = [(coords[2*i], coords[2*i+1]) for i in range(numCells)]
+    try:
+      distances = memoryview(buf)[distStart:].cast('H')
+    except AttributeError:
+      # No memoryview.cast (Python 2): copy the table out of the mapping
+      distances = array('H', buf[distStart:])
+    return DistanceTable(width, height, cells, distances)
+  except (IOError, OSError, ValueError, struct.error):
+    return None
+
+def saveDistanceTable(walls, table):
+  """
+  Writes a DistanceTable to the cache.  The file is written under a temporary
+  name and renamed into place, so concurrent readers never see a partial
+  table.  Failing to write the cache is not an error.
+  """
+  path = distanceCachePath(walls)
+  if path == None: return
+  try:
+    if not os.path.isdir(DISTANCE_CACHE_DIR):
+      os.makedirs(DISTANCE_CACHE_DIR)
+    fd, tmpPath = tempfile.mkstemp(dir=DISTANCE_CACHE_DIR, suffix='.tmp')
+    try:
+      f = os.fdopen(fd, 'wb')
+      try:
+        f.write(_CACHE_HEADER.pack(_CACHE_MAGIC, _CACHE_VERSION, int(sys.byteorder == 'little'),
+                                   table.width, table.height, table.numCells))
+        coords = array('H')
+        for x, y in table.cells:
+          coords.append(x)
+          coords.append(y)
+        f.write(coords.tobytes())
+        f.write(array('H', table.distances).tobytes())
+      finally:
+        f.close()
+      # mkstemp files are private; give the table the mode open() would
+      os.chmod(tmpPath, 0o666 & ~_UMASK)
+      getattr(os, 'replace', os.rename)(tmpPath, path)
+    except:
+      os.remove(tmpPath)
+      raise
+  except (IOError, OSError):
+    pass
+
 def computeDistances(layout):
+    """
+    Reference implementation: Dijkstra from every free cell into a dict keyed
+    by ((x1,y1),(x2,y2)).  Kept for benchmarking computeDistanceTable.
+    """
     distances = {}
     allNodes = layout.walls.asList(False)
     for source in allNodes:
@@ -192,3 +397,32 @@ def getDistanceOnGrid(distances, pos1, pos2):
       return distances[key]
     return 100000
 
+def benchmark(layoutName, repeats=3):
+  """
+  Times the dict-based computeDistances against computeDistanceTable on a
+  layout and checks that both agree on every pair of cells.
+
+  > python distanceCalculator.py bigHunt
+  """
+  import layout as layoutModule
+  lay = layoutModule.getLayout(layoutName)
+  if lay == None: raise Exception("The layout " + layoutName + " cannot be found")
+
+  start = time.time()
+  for i in range(repeats): reference = computeDistances(lay)
+  dictTime = (time.time() - start) / repeats
+  start = time.time()
+  for i in range(repeats): table = computeDistanceTable(lay)
+  tableTime = (time.time() - start) / repeats
+
+  for (pos1, pos2), distance in reference.items():
+    if table.getDistance(pos1, pos2) != distance:
+      raise Exception("Distance mismatch for " + str((pos1, pos2)))
+
+  print('Layout:        %s (%d free cells)' % (layoutName, table.numCells))
+  print('Dict Dijkstra: %.4fs, %d bytes' % (dictTime, sys.getsizeof(reference)))
+  print('Array BFS:     %.4fs, %d bytes' % (tableTime, table.numCells * table.numCells * table.distances.itemsize))
+
+if __name__ == '__main__':
+  for name in sys.argv[1:] or ['bigHunt']:
+    benchmark(name)
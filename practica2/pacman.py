@@ -47,6 +47,9 @@ from builtins import range
 from builtins import object
 from game import GameStateData
 from game import Game
+from game import GameResult
+from game import GameProfile
+from game import writeProfiles
 from game import Directions
 from game import Actions
 from util import nearestPoint
@@ -154,6 +157,13 @@ class GameState(object):
     def getGhostStates( self ):
         return self.data.agentStates[1:]
 
+    def getVisibleGhosts( self ):
+        "Returns the states of the ghosts in Pacman's line of sight, in the direction it faces."
+        configuration = self.data.agentStates[0].configuration
+        layout = self.data.layout
+        return [ghost for ghost in self.getGhostStates()
+                if layout.isVisibleFrom(ghost.getPosition(), configuration.getPosition(), configuration.getDirection())]
+
     def getGhostState( self, agentIndex ):
         if agentIndex == 0 or agentIndex >= self.getNumAgents():
             raise Exception("Invalid index passed to getGhostState")
@@ -207,10 +217,10 @@ class GameState(object):
         return self.data.layout.walls
 
     def hasFood(self, x, y):
-        return self.data.food[x][y]
+        return self.data.food.get(x, y)
 
     def hasWall(self, x, y):
-        return self.data.layout.walls[x][y]
+        return self.data.layout.walls.get(x, y)
 
     def isLose( self ):
         return self.data._lose
@@ -277,11 +287,11 @@ class ClassicGameRules(object):
     def __init__(self, timeout=30):
         self.timeout = timeout
 
-    def newGame( self, layout, pacmanAgent, ghostAgents, display, quiet = False, catchExceptions=False):
+    def newGame( self, layout, pacmanAgent, ghostAgents, display, quiet = False, catchExceptions=False, headless=False):
         agents = [pacmanAgent] + ghostAgents[:layout.getNumGhosts()]
         initState = GameState()
         initState.initialize( layout, len(ghostAgents) )
-        game = Game(agents, display, self, catchExceptions=catchExceptions)
+        game = Game(agents, display, self, catchExceptions=catchExceptions, headless=headless)
         game.state = initState
         self.initialState = initState.deepCopy()
         self.quiet = quiet
@@ -518,7 +528,11 @@ def readCommand( argv ):
     parser.add_option('-r', '--recordActions', action='store_true', dest='record',
                       help='Writes game histories to a file (named by the time they were played)', default=False)
     parser.add_option('--replay', dest='gameToReplay',
-                      help='A recorded game file (pickle) to replay', default=None)
+                      help='A recorded game file to replay', default=None)
+    parser.add_option('--replayGame', dest='replayIndex', type='int',
+                      help=default('Which game of the recording file to replay'), default=0)
+    parser.add_option('--replayFrom', dest='replayFrom', type='int',
+                      help=default('The ply from which to replay the recorded game'), default=0)
     parser.add_option('-a','--agentArgs',dest='agentArgs',
                       help='Comma separated values sent to agent. e.g. "opt1=val1,opt2,opt3=val3"')
     parser.add_option('-x', '--numTraining', dest='numTraining', type='int',
@@ -529,6 +543,12 @@ def readCommand( argv ):
                       help='Turns on exception handling and timeouts during games', default=False)
     parser.add_option('--timeout', dest='timeout', type='int',
                       help=default('Maximum length of time an agent can spend computing in a single game'), default=30)
+    parser.add_option('--headless', action='store_true', dest='headless',
+                      help='Play without graphics in the fast game loop (agents must not modify the states they observe)', default=False)
+    parser.add_option('-w', '--workers', dest='workers', type='int',
+                      help=default('Number of worker processes to spread the games over (no graphics when > 1)'), default=1)
+    parser.add_option('--profile', dest='profile',
+                      help='Time the phases of every ply and write the histograms to this JSON file', default=None)
 
     options, otherjunk = parser.parse_args(argv)
     if len(otherjunk) != 0:
@@ -562,7 +582,7 @@ def readCommand( argv ):
     args['ghosts'] = [ghostType( i+1 ) for i in range( options.numGhosts )]
 
     # Choose a display format
-    if options.quietGraphics:
+    if options.quietGraphics or options.headless:
         import textDisplay
         args['display'] = textDisplay.NullGraphics()
     elif options.textGraphics:
@@ -576,16 +596,24 @@ def readCommand( argv ):
     args['record'] = options.record
     args['catchExceptions'] = options.catchExceptions
     args['timeout'] = options.timeout
+    args['workers'] = options.workers
+    args['headless'] = options.headless
+    args['profile'] = options.profile
 
     # Special case: recorded games don't use the runGames method or args structure
     if options.gameToReplay != None:
         print('Replaying recorded game %s.' % options.gameToReplay)
-        import pickle
-        f = open(options.gameToReplay)
-        try: recorded = pickle.load(f)
-        finally: f.close()
-        recorded['display'] = args['display']
-        replayGame(**recorded)
+        import recording
+        if recording.isRecording(options.gameToReplay):
+            recorded = recording.loadRecording(options.gameToReplay, options.replayIndex)
+            replayRecording(recorded, args['display'], options.replayFrom)
+        else: # A pickled layout and move history
+            import pickle
+            f = open(options.gameToReplay, 'rb')
+            try: recorded = pickle.load(f)
+            finally: f.close()
+            recorded['display'] = args['display']
+            replayGame(**recorded)
         sys.exit(0)
 
     return args
@@ -613,12 +641,16 @@ def loadAgent(pacman, nographics):
                 return getattr(module, pacman)
     raise Exception('The agent ' + pacman + ' is not specified in any *Agents.py.')
 
-def replayGame( layout, actions, display ):
-    import pacmanAgents, ghostAgents
+def replayGame( layout, actions, display, state=None ):
+    """
+    Shows a game by replaying its actions, from state if it is given and
+    from the start of the game otherwise.  The agents are never asked for a
+    move, so none are loaded.
+    """
     rules = ClassicGameRules()
-    agents = [pacmanAgents.GreedyAgent()] + [ghostAgents.RandomGhost(i+1) for i in range(layout.getNumGhosts())]
-    game = rules.newGame( layout, agents[0], agents[1:], display )
-    state = game.state
+    numGhosts = layout.getNumGhosts() if state is None else len(state.data.agentStates) - 1
+    game = rules.newGame( layout, None, [None] * numGhosts, display )
+    if state is None: state = game.state
     display.initialize(state.data)
 
     for action in actions:
@@ -631,44 +663,99 @@ def replayGame( layout, actions, display ):
 
     display.finish()
 
-def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0, catchExceptions=False, timeout=30 ):
+def replayRecording( recorded, display, startPly=0 ):
+    "Replays a recording.Recording from startPly, seeking to it through the keyframes."
+    state = recorded.stateAt(recorded.getInitialState(GameState), startPly)
+    replayGame(recorded.getLayout(), recorded.actions[startPly:], display, state)
+
+def recordGame( layout, game, index ):
+    "Writes the layout and move history of a finished game to a file named by the current time"
+    import time, recording
+    fname = ('recorded-game-%d' % (index + 1)) +  '-'.join([str(t) for t in time.localtime()[1:6]])
+    initialState = GameState()
+    initialState.initialize(layout, len(game.state.data.agentStates) - 1)
+    recording.writeRecordings(fname, [recording.makeRecording(layout, initialState, game.moveHistory)])
+
+def _playGame(task):
+    "Plays a single game inside a worker process and returns its GameResult."
+    layout, pacman, ghosts, record, catchExceptions, timeout, headless, profile, index, seed = task
+    random.seed(seed)
+    import textDisplay, __main__
+    display = textDisplay.NullGraphics()
+    __main__.__dict__['_display'] = display
+    rules = ClassicGameRules(timeout)
+    game = rules.newGame( layout, pacman, ghosts, display, True, catchExceptions, headless)
+    if profile: game.profile = GameProfile()
+    game.run()
+    if record: recordGame(layout, game, index)
+    return GameResult(game, index, seed)
+
+def runGamesInParallel( layout, pacman, ghosts, numGames, record, catchExceptions, timeout, workers, headless=False, profile=False ):
+    """
+    Shards the games over a pool of worker processes.  Each game runs with its
+    own copy of the agents, a NullGraphics display and the seed
+    baseSeed + gameIndex, so every game of a sweep can be replayed on its own.
+    Returns the GameResults in game order.
+    """
+    import multiprocessing
+    baseSeed = random.getrandbits(31)
+    tasks = [(layout, pacman, ghosts, record, catchExceptions, timeout, headless, profile, i, baseSeed + i) for i in range(numGames)]
+    pool = multiprocessing.Pool(workers)
+    try:
+        return pool.map(_playGame, tasks, max(1, numGames // (4 * workers)))
+    finally:
+        pool.close()
+        pool.join()
+
+def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0, catchExceptions=False, timeout=30, workers=1, headless=False, profile=None ):
+    """
+    Plays numGames games, the first numTraining of them quietly.  If profile
+    is the name of a file, the phases of every ply of the games that are not
+    training games are timed and their histograms written to it as JSON.
+    """
     import __main__
     __main__.__dict__['_display'] = display
 
-    rules = ClassicGameRules(timeout)
-    games = []
-
-    for i in range( numGames ):
-        beQuiet = i < numTraining
-        if beQuiet:
-                # Suppress output and graphics
-            import textDisplay
-            gameDisplay = textDisplay.NullGraphics()
-            rules.quiet = True
-        else:
-            gameDisplay = display
-            rules.quiet = False
-        game = rules.newGame( layout, pacman, ghosts, gameDisplay, beQuiet, catchExceptions)
-        game.run()
-        if not beQuiet: games.append(game)
-
-        if record:
-            import time, pickle
-            fname = ('recorded-game-%d' % (i + 1)) +  '-'.join([str(t) for t in time.localtime()[1:6]])
-            f = file(fname, 'w')
-            components = {'layout': layout, 'actions': game.moveHistory}
-            pickle.dump(components, f)
-            f.close()
+    if workers > 1:
+        # Learning agents would train separately in every worker
+        if numTraining > 0: raise Exception('Training games cannot be spread over several workers')
+        games = runGamesInParallel( layout, pacman, ghosts, numGames, record, catchExceptions, timeout, workers, headless, profile != None )
+        scores = [game.getScore() for game in games]
+        wins = [game.isWin() for game in games]
+    else:
+        rules = ClassicGameRules(timeout)
+        games = []
+
+        for i in range( numGames ):
+            beQuiet = i < numTraining
+            if beQuiet:
+                    # Suppress output and graphics
+                import textDisplay
+                gameDisplay = textDisplay.NullGraphics()
+                rules.quiet = True
+            else:
+                gameDisplay = display
+                rules.quiet = False
+            game = rules.newGame( layout, pacman, ghosts, gameDisplay, beQuiet, catchExceptions, headless)
+            if profile != None and not beQuiet: game.profile = GameProfile()
+            game.run()
+            if not beQuiet: games.append(game)
+
+            if record: recordGame(layout, game, i)
 
-    if (numGames-numTraining) > 0:
         scores = [game.state.getScore() for game in games]
         wins = [game.state.isWin() for game in games]
+
+    if (numGames-numTraining) > 0:
         winRate = wins.count(True)/ float(len(wins))
         print('Average Score:', sum(scores) / float(len(scores)))
         print('Scores:       ', ', '.join([str(score) for score in scores]))
         print('Win Rate:      %d/%d (%.2f)' % (wins.count(True), len(wins), winRate))
         print('Record:       ', ', '.join([ ['Loss', 'Win'][int(w)] for w in wins]))
 
+    if profile != None:
+        writeProfiles([game.profile for game in games], profile)
+
     return games
 
 if __name__ == '__main__':
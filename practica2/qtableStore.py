@@ -0,0 +1,171 @@
+# qtableStore.py
+# --------------
+# Storage for the Q-tables of the table-based QLearningAgents.
+#
+# A Q-table is a rows x columns table of floats with one named column per
+# action.  Tables ending in .txt use the text format of the qtable_*.txt
+# files (one row per line, values separated by spaces); any other file
+# name uses a binary format that loads with a single memory map:
+#
+#   header   magic 'PMQT', version, names length, rows, columns (little endian)
+#   names    the action names, utf-8, separated by newlines, padded to 8 bytes
+#   values   rows * columns little endian doubles, row after row
+#
+# Both formats are written to a temporary file that is renamed over the
+# old table, so a crash never leaves a half-written table behind.
+#
+#   python qtableStore.py import qtable_MazeGrid_noNoise.txt maze.bin north,east,south,west,exit
+#   python qtableStore.py export maze.bin qtable.txt
+
+from __future__ import print_function
+from builtins import range
+from builtins import object
+from array import array
+import io, os, sys, mmap, struct, tempfile
+
+_HEADER = struct.Struct('<4sBxHII')
+_MAGIC = b'PMQT'
+_VERSION = 2
+
+class QTable(object):
+    """
+    A rows x columns table of Q-values with named action columns.
+
+    table[row] is a writable view of one row, so table[row][column],
+    max(table[row]) and iterating over the rows all work as they did on
+    the old lists of lists.  Tables loaded with readOnly=True are views
+    of a shared memory map and raise TypeError when written to.
+    """
+
+    def __init__(self, rows, actions, values=None):
+        self.rows = rows
+        self.actions = list(actions)
+        self.columns = len(self.actions)
+        self.actionIndex = dict([(a, i) for i, a in enumerate(self.actions)])
+        if values is None:
+            values = array('d', [0.0]) * (rows * self.columns)
+        if len(values) != rows * self.columns:
+            raise Exception('A %dx%d Q-table needs %d values, not %d' %
+                            (rows, self.columns, rows * self.columns, len(values)))
+        self.values = memoryview(values) if isinstance(values, array) else values
+
+    def __getitem__(self, row):
+        if row < 0: row += self.rows
+        if not 0 <= row < self.rows: raise IndexError('Q-table row out of range')
+        return self.values[row * self.columns:(row + 1) * self.columns]
+
+    def __iter__(self):
+        for row in range(self.rows):
+            yield self[row]
+
+    def __len__(self):
+        return self.rows
+
+    def getQValue(self, row, action):
+        return self.values[row * self.columns + self.actionIndex[action]]
+
+    def setQValue(self, row, action, value):
+        self.values[row * self.columns + self.actionIndex[action]] = value
+
+    def copy(self):
+        "Returns a writable in-memory copy of the table."
+        return QTable(self.rows, self.actions, array('d', self.values))
+
+def readText(path, actions):
+    "Imports a table in the qtable_*.txt format, whose columns are the given actions."
+    with open(path) as f:
+        rows = [line.split() for line in f if line.strip()]
+    values = array('d')
+    for row in rows:
+        if len(row) != len(actions):
+            raise Exception('%s has a row of %d values for %d actions' % (path, len(row), len(actions)))
+        values.extend([float(x) for x in row])
+    return QTable(len(rows), actions, values)
+
+def readBinary(path, actions=None, readOnly=False):
+    """
+    Loads a binary table.  With readOnly the values are a view of a
+    read-only memory map of the file, which processes share through the
+    page cache; otherwise they are copied into memory.  If actions is
+    given it must match the stored action columns.
+    """
+    with open(path, 'rb') as f:
+        if readOnly and sys.byteorder == 'little':
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            buf = f.read()
+    magic, version, namesLength, rows, columns = _HEADER.unpack_from(buf, 0)
+    if magic != _MAGIC or version != _VERSION:
+        raise Exception('%s is not a binary Q-table' % path)
+    start = _HEADER.size
+    names = bytes(buf[start:start + namesLength]).decode('utf-8')
+    storedActions = names.split('\n') if names else []
+    if actions is not None and list(actions) != storedActions:
+        raise Exception('%s stores the actions %s, not %s' % (path, storedActions, list(actions)))
+    start = _align(start + namesLength)
+    end = start + rows * columns * 8
+    if len(buf) < end:
+        raise Exception('Truncated Q-table: %s' % path)
+    if isinstance(buf, mmap.mmap):
+        return QTable(rows, storedActions, memoryview(buf)[start:end].cast('d'))
+    values = array('d')
+    values.frombytes(buf[start:end])
+    if sys.byteorder != 'little': values.byteswap()
+    return QTable(rows, storedActions, values)
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+def writeText(table, path):
+    "Exports a table in the qtable_*.txt format."
+    lines = [''.join([str(item) + ' ' for item in row]) + '\n' for row in table]
+    _replace(path, ''.join(lines).encode('utf-8'))
+
+def writeBinary(table, path):
+    "Writes a table in the binary format."
+    names = '\n'.join(table.actions).encode('utf-8')
+    header = _HEADER.pack(_MAGIC, _VERSION, len(names), table.rows, table.columns)
+    padding = b'\0' * (_align(len(header) + len(names)) - len(header) - len(names))
+    values = array('d', table.values)
+    if sys.byteorder != 'little': values.byteswap()
+    _replace(path, header + names + padding + values.tobytes())
+
+def _replace(path, data):
+    "Atomically replaces the contents of path with data."
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmpPath = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with io.open(fd, 'wb') as f: # os.fdopen imports io, which fails at interpreter exit
+            f.write(data)
+        if os.path.exists(path): # mkstemp files are private; keep the table's permissions
+            os.chmod(tmpPath, os.stat(path).st_mode & 0o777)
+        os.replace(tmpPath, path)
+    except Exception:
+        if os.path.exists(tmpPath): os.remove(tmpPath)
+        raise
+
+def isText(path):
+    return path.endswith('.txt')
+
+def loadQtable(path, actions, readOnly=False):
+    "Loads a text or binary table, chosen by the file name."
+    if isText(path):
+        return readText(path, actions)
+    return readBinary(path, actions, readOnly)
+
+def saveQtable(table, path):
+    "Saves a table as text or binary, chosen by the file name."
+    if isText(path):
+        writeText(table, path)
+    else:
+        writeBinary(table, path)
+
+if __name__ == '__main__':
+    usage = 'USAGE: python qtableStore.py import TEXT_TABLE BINARY_TABLE ACTION,ACTION,...\n' \
+            '       python qtableStore.py export BINARY_TABLE TEXT_TABLE'
+    if len(sys.argv) == 5 and sys.argv[1] == 'import':
+        writeBinary(readText(sys.argv[2], sys.argv[4].split(',')), sys.argv[3])
+    elif len(sys.argv) == 4 and sys.argv[1] == 'export':
+        writeText(readBinary(sys.argv[2], readOnly=True), sys.argv[3])
+    else:
+        print(usage)
@@ -0,0 +1,169 @@
+# regressionGames.py
+# ------------------
+# Fixed-seed headless games that once crashed the framework.  Every game
+# must run to its end; run them after changing the inference modules or
+# the game loop.
+#
+#   python regressionGames.py
+
+from __future__ import print_function
+from builtins import range
+import sys, random
+import util
+import busters
+import layout
+import textDisplay
+import ghostAgents
+from bustersAgents import BustersAgent
+import distanceCalculator
+from distanceCalculator import Distancer
+from game import Actions
+from util import manhattanDistance
+
+class ChasingAgent(BustersAgent):
+    """
+    Updates its beliefs every move, like the BustersAgent loop, and charges
+    the closest living ghost at its true position, so that ghosts are
+    captured while the inference modules are still tracking the others.
+    """
+
+    def registerInitialState(self, gameState):
+        BustersAgent.registerInitialState(self, gameState)
+        self.distancer = Distancer(gameState.data.layout, False)
+
+    def getAction(self, gameState):
+        for index, inf in enumerate(self.inferenceModules):
+            if not self.firstMove and self.elapseTimeEnable:
+                inf.elapseTime(gameState)
+            self.firstMove = False
+            if self.observeEnable:
+                inf.observeState(gameState)
+            self.ghostBeliefs[index] = inf.getBeliefDistribution()
+        return self.chooseAction(gameState)
+
+    def chooseAction(self, gameState):
+        position = gameState.getPacmanPosition()
+        livingGhosts = gameState.getLivingGhosts()
+        ghosts = [g for i, g in enumerate(gameState.getGhostPositions()) if livingGhosts[i + 1]]
+        target = min(ghosts, key=lambda g: self.distancer.getDistance(position, g))
+        return min(gameState.getLegalPacmanActions(),
+                   key=lambda a: self.distancer.getDistance(Actions.getSuccessor(position, a), target))
+
+class PursuingRandomGhost(ghostAgents.RandomGhost):
+    "A RandomGhost subclass whose moves depend on where Pacman is."
+
+    def getDistribution(self, state):
+        position = state.getGhostPosition(self.index)
+        pacman = state.getPacmanPosition()
+        distances = dict([(a, manhattanDistance(Actions.getSuccessor(position, a), pacman))
+                          for a in state.getLegalActions(self.index)])
+        closest = min(distances.values())
+        dist = util.Counter()
+        for a, distance in list(distances.items()):
+            if distance == closest: dist[a] = 1.0
+        dist.normalize()
+        return dist
+
+def playGame(layoutName, ghostType, numGhosts, inference, seed, maxMoves=500):
+    "Plays one game with a ChasingAgent and returns the finished Game."
+    random.seed(seed)
+    import __main__
+    display = textDisplay.NullGraphics()
+    __main__.__dict__['_display'] = display
+    ghosts = [ghostType(i + 1) for i in range(numGhosts)]
+    pacman = ChasingAgent(inference=inference, ghostAgents=ghosts)
+    game = busters.BustersGameRules().newGame(layout.getLayout(layoutName), pacman, ghosts, display, maxMoves, True)
+    game.run()
+    return game
+
+def capturedDirectionalGhost():
+    """
+    ArrayJointParticleFilter used to look up the moves of captured
+    DirectionalGhosts from their jail cell, which is not a legal position,
+    and raised KeyError as soon as the first ghost was captured.
+    """
+    for seed in range(1, 5):
+        state = playGame('smallHunt', ghostAgents.DirectionalGhost, 3, 'ArrayMarginalInference', seed).state
+        if any(state.getLivingGhosts()[1:]):
+            raise Exception('Seed %d ended with ghosts still free' % seed)
+
+def subclassedRandomGhost():
+    """
+    ArrayExactInference used to give subclasses of the ghosts in
+    STATIONARY_GHOSTS a transition matrix cached from their first state,
+    even when they override getDistribution to follow Pacman.
+    """
+    for ghostType, cached in [(ghostAgents.RandomGhost, True), (PursuingRandomGhost, False)]:
+        game = playGame('smallHunt', ghostType, 1, 'ArrayExactInference', 1)
+        transitions = game.agents[0].inferenceModules[0].transitions
+        if (transitions != None) != cached:
+            raise Exception('%s %s a cached transition matrix' %
+                            (ghostType.__name__, cached and 'lacks' or 'has'))
+
+def gridCopiesShareColumns():
+    """
+    Reading one cell of a Grid copy used to rebuild all of its column lists,
+    which made the first food read of every successor state slower than
+    copying the old list-of-lists grids.  Only the column that is written to
+    or handed out as grid[x] may be copied.
+    """
+    walls = layout.getLayout('bigHunt').walls.copy()
+    for x in range(walls.width): walls.get(x, 0)
+    copy = walls.copy()
+    copy.get(3, 4)
+    copy[5][6]
+    copy[7][8] = not copy[7][8]
+    for x in range(walls.width):
+        shared = copy._columns[x] is walls._columns[x]
+        if shared == (x in (5, 7)):
+            raise Exception('Column %d of a copy is %s' % (x, shared and 'still shared' or 'rebuilt'))
+    if walls[7][8] == copy[7][8]:
+        raise Exception('Writing to a copy changed the original')
+
+def unreachableDistances():
+    """
+    Distancer.getDistance returns sys.maxsize between cells that cannot
+    reach each other, as the dictionary of computeDistances did, whether
+    the table was just computed or mapped from the cache.  Walls still
+    raise.
+    """
+    import shutil, tempfile
+    lay = layout.Layout(['%%%%%%%', '%P %  %', '%  % G%', '%%%%%%%'])
+    reference = distanceCalculator.computeDistances(lay)
+    cacheDir = distanceCalculator.DISTANCE_CACHE_DIR
+    distanceCalculator.DISTANCE_CACHE_DIR = tempfile.mkdtemp()
+    try:
+        table = distanceCalculator.computeDistanceTable(lay)
+        distanceCalculator.saveDistanceTable(lay.walls, table)
+        for distances in [table, distanceCalculator.loadDistanceTable(lay.walls)]:
+            distancer = Distancer(lay, False)
+            distancer._distances = distances
+            for (pos1, pos2), distance in reference.items():
+                if distancer.getDistance(pos1, pos2) != distance:
+                    raise Exception('Distance mismatch for %s' % str((pos1, pos2)))
+            if distancer.getDistance((1, 1), (5, 2)) != sys.maxsize:
+                raise Exception('Unreachable cells are %s apart' % distancer.getDistance((1, 1), (5, 2)))
+            try:
+                distancer.getDistance((1, 1), (3, 1))
+            except Exception:
+                pass
+            else:
+                raise Exception('The distance to a wall did not raise')
+    finally:
+        shutil.rmtree(distanceCalculator.DISTANCE_CACHE_DIR)
+        distanceCalculator.DISTANCE_CACHE_DIR = cacheDir
+
+GAMES = [capturedDirectionalGhost, subclassedRandomGhost, gridCopiesShareColumns, unreachableDistances]
+
+if __name__ == '__main__':
+    failures = 0
+    for game in GAMES:
+        try:
+            game()
+            print('PASS', game.__name__)
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            print('FAIL', game.__name__)
+            failures += 1
+    sys.exit(failures)
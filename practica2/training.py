@@ -0,0 +1,158 @@
+# training.py
+# -----------
+# Headless training loop for the QLearningAgent in bustersAgents.py.
+#
+# Episodes are played directly on busters.GameState without going through
+# game.Game, so there is no display, muting, timing or per-ply file access.
+# The Q-table stays in memory for the whole run, is checkpointed every few
+# episodes and is written back to qtable.txt at the end; both go through
+# qtableStore.py.  Pacman's observations can be appended to a trajectory log
+# (see trajectoryLog.py).
+#
+#   python training.py -l labAA1 -g RandomGhost -k 2 -n 10000 -e 0.3 -r 0.5
+
+from __future__ import print_function
+from builtins import range
+from builtins import object
+import sys, time, random
+import busters
+import layout
+import qtableStore
+import textDisplay
+import trajectoryLog
+
+############
+# Training #
+############
+
+def runEpisode(layout, agent, ghosts, maxMoves=-1, log=None, parameters=None):
+    """
+    Plays one game with agent as Pacman, updating its Q-table after every
+    Pacman move.  The transition into the final state is learned as well.
+    parameters is an optional (epsilon, alpha, discount) tuple that replaces
+    the ones the agent sets up in registerInitialState.  Returns the final
+    GameState.
+    """
+    ghosts = ghosts[:layout.getNumGhosts()]
+    state = busters.GameState()
+    state.initialize(layout, len(ghosts))
+    state.maxMoves = maxMoves
+    agent.registerInitialState(state.deepCopy())
+    if parameters is not None:
+        agent.epsilon, agent.alpha, agent.discount = parameters
+    agents = [agent] + ghosts
+    numAgents = len(agents)
+    previous = previousAction = None
+    agentIndex = 0
+    while not (state.isWin() or state.isLose()):
+        if agentIndex == 0:
+            observation = agent.observationFunction(state.deepCopy())
+            action = agent.getAction(observation)
+            if previous is not None:
+                agent.update(previous, previousAction, observation, agent.getReward(previous, observation))
+            if log is not None:
+                log.log(observation)
+            previous, previousAction = observation, action
+        else:
+            action = agents[agentIndex].getAction(state)
+        state = state.generateSuccessor(agentIndex, action)
+        agentIndex = (agentIndex + 1) % numAgents
+    if previous is not None:
+        observation = agent.observationFunction(state.deepCopy())
+        agent.update(previous, previousAction, observation, agent.getReward(previous, observation))
+    if log is not None:
+        log.endGame()
+    return state
+
+def train(layout, agent, ghosts, numEpisodes, maxMoves=-1, epsilon=0.3, alpha=0.5, discount=0.8,
+          checkpointPath='qtable.bin', checkpointInterval=1000, logPath=None, quiet=False):
+    """
+    Runs numEpisodes training episodes and returns the final scores.
+
+    The Q-table is checkpointed to checkpointPath every checkpointInterval
+    episodes and at the end, when it is also written back to the agent's
+    text table.  If logPath is given every Pacman observation is appended
+    to it, as a trajectory log if the agent has the stock printLineData and
+    as the agent's printLineData lines otherwise.
+    """
+    import __main__
+    __main__.__dict__['_display'] = textDisplay.NullGraphics()
+    log = trajectoryLog.openLog(agent, True, logPath) if logPath else None
+    scores, wins = [], 0
+    start = time.time()
+    try:
+        for episode in range(1, numEpisodes + 1):
+            state = runEpisode(layout, agent, ghosts, maxMoves, log, (epsilon, alpha, discount))
+            scores.append(state.getScore())
+            wins += state.isWin()
+            if checkpointPath and episode % checkpointInterval == 0:
+                qtableStore.writeBinary(agent.q_table, checkpointPath)
+                if not quiet:
+                    recent = scores[-checkpointInterval:]
+                    print('Episode %d: average score %.2f, %d wins, %.1f episodes/s' %
+                          (episode, sum(recent) / float(len(recent)), wins, episode / (time.time() - start)))
+    finally:
+        if log is not None: log.close()
+    if checkpointPath:
+        qtableStore.writeBinary(agent.q_table, checkpointPath)
+    agent.writeQtable()
+    return scores
+
+def readCommand(argv):
+    "Processes the command used to run the training from the command line."
+    from optparse import OptionParser
+    usageStr = """
+    USAGE:      python training.py <options>
+    EXAMPLE:    python training.py -l labAA1 -g RandomGhost -k 2 -n 10000
+                  - trains the QLearningAgent for 10000 episodes
+    """
+    parser = OptionParser(usageStr)
+    parser.add_option('-n', '--numEpisodes', dest='numEpisodes', type='int',
+                      help=busters.default('the number of training EPISODES'), metavar='EPISODES', default=1000)
+    parser.add_option('-l', '--layout', dest='layout',
+                      help=busters.default('the LAYOUT_FILE from which to load the map layout'),
+                      metavar='LAYOUT_FILE', default='labAA1')
+    parser.add_option('-g', '--ghosts', dest='ghost',
+                      help=busters.default('the ghost agent TYPE in the ghostAgents module to use'),
+                      metavar='TYPE', default='RandomGhost')
+    parser.add_option('-k', '--numghosts', type='int', dest='numGhosts',
+                      help=busters.default('The maximum number of ghosts to use'), default=4)
+    parser.add_option('-m', '--maxMoves', type='int', dest='maxMoves',
+                      help=busters.default('Moves after which an episode is lost (-1 for no limit)'), default=-1)
+    parser.add_option('-e', '--epsilon', type='float', dest='epsilon',
+                      help=busters.default('Exploration rate'), default=0.3)
+    parser.add_option('-r', '--alpha', type='float', dest='alpha',
+                      help=busters.default('Learning rate'), default=0.5)
+    parser.add_option('-d', '--discount', type='float', dest='discount',
+                      help=busters.default('Discount factor'), default=0.8)
+    parser.add_option('-c', '--checkpoint', dest='checkpointPath',
+                      help=busters.default('Binary Q-table checkpoint file'), default='qtable.bin')
+    parser.add_option('-i', '--checkpointInterval', type='int', dest='checkpointInterval',
+                      help=busters.default('Episodes between checkpoints'), default=1000)
+    parser.add_option('--log', dest='logPath',
+                      help='Append every Pacman observation to this trajectory log', default=None)
+    parser.add_option('-f', '--fixRandomSeed', action='store_true', dest='fixRandomSeed',
+                      help='Fixes the random seed to always train the same way', default=False)
+    parser.add_option('-q', '--quiet', action='store_true', dest='quiet',
+                      help='Do not report progress at every checkpoint', default=False)
+
+    options, otherjunk = parser.parse_args(argv)
+    if len(otherjunk) != 0:
+        raise Exception('Command line input not understood: ' + str(otherjunk))
+    if options.fixRandomSeed: random.seed('bustersPacman')
+
+    import bustersAgents
+    args = dict()
+    args['layout'] = layout.getLayout(options.layout)
+    if args['layout'] == None: raise Exception("The layout " + options.layout + " cannot be found")
+    ghostType = busters.loadAgent(options.ghost, True)
+    args['ghosts'] = [ghostType(i + 1) for i in range(options.numGhosts)]
+    args['agent'] = bustersAgents.QLearningAgent(ghostAgents=args['ghosts'])
+    for name in ['numEpisodes', 'maxMoves', 'epsilon', 'alpha', 'discount',
+                 'checkpointPath', 'checkpointInterval', 'logPath', 'quiet']:
+        args[name] = getattr(options, name)
+    return args
+
+if __name__ == '__main__':
+    args = readCommand(sys.argv[1:])
+    train(**args)
@@ -5,6 +5,7 @@ from __future__ import division
 from builtins import range
 from builtins import object
 from past.utils import old_div
+from array import array
 import math
 from math import pi as PI
 import time
@@ -371,6 +372,143 @@ class CrawlingRobot(object):
 
 
 
+class HeadlessCrawlingRobot(CrawlingRobot):
+    """
+        A CrawlingRobot with the same geometry but no canvas, for
+        simulating the robot without a display.  It cannot be drawn.
+    """
+
+    def __init__(self):
+        self.armAngle = self.oldArmDegree = 0.0
+        self.handAngle = self.oldHandDegree = old_div(-PI,6)
+
+        self.maxArmAngle = old_div(PI,6)
+        self.minArmAngle = old_div(-PI,6)
+
+        self.maxHandAngle = 0
+        self.minHandAngle = -(5.0/6.0) * PI
+
+        self.groundY = 0
+        self.robotWidth = 80
+        self.robotHeight = 40
+        self.robotPos = (20, self.groundY)
+        self.armLength = 60
+        self.handLength = 40
+
+        self.positions = [0,0]
+
+
+class BatchCrawlingRobotEnvironment(object):
+    """
+      Steps numRobots independent crawling robots in lockstep
+      without a display.
+
+      The robots live on the same buckets as CrawlingRobotEnvironment,
+      but states are numbered armBucket * nHandStates + handBucket and
+      actions are numbered as in ACTIONS.  The next state and the
+      reward (the x displacement) of every (state, action) pair are
+      computed once with the robot geometry, so a step is two table
+      lookups per robot instead of the trigonometry in displacement.
+    """
+
+    ACTIONS = ('arm-down', 'arm-up', 'hand-down', 'hand-up')
+
+    def __init__(self, numRobots, robot=None):
+        self.numRobots = numRobots
+        if robot is None: robot = HeadlessCrawlingRobot()
+        single = CrawlingRobotEnvironment(robot)
+        self.nArmStates = single.nArmStates
+        self.nHandStates = single.nHandStates
+        self.numStates = self.nArmStates * self.nHandStates
+        self.armBuckets, self.handBuckets = single.armBuckets, single.handBuckets
+
+        # Indexed by state * len(ACTIONS) + action; illegal moves have next state -1
+        numActions = len(self.ACTIONS)
+        self.nextStates = array('i', [-1]) * (self.numStates * numActions)
+        self.rewards = array('d', [0.0]) * (self.numStates * numActions)
+        self.legalActions = []
+        for state in range(self.numStates):
+            armBucket, handBucket = self.getBuckets(state)
+            legal = single.getPossibleActions((armBucket, handBucket))
+            self.legalActions.append(tuple([self.ACTIONS.index(a) for a in legal]))
+            for action in legal:
+                single.state = (armBucket, handBucket)
+                robot.setAngles(self.armBuckets[armBucket], self.handBuckets[handBucket])
+                nextState, reward = single.doAction(action)
+                entry = state * numActions + self.ACTIONS.index(action)
+                self.nextStates[entry] = self.getStateIndex(nextState)
+                self.rewards[entry] = reward
+        self.reset()
+
+    def getStateIndex(self, buckets):
+        "Returns the number of an (armBucket, handBucket) state."
+        return buckets[0] * self.nHandStates + buckets[1]
+
+    def getBuckets(self, state):
+        "Returns the (armBucket, handBucket) pair of a state number."
+        return divmod(state, self.nHandStates)
+
+    def reset(self):
+        "Puts every robot back in the middle state at x = 0."
+        start = self.getStateIndex((old_div(self.nArmStates,2), old_div(self.nHandStates,2)))
+        self.states = array('i', [start]) * self.numRobots
+        self.positions = array('d', [0.0]) * self.numRobots
+
+    def step(self, actions):
+        """
+          Performs actions[i] (an action number) for every robot i
+          and returns the list of rewards.  The actions must be
+          legal in the robots' current states.
+        """
+        numActions = len(self.ACTIONS)
+        nextStates, rewards, states, positions = self.nextStates, self.rewards, self.states, self.positions
+        result = []
+        for i, action in enumerate(actions):
+            entry = states[i] * numActions + action
+            reward = rewards[entry]
+            states[i] = nextStates[entry]
+            positions[i] += reward
+            result.append(reward)
+        return result
+
+
+def batchQLearning(environment, steps, alpha=0.8, discount=0.8, epsilon=0.5, qValues=None):
+    """
+      Runs epsilon-greedy Q-learning with all the robots of a
+      BatchCrawlingRobotEnvironment sharing one Q-table, for steps
+      lockstep steps.  The table is a flat array indexed like the
+      environment's tables (illegal entries stay 0) and is returned.
+    """
+    numActions = len(environment.ACTIONS)
+    if qValues is None: qValues = array('d', [0.0]) * len(environment.rewards)
+    nextStates, rewards, legalActions = environment.nextStates, environment.rewards, environment.legalActions
+    states, positions = environment.states, environment.positions
+    rand, choice = random.random, random.choice
+
+    # The best Q-value of every state, kept up to date as the table changes
+    def best(state):
+        return max([qValues[state * numActions + a] for a in legalActions[state]])
+    values = array('d', [best(s) for s in range(environment.numStates)])
+
+    for step in range(steps):
+        for i in range(environment.numRobots):
+            state = states[i]
+            legal = legalActions[state]
+            if rand() < epsilon:
+                action = choice(legal)
+            else:
+                base = state * numActions
+                action = max(legal, key=lambda a: qValues[base + a])
+            entry = state * numActions + action
+            nextState = nextStates[entry]
+            reward = rewards[entry]
+            qValues[entry] += alpha * (reward + discount * values[nextState] - qValues[entry])
+            values[state] = best(state)
+            states[i] = nextState
+            positions[i] += reward
+    return qValues
+
+
 if __name__ == '__main__':
     from graphicsCrawlerDisplay import *
     run()
@@ -4,7 +4,9 @@
 "Feature extractors for Pacman game states"
 
 from builtins import object
+from collections import deque
 from game import Directions, Actions
+import heapq
 import util
 
 class FeatureExtractor(object):
@@ -27,10 +29,10 @@ def closestFood(pos, food, walls):
     closestFood -- this is similar to the function that we have
     worked on in the search project; here its all in one place
     """
-    fringe = [(pos[0], pos[1], 0)]
+    fringe = deque([(pos[0], pos[1], 0)])
     expanded = set()
     while fringe:
-        pos_x, pos_y, dist = fringe.pop(0)
+        pos_x, pos_y, dist = fringe.popleft()
         if (pos_x, pos_y) in expanded:
             continue
         expanded.add((pos_x, pos_y))
@@ -44,6 +46,73 @@ def closestFood(pos, food, walls):
     # no food found
     return None
 
+class FoodDistanceField(object):
+    """
+    The maze distance from every free cell of a layout to the nearest
+    remaining food, from a BFS started at all the food at once.
+
+    When food is eaten only the cells whose nearest food was eaten can
+    get further away, so update() re-runs the search over those cells
+    alone, seeded from the distances of their unaffected neighbours.
+    """
+
+    def __init__(self, walls, food):
+        self.walls = walls
+        self.neighbors = {}
+        for x in range(walls.width):
+            for y in range(walls.height):
+                if not walls[x][y]:
+                    self.neighbors[(x, y)] = Actions.getLegalNeighbors((x, y), walls)
+        self.reset(food)
+
+    def reset(self, food):
+        "Recomputes every distance for the given food grid."
+        self.food = food.copy()
+        self.foodSet = set(food.asList())
+        self.distances, self.sources = {}, {}
+        fringe = deque()
+        for cell in self.foodSet:
+            self.distances[cell], self.sources[cell] = 0, cell
+            fringe.append(cell)
+        while fringe:
+            cell = fringe.popleft()
+            dist, source = self.distances[cell] + 1, self.sources[cell]
+            for nbr in self.neighbors[cell]:
+                if nbr not in self.distances:
+                    self.distances[nbr], self.sources[nbr] = dist, source
+                    fringe.append(nbr)
+
+    def update(self, food):
+        "Brings the distances up to date with a new food grid of the same layout."
+        if food.data == self.food.data: return
+        foodSet = set(food.asList())
+        eaten = self.foodSet - foodSet
+        if foodSet - self.foodSet:
+            self.reset(food)
+            return
+        self.food, self.foodSet = food.copy(), foodSet
+        distances, sources = self.distances, self.sources
+        affected = [cell for cell in distances if sources[cell] in eaten]
+        for cell in affected:
+            del distances[cell], sources[cell]
+        heap = []
+        for cell in affected:
+            for nbr in self.neighbors[cell]:
+                if nbr in distances:
+                    heap.append((distances[nbr] + 1, cell, sources[nbr]))
+        heapq.heapify(heap)
+        while heap:
+            dist, cell, source = heapq.heappop(heap)
+            if cell in distances: continue
+            distances[cell], sources[cell] = dist, source
+            for nbr in self.neighbors[cell]:
+                if nbr not in distances:
+                    heapq.heappush(heap, (dist + 1, nbr, source))
+
+    def getDistance(self, pos):
+        "The distance from pos to the nearest food, or None if no food can be reached."
+        return self.distances.get(pos)
+
 class SimpleExtractor(FeatureExtractor):
     """
     Returns simple features for a basic reflex Pacman:
@@ -51,9 +120,40 @@ class SimpleExtractor(FeatureExtractor):
     - how far away the next food is
     - whether a ghost collision is imminent
     - whether a ghost is one step away
+
+    The distance to the nearest food is looked up in a FoodDistanceField
+    kept up to date across calls, and the features of the last few states
+    are memoized per action, since an agent asks for the same (state,
+    action) pairs when acting and again when learning.
     """
 
+    MEMO_STATES = 3
+
+    def __init__(self):
+        self.field = None
+        self.memo = []
+
     def getFeatures(self, state, action):
+        for memoState, features in self.memo:
+            if memoState is state:
+                if action not in features:
+                    features[action] = self.computeFeatures(state, action)
+                return features[action]
+        features = {action: self.computeFeatures(state, action)}
+        self.memo = [(state, features)] + self.memo[:self.MEMO_STATES - 1]
+        return features[action]
+
+    def getFoodDistance(self, pos, food, walls):
+        "The maze distance from pos to the nearest food, or None if there is none."
+        if self.field is None or not (walls is self.field.walls or walls == self.field.walls):
+            self.field = FoodDistanceField(walls, food)
+        else:
+            self.field.update(food)
+        if pos in self.field.neighbors:
+            return self.field.getDistance(pos)
+        return closestFood(pos, food, walls)
+
+    def computeFeatures(self, state, action):
         # extract the grid of food and wall locations and get the ghost locations
         food = state.getFood()
         walls = state.getWalls()
@@ -75,7 +175,7 @@ class SimpleExtractor(FeatureExtractor):
         if not features["#-of-ghosts-1-step-away"] and food[next_x][next_y]:
             features["eats-food"] = 1.0
 
-        dist = closestFood((next_x, next_y), food, walls)
+        dist = self.getFoodDistance((next_x, next_y), food, walls)
         if dist is not None:
             # make the distance a number less than one otherwise the update
             # will diverge wildly
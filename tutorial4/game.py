@@ -493,7 +493,8 @@ class Game:
     The Game manages the control flow, soliciting actions from agents.
     """
 
-    def __init__( self, agents, display, rules, startingIndex=0, muteAgents=False, catchExceptions=False ):
+    def __init__( self, agents, display, rules, startingIndex=0, muteAgents=False, catchExceptions=False,
+                  outputLimit=AGENT_OUTPUT_LIMIT, outputRate=None ):
         self.agentCrashed = False
         self.agents = agents
         self.display = display
@@ -506,8 +507,9 @@ class Game:
         self.totalAgentTimes = [0 for agent in agents]
         self.totalAgentTimeWarnings = [0 for agent in agents]
         self.agentTimeout = False
-        import io
-        self.agentOutput = [io.StringIO() for agent in agents]
+        # What muted agents print goes to bounded per-agent buffers
+        self.output = OutputCapture(len(agents), outputLimit, outputRate) if muteAgents else None
+        self.agentOutput = self.output.buffers if muteAgents else []
 
     def getProgress(self):
         if self.gameOver:
@@ -522,30 +524,30 @@ class Game:
         self.agentCrashed = True
         self.rules.agentCrash(self, agentIndex)
 
-    OLD_STDOUT = None
-    OLD_STDERR = None
-
     def mute(self, agentIndex):
-        if not self.muteAgents: return
-        global OLD_STDOUT, OLD_STDERR
-        import io
-        OLD_STDOUT = sys.stdout
-        OLD_STDERR = sys.stderr
-        sys.stdout = self.agentOutput[agentIndex]
-        sys.stderr = self.agentOutput[agentIndex]
+        if self.output is not None: self.output.select(agentIndex)
 
     def unmute(self):
-        if not self.muteAgents: return
-        global OLD_STDOUT, OLD_STDERR
-        # Revert stdout/stderr to originals
-        sys.stdout = OLD_STDOUT
-        sys.stderr = OLD_STDERR
+        if self.output is not None: self.output.select(None)
 
+    def getAgentOutput(self, agentIndex):
+        "The tail of what a muted agent has printed."
+        return self.output.buffers[agentIndex].getvalue() if self.output is not None else ''
 
     def run( self ):
         """
         Main control loop for game play.
         """
+        if self.output is None:
+            return self._run()
+        # Muted agents print into their buffers until the game is over
+        self.output.install()
+        try:
+            return self._run()
+        finally:
+            self.output.uninstall()
+
+    def _run( self ):
         self.display.initialize(self.state.data)
         self.numMoves = 0
 
@@ -565,7 +567,7 @@ class Game:
                 self.mute(i)
                 if self.catchExceptions:
                     try:
-                        timed_func = TimeoutFunction(agent.registerInitialState, int(self.rules.getMaxStartupTime(i)))
+                        timed_func = TimeoutFunction(agent.registerInitialState, self.rules.getMaxStartupTime(i))
                         try:
                             start_time = time.time()
                             timed_func(self.state.deepCopy())
@@ -599,7 +601,7 @@ class Game:
                 self.mute(agentIndex)
                 if self.catchExceptions:
                     try:
-                        timed_func = TimeoutFunction(agent.observationFunction, int(self.rules.getMoveTimeout(agentIndex)))
+                        timed_func = TimeoutFunction(agent.observationFunction, self.rules.getMoveTimeout(agentIndex))
                         try:
                             start_time = time.time()
                             observation = timed_func(self.state.deepCopy())
@@ -622,7 +624,7 @@ class Game:
             self.mute(agentIndex)
             if self.catchExceptions:
                 try:
-                    timed_func = TimeoutFunction(agent.getAction, int(self.rules.getMoveTimeout(agentIndex)) - int(move_time))
+                    timed_func = TimeoutFunction(agent.getAction, self.rules.getMoveTimeout(agentIndex) - move_time)
                     try:
                         start_time = time.time()
                         if skip_action:
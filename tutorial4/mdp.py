@@ -3,7 +3,10 @@
 
 
 from builtins import object
+from builtins import range
+from array import array
 import random
+import heapq
 
 class MarkovDecisionProcess(object):
 
@@ -56,3 +59,159 @@ class MarkovDecisionProcess(object):
         are equivalent.
         """
         abstract
+
+class CompiledMDP(object):
+    """
+    A MarkovDecisionProcess flattened into arrays, so planning algorithms
+    do not have to call back into the MDP.
+
+    States are numbered in getStates() order.  Every (state, action) pair
+    of a non-terminal state gets a pair index; the pairs of state i are
+    actionStarts[i] to actionStarts[i+1] - 1 and their actions are in
+    pairActions.  The transitions of pair k are stored in compressed row
+    form: entries pairStarts[k] to pairStarts[k+1] - 1 of nextStates and
+    probabilities.  Rewards only enter value iteration through their
+    expectation, so each pair keeps sum(prob * reward) in expectedRewards.
+    """
+
+    def __init__(self, mdp):
+        self.mdp = mdp
+        self.states = list(mdp.getStates())
+        self.stateIndex = dict([(state, i) for i, state in enumerate(self.states)])
+        self.actionStarts = array('i', [0])
+        self.pairActions = []
+        self.pairStarts = array('i', [0])
+        self.nextStates = array('i')
+        self.probabilities = array('d')
+        self.expectedRewards = array('d')
+        for state in self.states:
+            if not mdp.isTerminal(state):
+                for action in mdp.getPossibleActions(state):
+                    expectedReward = 0.0
+                    for nextState, prob in mdp.getTransitionStatesAndProbs(state, action):
+                        if prob == 0: continue
+                        self.nextStates.append(self.stateIndex[nextState])
+                        self.probabilities.append(prob)
+                        expectedReward += prob * mdp.getReward(state, action, nextState)
+                    self.pairActions.append(action)
+                    self.pairStarts.append(len(self.nextStates))
+                    self.expectedRewards.append(expectedReward)
+            self.actionStarts.append(len(self.pairActions))
+
+    def getQValues(self, values, discount, index):
+        "Returns the Q-values of the pairs of state number index under values."
+        pairStarts, nextStates, probabilities = self.pairStarts, self.nextStates, self.probabilities
+        qValues = []
+        for pair in range(self.actionStarts[index], self.actionStarts[index + 1]):
+            expected = 0.0
+            for k in range(pairStarts[pair], pairStarts[pair + 1]):
+                expected += probabilities[k] * values[nextStates[k]]
+            qValues.append(self.expectedRewards[pair] + discount * expected)
+        return qValues
+
+    def backup(self, values, discount, index):
+        "Returns the Bellman backup of state number index: its best Q-value, or 0 without actions."
+        qValues = self.getQValues(values, discount, index)
+        if len(qValues) == 0: return 0.0
+        return max(qValues)
+
+    def getPredecessors(self):
+        """
+        Returns, for every state number, an array of the states that reach it
+        with non-zero probability under some action.  Computed once.
+        """
+        if not hasattr(self, 'predecessors'):
+            predecessors = [set() for state in self.states]
+            for i in range(len(self.states)):
+                for pair in range(self.actionStarts[i], self.actionStarts[i + 1]):
+                    for k in range(self.pairStarts[pair], self.pairStarts[pair + 1]):
+                        predecessors[self.nextStates[k]].add(i)
+            self.predecessors = [array('i', sorted(p)) for p in predecessors]
+        return self.predecessors
+
+    def sweep(self, values, discount, inPlace=False):
+        """
+        Performs one Bellman backup of every state, in order.  Returns the
+        new values and the largest change (the residual).  States without
+        actions keep a value of 0.  A synchronous sweep backs every state up
+        from the old values; an in-place (Gauss-Seidel) sweep overwrites
+        values as it goes, so later states already see the new ones.
+        """
+        actionStarts, pairStarts = self.actionStarts, self.pairStarts
+        nextStates, probabilities, expectedRewards = self.nextStates, self.probabilities, self.expectedRewards
+        newValues = values if inPlace else array('d', [0.0]) * len(values)
+        residual = 0.0
+        pair = 0
+        for i in range(len(values)):
+            end = actionStarts[i + 1]
+            if pair == end: continue
+            best = None
+            while pair < end:
+                expected = 0.0
+                for k in range(pairStarts[pair], pairStarts[pair + 1]):
+                    expected += probabilities[k] * values[nextStates[k]]
+                q = expectedRewards[pair] + discount * expected
+                if best is None or q > best: best = q
+                pair += 1
+            if abs(best - values[i]) > residual: residual = abs(best - values[i])
+            newValues[i] = best
+        return newValues, residual
+
+    def valueIteration(self, discount, iterations, tolerance=0.0):
+        """
+        Runs up to iterations synchronous sweeps from all-zero values,
+        stopping early once the residual is at most tolerance.  Returns the
+        values and the number of sweeps run.
+        """
+        return self._iterate(discount, iterations, tolerance, False)
+
+    def asynchronousValueIteration(self, discount, iterations, tolerance=0.0):
+        """
+        Like valueIteration, but every sweep updates the values in place.
+        Converges in fewer sweeps, to the same fixed point.
+        """
+        return self._iterate(discount, iterations, tolerance, True)
+
+    def _iterate(self, discount, iterations, tolerance, inPlace):
+        values = array('d', [0.0]) * len(self.states)
+        for iteration in range(iterations):
+            values, residual = self.sweep(values, discount, inPlace)
+            if residual <= tolerance:
+                return values, iteration + 1
+        return values, iterations
+
+    def prioritizedSweeping(self, discount, maxBackups, tolerance=1e-5):
+        """
+        Backs states up one at a time, always the state with the largest
+        Bellman error, starting from all-zero values.  After a state changes
+        only its predecessors can change error, so only they are re-checked.
+        Stops once no state has an error above tolerance, or after
+        maxBackups backups.  Returns the values and the number of backups.
+
+        The errors live in a max-heap (negated for heapq) with lazy
+        deletion: priority holds every state's latest queued error and
+        entries that no longer match it are skipped.
+        """
+        values = array('d', [0.0]) * len(self.states)
+        priority = array('d', [0.0]) * len(self.states)
+        heap = []
+        for i in range(len(self.states)):
+            error = abs(self.backup(values, discount, i))
+            if error > tolerance:
+                priority[i] = error
+                heap.append((-error, i))
+        heapq.heapify(heap)
+        predecessors = self.getPredecessors()
+        backups = 0
+        while heap and backups < maxBackups:
+            error, i = heapq.heappop(heap)
+            if -error != priority[i]: continue
+            priority[i] = 0.0
+            values[i] = self.backup(values, discount, i)
+            backups += 1
+            for p in predecessors[i]:
+                error = abs(self.backup(values, discount, p) - values[p])
+                if error > tolerance and error > priority[p]:
+                    priority[p] = error
+                    heapq.heappush(heap, (-error, p))
+        return values, backups
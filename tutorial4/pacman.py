@@ -138,6 +138,13 @@ class GameState(object):
     def getGhostStates( self ):
         return self.data.agentStates[1:]
 
+    def getVisibleGhosts( self ):
+        "Returns the states of the ghosts in Pacman's line of sight, in the direction it faces."
+        configuration = self.data.agentStates[0].configuration
+        layout = self.data.layout
+        return [ghost for ghost in self.getGhostStates()
+                if layout.isVisibleFrom(ghost.getPosition(), configuration.getPosition(), configuration.getDirection())]
+
     def getGhostState( self, agentIndex ):
         if agentIndex == 0 or agentIndex >= self.getNumAgents():
             raise Exception("Invalid index passed to getGhostState")
@@ -502,7 +509,11 @@ def readCommand( argv ):
     parser.add_option('-r', '--recordActions', action='store_true', dest='record',
                       help='Writes game histories to a file (named by the time they were played)', default=False)
     parser.add_option('--replay', dest='gameToReplay',
-                      help='A recorded game file (pickle) to replay', default=None)
+                      help='A recorded game file to replay', default=None)
+    parser.add_option('--replayGame', dest='replayIndex', type='int',
+                      help=default('Which game of the recording file to replay'), default=0)
+    parser.add_option('--replayFrom', dest='replayFrom', type='int',
+                      help=default('The ply from which to replay the recorded game'), default=0)
     parser.add_option('-a','--agentArgs',dest='agentArgs',
                       help='Comma separated values sent to agent. e.g. "opt1=val1,opt2,opt3=val3"')
     parser.add_option('-x', '--numTraining', dest='numTraining', type='int',
@@ -564,12 +575,17 @@ def readCommand( argv ):
     # Special case: recorded games don't use the runGames method or args structure
     if options.gameToReplay != None:
         print('Replaying recorded game %s.' % options.gameToReplay)
-        import pickle
-        f = open(options.gameToReplay)
-        try: recorded = pickle.load(f)
-        finally: f.close()
-        recorded['display'] = args['display']
-        replayGame(**recorded)
+        import recording
+        if recording.isRecording(options.gameToReplay):
+            recorded = recording.loadRecording(options.gameToReplay, options.replayIndex)
+            replayRecording(recorded, args['display'], options.replayFrom)
+        else: # A pickled layout and move history
+            import pickle
+            f = open(options.gameToReplay, 'rb')
+            try: recorded = pickle.load(f)
+            finally: f.close()
+            recorded['display'] = args['display']
+            replayGame(**recorded)
         sys.exit(0)
 
     return args
@@ -597,12 +613,16 @@ def loadAgent(pacman, nographics):
                 return getattr(module, pacman)
     raise Exception('The agent ' + pacman + ' is not specified in any *Agents.py.')
 
-def replayGame( layout, actions, display ):
-    import pacmanAgents, ghostAgents
+def replayGame( layout, actions, display, state=None ):
+    """
+    Shows a game by replaying its actions, from state if it is given and
+    from the start of the game otherwise.  The agents are never asked for a
+    move, so none are loaded.
+    """
     rules = ClassicGameRules()
-    agents = [pacmanAgents.GreedyAgent()] + [ghostAgents.RandomGhost(i+1) for i in range(layout.getNumGhosts())]
-    game = rules.newGame( layout, agents[0], agents[1:], display )
-    state = game.state
+    numGhosts = layout.getNumGhosts() if state is None else len(state.data.agentStates) - 1
+    game = rules.newGame( layout, None, [None] * numGhosts, display )
+    if state is None: state = game.state
     display.initialize(state.data)
 
     for action in actions:
@@ -615,6 +635,19 @@ def replayGame( layout, actions, display ):
 
     display.finish()
 
+def replayRecording( recorded, display, startPly=0 ):
+    "Replays a recording.Recording from startPly, seeking to it through the keyframes."
+    state = recorded.stateAt(recorded.getInitialState(GameState), startPly)
+    replayGame(recorded.getLayout(), recorded.actions[startPly:], display, state)
+
+def recordGame( layout, game, index ):
+    "Writes the layout and move history of a finished game to a file named by the current time"
+    import time, recording
+    fname = ('recorded-game-%d' % (index + 1)) +  '-'.join([str(t) for t in time.localtime()[1:6]])
+    initialState = GameState()
+    initialState.initialize(layout, len(game.state.data.agentStates) - 1)
+    recording.writeRecordings(fname, [recording.makeRecording(layout, initialState, game.moveHistory)])
+
 def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0, catchExceptions=False, timeout=30 ):
     import __main__
     __main__.__dict__['_display'] = display
@@ -636,13 +669,7 @@ def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0
         game.run()
         if not beQuiet: games.append(game)
 
-        if record:
-            import time, pickle
-            fname = ('recorded-game-%d' % (i + 1)) +  '-'.join([str(t) for t in time.localtime()[1:6]])
-            f = file(fname, 'w')
-            components = {'layout': layout, 'actions': game.moveHistory}
-            pickle.dump(components, f)
-            f.close()
+        if record: recordGame(layout, game, i)
 
     if (numGames-numTraining) > 0:
         scores = [game.state.getScore() for game in games]
@@ -6,6 +6,8 @@ from learningAgents import ReinforcementAgent
 from featureExtractors import *
 
 import random,util,math
+from array import array
+import qtableStore
 
 class QLearningAgent(ReinforcementAgent):
     """
@@ -19,36 +21,24 @@ class QLearningAgent(ReinforcementAgent):
         - self.alpha (learning rate)
         - self.discount (discount rate)
     """
-    def __init__(self, **args):
+    def __init__(self, qtableFile="qtable.txt", **args):
         "Initialize Q-values"
         ReinforcementAgent.__init__(self, **args)
 
         self.actions = {"north":0, "east":1, "south":2, "west":3, "exit":4}
-        self.table_file = open("qtable.txt", "r+")
+        self.qtableFile = qtableFile
 #        self.table_file_csv = open("qtable.csv", "r+")        
         self.q_table = self.readQtable()
         self.epsilon = 0.05
 
     def readQtable(self):
-        "Read qtable from disc"
-        table = self.table_file.readlines()
-        q_table = []
-
-        for i, line in enumerate(table):
-            row = line.split()
-            row = [float(x) for x in row]
-            q_table.append(row)
-
-        return q_table
+        "Read qtable from disc (text for .txt files, binary otherwise)"
+        actionNames = sorted(self.actions, key=self.actions.get)
+        return qtableStore.loadQtable(self.qtableFile, actionNames)
 
     def writeQtable(self):
-        "Write qtable to disc"
-        self.table_file.seek(0)
-        self.table_file.truncate()
-        for line in self.q_table:
-            for item in line:
-                self.table_file.write(str(item)+" ")
-            self.table_file.write("\n")
+        "Write qtable to disc, replacing the old file atomically"
+        qtableStore.saveQtable(self.q_table, self.qtableFile)
 
 #         self.table_file_csv.seek(0)
 #         self.table_file_csv.truncate()
@@ -68,7 +58,6 @@ class QLearningAgent(ReinforcementAgent):
     def __del__(self):
         "Destructor. Invokation at the end of each episode"
         self.writeQtable()
-        self.table_file.close()
 
     def computePosition(self, state):
         """
@@ -230,34 +219,67 @@ class ApproximateQAgent(PacmanQAgent):
        You should only have to overwrite getQValue
        and update.  All other QLearningAgent functions
        should work as is.
+
+       Feature names are mapped to integer slots the first
+       time they are seen and the weights live in one array
+       indexed by slot, so a Q-value is a dot product over
+       the (slot, value) pairs of a feature vector.
     """
     def __init__(self, extractor='IdentityExtractor', **args):
         self.featExtractor = util.lookup(extractor, globals())()
         PacmanQAgent.__init__(self, **args)
-        self.weights = util.Counter()
+        self.featureSlots = {}
+        self.weightArray = array('d')
 
     def getWeights(self):
-        return self.weights
+        "Returns the weights as a Counter keyed by feature name."
+        weights = util.Counter()
+        for name, slot in self.featureSlots.items():
+            weights[name] = self.weightArray[slot]
+        return weights
+
+    def getFeatureVector(self, state, action):
+        """
+          Returns the features of (state, action) as parallel
+          lists of weight slots and feature values.
+        """
+        slots, values = [], []
+        for name, value in self.featExtractor.getFeatures(state, action).items():
+            slot = self.featureSlots.get(name)
+            if slot is None:
+                slot = self.featureSlots[name] = len(self.weightArray)
+                self.weightArray.append(0.0)
+            slots.append(slot)
+            values.append(value)
+        return slots, values
 
     def getQValue(self, state, action):
         """
           Should return Q(state,action) = w * featureVector
           where * is the dotProduct operator
         """
-        "*** YOUR CODE HERE ***"
-        util.raiseNotDefined()
+        slots, values = self.getFeatureVector(state, action)
+        weights = self.weightArray
+        return sum([weights[slot] * value for slot, value in zip(slots, values)])
+
+    def computeValueFromQValues(self, state):
+        "The best Q-value over the legal actions, or 0.0 at the terminal state."
+        legalActions = self.getLegalActions(state)
+        if len(legalActions) == 0:
+            return 0.0
+        return max([self.getQValue(state, action) for action in legalActions])
 
     def update(self, state, action, nextState, reward):
         """
            Should update your weights based on transition
         """
-        "*** YOUR CODE HERE ***"
-
-        feats = self.featExtractor.getFeatures(state, action)
-        for f in feats:
-          self.weights[f] = self.weights[f] + self.alpha * feats[f]*((reward + self.discount * self.computeValueFromQValues(nextState)) - self.getQValue(state, action))
-
-        # util.raiseNotDefined()
+        slots, values = self.getFeatureVector(state, action)
+        weights = self.weightArray
+        qValue = sum([weights[slot] * value for slot, value in zip(slots, values)])
+        difference = reward + self.discount * self.computeValueFromQValues(nextState) - qValue
+        step = self.alpha * difference
+        for slot, value in zip(slots, values):
+            weights[slot] += step * value
 
     def final(self, state):
         "Called at the end of each game."
@@ -3,6 +3,7 @@
 
 
 import mdp, util
+from mdp import CompiledMDP
 
 from learningAgents import ValueEstimationAgent
 
@@ -14,8 +15,12 @@ class ValueIterationAgent(ValueEstimationAgent):
         (see mdp.py) on initialization and runs value iteration
         for a given number of iterations using the supplied
         discount factor.
+
+        The mdp is compiled into a CompiledMDP once, and each
+        iteration is a sweep over its arrays.  Iteration stops
+        early once no value changes by more than tolerance.
     """
-    def __init__(self, mdp, discount = 0.9, iterations = 100):
+    def __init__(self, mdp, discount = 0.9, iterations = 100, tolerance = 0.0):
         """
           Your value iteration agent should take an mdp on
           construction, run the indicated number of iterations
@@ -31,10 +36,18 @@ class ValueIterationAgent(ValueEstimationAgent):
         self.mdp = mdp
         self.discount = discount
         self.iterations = iterations
+        self.tolerance = tolerance
         self.values = util.Counter() # A Counter is a dict with default 0
 
-        # Write value iteration code here
-        "*** YOUR CODE HERE ***"
+        self.compiled = CompiledMDP(mdp)
+        self.valueArray = self.runValueIteration()
+        for state, value in zip(self.compiled.states, self.valueArray):
+            self.values[state] = value
+
+    def runValueIteration(self):
+        "Runs synchronous value iteration and returns the values of the compiled states."
+        values, self.iterationsRun = self.compiled.valueIteration(self.discount, self.iterations, self.tolerance)
+        return values
 
     def getValue(self, state):
         """
@@ -48,8 +61,13 @@ class ValueIterationAgent(ValueEstimationAgent):
           Compute the Q-value of action in state from the
           value function stored in self.values.
         """
-        "*** YOUR CODE HERE ***"
-        util.raiseNotDefined()
+        compiled = self.compiled
+        index = compiled.stateIndex[state]
+        actions = compiled.pairActions[compiled.actionStarts[index]:compiled.actionStarts[index + 1]]
+        if action not in actions:
+            return 0.0
+        qValues = compiled.getQValues(self.valueArray, self.discount, index)
+        return qValues[actions.index(action)]
 
     def computeActionFromValues(self, state):
         """
@@ -60,8 +78,13 @@ class ValueIterationAgent(ValueEstimationAgent):
           there are no legal actions, which is the case at the
           terminal state, you should return None.
         """
-        "*** YOUR CODE HERE ***"
-        util.raiseNotDefined()
+        compiled = self.compiled
+        index = compiled.stateIndex[state]
+        start = compiled.actionStarts[index]
+        qValues = compiled.getQValues(self.valueArray, self.discount, index)
+        if len(qValues) == 0:
+            return None
+        return compiled.pairActions[start + qValues.index(max(qValues))]
 
     def getPolicy(self, state):
         return self.computeActionFromValues(state)
@@ -72,3 +95,35 @@ class ValueIterationAgent(ValueEstimationAgent):
 
     def getQValue(self, state, action):
         return self.computeQValueFromValues(state, action)
+
+
+class AsynchronousValueIterationAgent(ValueIterationAgent):
+    """
+        A ValueIterationAgent that updates the values in place
+        during each sweep, so states later in the sweep use the
+        values already updated in it.  Stops after iterations
+        sweeps or once a sweep changes no value by more than
+        tolerance.
+    """
+    def __init__(self, mdp, discount = 0.9, iterations = 1000, tolerance = 1e-5):
+        ValueIterationAgent.__init__(self, mdp, discount, iterations, tolerance)
+
+    def runValueIteration(self):
+        values, self.iterationsRun = self.compiled.asynchronousValueIteration(self.discount, self.iterations, self.tolerance)
+        return values
+
+class PrioritizedSweepingValueIterationAgent(ValueIterationAgent):
+    """
+        A ValueIterationAgent that backs up one state at a time,
+        always the one with the largest Bellman error, and only
+        re-checks the predecessors of the states it changes.
+        Stops once every error is at most tolerance, or after the
+        work of iterations full sweeps.
+    """
+    def __init__(self, mdp, discount = 0.9, iterations = 1000, tolerance = 1e-5):
+        ValueIterationAgent.__init__(self, mdp, discount, iterations, tolerance)
+
+    def runValueIteration(self):
+        maxBackups = self.iterations * len(self.compiled.states)
+        values, self.backups = self.compiled.prioritizedSweeping(self.discount, maxBackups, self.tolerance)
+        return values